@@ -0,0 +1,29 @@
+from webhooks.models.mailserver import MailServer
+from webhooks.utils.accounts import AccountIndex, read_export
+import json
+
+
+def test_account_index_lookups_follow_our_writes(tmp_path):
+    export = tmp_path / 'accounts.jsonl'
+    export.write_text('\n'.join(json.dumps(account) for account in [
+        { 'accountId': 1, 'username': 'Jane@example.com', 'billingCode': 'cust_1', 'account_status': 'active', 'cosProfile': [ { 'origin': 'domain', 'profile': [ { 'id': 7, 'name': 'email-basic.group', 'active': True } ] } ] },
+        { 'accountId': 2, 'username': 'john@example.com', 'billingCode': '', 'account_status': 'rstrBilling' }
+    ]))
+
+    index = AccountIndex(str(tmp_path / 'accounts.db')).open()
+    assert index.load(read_export(str(export))) == 2
+
+    assert index.by_username('JANE@example.com').cos_profile_id == 7
+    assert index.by_account_id(2).billing_code is None
+    assert [ account.username for account in index.by_billing_code('cust_1') ] == [ 'jane@example.com' ]
+
+    index.update('john@example.com', { 'billingCode': 'cust_1', 'account_status': 'active', 'disableQuotaCheck': 1 })
+    index.update('jane@example.com', { 'billingCode': '' })
+    assert [ account.username for account in index.by_billing_code('cust_1') ] == [ 'john@example.com' ]
+
+    # a re-created account keeps its username under a new accountId
+    index.observe(MailServer(accountId='3', username='jane@example.com', account_status='active', cosProfile=[]))
+    assert index.by_account_id(1) is None
+    assert index.by_username('jane@example.com').account_id == '3'
+
+    index.close()
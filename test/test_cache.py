@@ -0,0 +1,99 @@
+from webhooks.models.chargebee import Subscription
+from webhooks.models.mailserver import MailServer
+from webhooks.utils.cache import TTLCache, AccountCache, SubscriptionCache
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def mock_account():
+    return MailServer(**{
+        "accountId": "1001",
+        "username": "cb-test04@tasman-test.atmailcloud.com",
+        "account_status": "active",
+        "billingCode": "6oqNhUfNzph5iXb",
+        "firstName": "Test",
+        "mailUsedBytes": 10,
+        "fileUsedBytes": 20,
+        "cosProfile": [{
+            "origin": "domain",
+            "profile": [
+                { "id": 1, "name": "email-tasman-standard.group", "active": True },
+                { "id": 2, "name": "email-tasman-premium.group", "active": False }
+            ]
+        }]
+    })
+
+def test_ttl_cache_expires_entries(clock):
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    clock.now = 5
+    assert cache.get('a') is None
+    assert cache.stats().get('hits') == 1
+    assert cache.stats().get('misses') == 1
+    assert cache.stats().get('expirations') == 1
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=60, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.stats().get('evictions') == 1
+
+def test_account_cache_write_through(clock, mock_account):
+    cache = AccountCache(maxsize=10, ttl=60, slim=True, clock=clock)
+    cache.set_account(mock_account.username.upper(), mock_account)
+    cache.update_account(mock_account.username, { 'account_status': 'rstrBilling', 'cosProfileId': 2, 'disableQuotaCheck': 1 })
+    account = cache.get_account(mock_account.username)
+
+    assert account.account_status == 'rstrBilling'
+    assert account.disableQuotaCheck == '1'
+    assert next(profile for profile in account.cosProfile[0].profile if profile.active).id == 2
+    assert account.firstName is None
+
+def test_account_cache_drops_unknown_updates(clock, mock_account):
+    cache = AccountCache(maxsize=10, ttl=60, clock=clock)
+    cache.set_account(mock_account.username, mock_account)
+    cache.update_account(mock_account.username, { 'cosProfileId': 99 })
+
+    assert cache.get_account(mock_account.username) is None
+
+def test_subscription_cache_rejects_stale_versions(clock):
+    cache = SubscriptionCache(maxsize=10, ttl=60, clock=clock)
+    subscription = { "id": "16CRgJUfnWgue1sf", "customer_id": "6oqNhUfNzph5iXb", "object": "subscription" }
+    cache.set_subscriptions("msgco", "6oqNhUfNzph5iXb", [ Subscription(**subscription, status="active", resource_version=1700000002000) ])
+
+    assert not cache.observe("msgco", Subscription(**subscription, status="cancelled", resource_version=1700000001000))
+    assert len(cache.get_subscriptions("msgco", "6oqNhUfNzph5iXb", { 'status[is]': 'active' })) == 1
+
+    assert cache.observe("msgco", Subscription(**subscription, status="cancelled", resource_version=1700000003000))
+    assert cache.get_subscriptions("msgco", "6oqNhUfNzph5iXb", { 'status[is]': 'active' }) == []
+    assert cache.get_subscriptions("msgco", "6oqNhUfNzph5iXb", { 'plan_id[is]': 'x' }) is None
+
+def test_subscription_cache_keeps_tenants_apart(clock):
+    # the same customer id on two Chargebee sites is two different customers
+    cache = SubscriptionCache(maxsize=10, ttl=60, clock=clock)
+    subscription = { "id": "16CRgJUfnWgue1sf", "customer_id": "6oqNhUfNzph5iXb", "object": "subscription" }
+    cache.set_subscriptions("msgco", "6oqNhUfNzph5iXb", [ Subscription(**subscription, status="active") ])
+
+    assert cache.get_subscriptions("tasman", "6oqNhUfNzph5iXb") is None
+    assert not cache.observe("tasman", Subscription(**subscription, status="cancelled"))
+
+    cache.invalidate_customer("tasman", "6oqNhUfNzph5iXb")
+    assert [ sub.status for sub in cache.get_subscriptions("msgco", "6oqNhUfNzph5iXb") ] == [ "active" ]
@@ -0,0 +1,161 @@
+from contextlib import aclosing
+from webhooks.utils.clients import ChargebeeClient, ChargebeeGateway, MailServerClient
+from webhooks.utils.ratelimit import TokenBucket
+from webhooks.utils.timing import request_scope, request_timer
+import time, asyncio, threading, chargebee, pytest
+
+
+class Page(list):
+    def __init__(self, entries, next_offset):
+        super().__init__(entries)
+        self.next_offset = next_offset
+
+class Entry:
+    def __init__(self, **response):
+        self._response = response
+
+class PagedClient(ChargebeeClient):
+    def __init__(self, pages: int, page_size: int):
+        super().__init__('msgco-test', 'test_key', 1, page_size=page_size)
+        self.total = pages
+        self.offsets = []
+
+    async def call(self, func, params):
+        page = int(params.get('offset', 0))
+        self.offsets.append(page)
+        await asyncio.sleep(0)
+
+        subscriptions = [ Entry(subscription={ 'id': f'sub_{ page }_{ n }', 'customer_id': 'cust_1', 'status': 'active', 'object': 'subscription' }) for n in range(params['limit']) ]
+        return Page(subscriptions, str(page + 1) if page + 1 < self.total else None)
+
+def test_chargebee_iterator_follows_next_offset():
+    client = PagedClient(pages=3, page_size=2)
+
+    async def collect():
+        return [ subscription.id async for subscription in client.subscriptions({ 'customer_id[is]': 'cust_1' }) ]
+
+    assert asyncio.run(collect()) == [ 'sub_0_0', 'sub_0_1', 'sub_1_0', 'sub_1_1', 'sub_2_0', 'sub_2_1' ]
+    assert client.offsets == [ 0, 1, 2 ]
+
+def test_chargebee_iterator_stops_early_and_drops_the_prefetch():
+    client = PagedClient(pages=10, page_size=2)
+
+    async def first():
+        async with aclosing(client.subscriptions({ 'customer_id[is]': 'cust_1' })) as subscriptions:
+            async for subscription in subscriptions:
+                return subscription.id
+
+    assert asyncio.run(first()) == 'sub_0_0'
+    assert len(client.offsets) <= 2
+
+def test_chargebee_iterator_fetches_the_next_page_while_the_current_one_is_consumed():
+    client = PagedClient(pages=3, page_size=2)
+
+    async def first_page():
+        async with aclosing(client.pages(chargebee.Subscription.list, { 'customer_id[is]': 'cust_1' })) as pages:
+            async for page in pages:
+                await asyncio.sleep(0)
+                return list(client.offsets)
+
+    assert asyncio.run(first_page()) == [ 0, 1 ]
+
+def test_chargebee_gateway_keeps_one_client_per_site():
+    gateway = ChargebeeGateway(max_workers=1)
+    msgco, tasman = gateway.client('msgco-test', 'msgco_key'), gateway.client('tasman-test', 'tasman_key')
+
+    assert gateway.client('msgco-test', 'msgco_key') is msgco
+    assert (msgco.env.site, msgco.env.api_key) == ('msgco-test', 'msgco_key')
+    assert (tasman.env.site, tasman.env.api_key) == ('tasman-test', 'tasman_key')
+    asyncio.run(gateway.close())
+
+def test_chargebee_gateway_shuts_a_rotated_client_down_once_its_calls_finish():
+    gateway = ChargebeeGateway(max_workers=2)
+    release = threading.Event()
+
+    def slow_call(env=None):
+        release.wait(5)
+        return env.api_key
+
+    async def run():
+        old = gateway.client('msgco-test', 'old_key')
+        call = asyncio.ensure_future(old.send(slow_call))
+        await asyncio.sleep(0.05)
+
+        new = gateway.client('msgco-test', 'new_key')
+        assert new is not old and new.limiter is old.limiter
+        # still usable by the call holding it
+        old.executor.submit(lambda: None).result(timeout=1)
+
+        release.set()
+        assert await call == 'old_key'
+        return old
+
+    old = asyncio.run(run())
+
+    with pytest.raises(RuntimeError):
+        old.executor.submit(lambda: None)
+    asyncio.run(gateway.close())
+
+class RecordingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__('msgco-test', rate=1000, burst=5, reserve=0)
+        self.throttled = []
+
+    def throttle(self, retry_after: float):
+        self.throttled.append(retry_after)
+
+class RateLimitedClient(ChargebeeClient):
+    def __init__(self, headers):
+        super().__init__('msgco-test', 'test_key', 1, RecordingBucket(), throttle_retries=1, retry_after=60)
+        self.headers = headers
+        self.attempts = 0
+
+    async def send(self, func, *args, **kwargs):
+        self.attempts += 1
+        raise chargebee.APIError(429, { 'message': 'Sorry, access has been blocked temporarily due to request count exceeding acceptable limits.', 'error_code': 'api_request_limit_exceeded' }, self.headers)
+
+def test_chargebee_client_honours_retry_after_and_gives_up_after_its_retries():
+    client, fallback = RateLimitedClient({ 'Retry-After': '7' }), RateLimitedClient({})
+
+    for throttled in [ client, fallback ]:
+        with pytest.raises(chargebee.APIError):
+            asyncio.run(throttled.call(lambda: None))
+
+    assert (client.attempts, client.limiter.throttled) == (2, [ 7.0 ])
+    assert fallback.limiter.throttled == [ 60 ]
+
+def test_mailserver_client_pools_one_connection_per_host():
+    async def run():
+        client = MailServerClient(max_connections=3)
+        view, update = await client.client('https://mail.test/api/accounts/view'), await client.client('https://mail.test/api/accounts/update')
+        other = await client.client('https://mail.other/api/accounts/view')
+        await client.close()
+        reopened = await client.client('https://mail.test/api/accounts/view')
+        await client.close()
+        return view, update, other, reopened
+
+    view, update, other, reopened = asyncio.run(run())
+
+    assert view is update and other is not view
+    assert view.is_closed and reopened is not view
+
+def test_chargebee_calls_run_off_the_event_loop_with_the_callers_context():
+    client = ChargebeeClient('msgco-test', 'test_key', 2, TokenBucket('msgco-test', rate=1000, burst=5, reserve=0))
+    loop_thread = threading.current_thread().name
+
+    def blocking_call(id: str, env=None):
+        time.sleep(0.1)
+        return threading.current_thread().name, request_timer.get(), env.site
+
+    async def run():
+        with request_scope() as request:
+            started = time.perf_counter()
+            results = await asyncio.gather(client.call(blocking_call, 'cust_1'), client.call(blocking_call, 'cust_2'))
+            return request, results, time.perf_counter() - started
+
+    request, results, elapsed = asyncio.run(run())
+    client.close()
+
+    assert all(thread.startswith('chargebee-msgco-test') and thread != loop_thread for thread, _, _ in results)
+    assert all(timer is request and site == 'msgco-test' for _, timer, site in results)
+    assert elapsed < 0.19
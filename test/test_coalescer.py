@@ -0,0 +1,69 @@
+from webhooks.chargebee.v2.endpoints import management
+from webhooks.models.chargebee import ChargebeeWebhookPayload
+from webhooks.models.response import ResponseBody
+from webhooks.utils.coalescer import EventCoalescer
+import asyncio
+
+
+class Batches:
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        return [ ValueError(item) if item < 0 else item * 10 for item in items ]
+
+def test_coalescer_flushes_each_key_after_the_window():
+    batches = Batches()
+
+    async def run():
+        coalescer = EventCoalescer(batches, window=0.05, max_batch=10)
+        return await asyncio.gather(coalescer.submit('cust_1', 1), coalescer.submit('cust_1', 2), coalescer.submit('cust_2', 3), coalescer.submit('cust_1', 4))
+
+    assert asyncio.run(run()) == [ 10, 20, 30, 40 ]
+    assert sorted(batches.batches) == [ ('cust_1', [ 1, 2, 4 ]), ('cust_2', [ 3 ]) ]
+
+def test_coalescer_flushes_a_full_batch_without_waiting_for_the_window():
+    batches = Batches()
+
+    async def run():
+        coalescer = EventCoalescer(batches, window=60, max_batch=2)
+        return await asyncio.wait_for(asyncio.gather(coalescer.submit('cust_1', 1), coalescer.submit('cust_1', 2)), timeout=1)
+
+    assert asyncio.run(run()) == [ 10, 20 ]
+    assert batches.batches == [ ('cust_1', [ 1, 2 ]) ]
+
+def test_coalescer_hands_each_caller_its_own_result():
+    async def run():
+        coalescer = EventCoalescer(Batches(), window=0.01, max_batch=10)
+        ok = asyncio.ensure_future(coalescer.submit('cust_1', 1))
+        failed = asyncio.ensure_future(coalescer.submit('cust_1', -1))
+        await asyncio.wait([ ok, failed ])
+        return ok.result(), failed.exception()
+
+    ok, failed = asyncio.run(run())
+
+    assert ok == 10
+    assert isinstance(failed, ValueError)
+
+def subscription_changed(event_id: str, subscription_id: str):
+    return ChargebeeWebhookPayload(id=event_id, event_type='subscription_changed', webhook_status='scheduled', content={
+        'subscription': { 'id': subscription_id, 'customer_id': 'cust_1', 'status': 'active', 'object': 'subscription' },
+        'customer': { 'id': 'cust_1', 'email': 'jane@example.com' }
+    })
+
+def test_batch_only_drops_an_event_superseded_for_the_same_resource(monkeypatch):
+    dispatched = []
+
+    async def dispatch_event(secrets, cb_instance, payload):
+        dispatched.append(payload.id)
+        return ResponseBody(status_code=200, msg=payload.id, api_src='chargebee')
+
+    monkeypatch.setattr(management, 'dispatch_event', dispatch_event)
+    events = [ ({}, 'msgco-test', subscription_changed(*event)) for event in [ ('ev_1', 'sub_1'), ('ev_2', 'sub_2'), ('ev_3', 'sub_1') ] ]
+
+    results = asyncio.run(management.run_batch('msgco:cust_1', events))
+
+    assert dispatched == [ 'ev_2', 'ev_3' ]
+    assert results[0].msg.startswith('Coalesced Event - superseded')
+    assert [ result.msg for result in results[1:] ] == [ 'ev_2', 'ev_3' ]
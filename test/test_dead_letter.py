@@ -0,0 +1,62 @@
+from fastapi import HTTPException
+from webhooks.models.chargebee import ChargebeeWebhookPayload
+from webhooks.utils.dead_letter import DeadLetterStore
+from webhooks.utils.versions import VersionIndex
+from webhooks import replay
+from datetime import datetime, timezone
+import asyncio
+
+
+def event(id: str, event_type: str='subscription_changed', occurred_at: int=None):
+    # shaped like what the endpoint and the queue hand over: the parsed payload dumped back to JSON
+    return ChargebeeWebhookPayload(id=id, event_type=event_type, occurred_at=occurred_at, webhook_status='scheduled', content={}).model_dump(mode='json')
+
+def test_dead_letter_store_keeps_one_entry_per_event_and_filters(tmp_path):
+    store = DeadLetterStore(str(tmp_path / 'webhooks.db'))
+
+    store.add('msgco-test', event('ev_1', occurred_at=1700000000), 'mail server down', 502)
+    store.add('msgco-test', event('ev_1', occurred_at=1700000000), 'mail server down', 502, attempts=5, source='queue')
+    store.add('tasman', event('ev_2', 'customer_changed', 1600000000), 'timeout')
+    store.add('tasman', event('ev_3', 'customer_changed', 2000000000), 'timeout')
+    # no occurred_at: sorted by when it failed, i.e. now
+    store.add('tasman', event('ev_4', 'customer_changed'), 'timeout')
+
+    assert [ letter['event_id'] for letter in store.select() ] == [ 'ev_2', 'ev_1', 'ev_4', 'ev_3' ]
+    assert [ letter['attempts'] for letter in store.select(tenant='msgco') ] == [ 6 ]
+    assert [ letter['event_id'] for letter in store.select(event_types=[ 'customer_changed' ]) ] == [ 'ev_2', 'ev_4', 'ev_3' ]
+    assert store.select(until=0) == []
+
+    assert store.resolve('tasman', 'ev_2', 'Ok') == 1
+    assert store.stats() == { 'dead': 3, 'replayed': 1 }
+    store.close()
+
+def test_replay_marks_each_event_with_its_outcome(tmp_path, monkeypatch):
+    store = DeadLetterStore(str(tmp_path / 'webhooks.db'))
+    for n in range(6):
+        store.add('msgco-test', event(f'ev_{ n }'), 'mail server down', 502)
+
+    async def process_event(app_secrets, cb_instance, content):
+        await asyncio.sleep(0)
+        if content['id'] == 'ev_3':
+            raise HTTPException(status_code=502, detail='still down')
+
+    monkeypatch.setattr(replay, 'process_event', process_event)
+    stats = asyncio.run(replay.Replayer(None, store, concurrency=3).run(store.select()))
+
+    assert stats == { 'processed': 6, 'replayed': 5, 'failed': 1 }
+    assert [ (letter['event_id'], letter['attempts']) for letter in store.select() ] == [ ('ev_3', 2) ]
+    store.close()
+
+def test_replay_checks_versions_the_server_persisted(tmp_path):
+    path = str(tmp_path / 'webhooks.db')
+    older, newer = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+    server = VersionIndex(path=path).open()
+    server.record('subscription', 'msgco:sub_1', newer)
+    server.close()
+
+    # the replay command runs in its own process, starting with nothing in memory
+    replayer = VersionIndex(path=path).open()
+    assert replayer.is_stale('subscription', 'msgco:sub_1', older)
+    assert not replayer.is_stale('subscription', 'msgco:sub_1', newer)
+    replayer.close()
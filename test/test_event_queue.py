@@ -0,0 +1,96 @@
+from fastapi import HTTPException
+from webhooks.chargebee.v2.endpoints.management import process_event
+from webhooks.utils import event_queue as event_queue_module
+from webhooks.utils.dead_letter import DeadLetterStore
+from webhooks.utils.event_queue import EventQueue, EventWorkers
+import time, asyncio
+
+
+def event(id: str, event_type: str='subscription_changed'):
+    return { 'id': id, 'event_type': event_type, 'webhook_status': 'scheduled', 'content': {} }
+
+def test_queue_claims_pending_events_in_order(tmp_path):
+    queue = EventQueue(str(tmp_path / 'webhooks.db'))
+    first, second = queue.enqueue('msgco-test', event('ev_1')), queue.enqueue('msgco-test', event('ev_2'))
+
+    claimed = queue.claim(limit=10)
+
+    assert [ (item['id'], item['payload']['id'], item['attempts']) for item in claimed ] == [ (first, 'ev_1', 1), (second, 'ev_2', 1) ]
+    assert queue.claim() == []
+
+    queue.complete(first)
+    assert queue.stats() == { 'done': 1, 'processing': 1 }
+    queue.close()
+
+def test_queue_recovers_events_interrupted_by_a_restart(tmp_path):
+    queue = EventQueue(str(tmp_path / 'webhooks.db'))
+    queue.enqueue('msgco-test', event('ev_1'))
+    queue.claim()
+    queue.close()
+
+    queue.open()
+
+    assert queue.stats() == { 'pending': 1 }
+    assert queue.claim()[0]['attempts'] == 2
+    queue.close()
+
+def test_queue_backs_off_between_attempts_up_to_a_cap(tmp_path):
+    queue = EventQueue(str(tmp_path / 'webhooks.db'), max_attempts=5)
+    id = queue.enqueue('msgco-test', event('ev_1'))
+
+    def available_in():
+        return queue.conn.execute('SELECT available_at FROM events WHERE id = ?', (id,)).fetchone()[0] - time.time()
+
+    assert queue.fail(id, 1, 'mail server down') == 'pending'
+    assert 1 < available_in() <= 2
+    assert queue.claim() == []
+
+    assert queue.fail(id, 4, 'mail server down') == 'pending'
+    assert 15 < available_in() <= 16
+
+    # 2 ** 20 seconds would be twelve days
+    queue.max_attempts = 30
+    assert queue.fail(id, 20, 'mail server down') == 'pending'
+    assert 299 < available_in() <= 300
+
+    assert queue.fail(id, 30, 'mail server down') == 'failed'
+    queue.close()
+
+async def drain(queue: EventQueue, process, done):
+    workers = EventWorkers(queue, process, concurrency=1, poll_interval=0.01)
+    workers.start()
+
+    try:
+        for _ in range(200):
+            if done():
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await workers.stop()
+
+def test_workers_complete_events_rejected_with_a_client_error(tmp_path):
+    queue = EventQueue(str(tmp_path / 'webhooks.db'))
+    queue.enqueue('msgco-test', event('ev_1', 'coupon_created'))
+    app_secrets = { 'msgco': { 'api_key': 'test_key', 'wh_username': 'user', 'wh_password': 'pass' }, 'mailserver': {} }
+
+    # an unhandled event type is a 400: retrying won't change that, so it is done rather than sent back to the queue
+    asyncio.run(drain(queue, lambda cb_instance, content: process_event(app_secrets, cb_instance, content), lambda: queue.stats() != { 'pending': 1 }))
+
+    assert queue.stats() == { 'done': 1 }
+    queue.close()
+
+def test_workers_dead_letter_events_that_run_out_of_attempts(tmp_path, monkeypatch):
+    queue = EventQueue(str(tmp_path / 'webhooks.db'), max_attempts=1)
+    dead_letters = DeadLetterStore(str(tmp_path / 'webhooks.db'))
+    monkeypatch.setattr(event_queue_module, 'dead_letter_store', dead_letters)
+    queue.enqueue('msgco-test', event('ev_1'))
+
+    async def process(cb_instance, content):
+        raise HTTPException(status_code=502, detail='mail server down')
+
+    asyncio.run(drain(queue, process, lambda: queue.stats() == { 'failed': 1 }))
+
+    assert queue.stats() == { 'failed': 1 }
+    assert [ (letter['event_id'], letter['attempts']) for letter in dead_letters.select() ] == [ ('ev_1', 1) ]
+    dead_letters.close()
+    queue.close()
@@ -0,0 +1,37 @@
+from webhooks.utils.idempotency import IdempotencyStore
+
+
+def test_idempotency_claims_an_event_once():
+    store = IdempotencyStore(path=None)
+
+    assert store.begin('msgco-test', 'ev_1') is None
+    assert store.begin('msgco', 'ev_1') == { 'status': 'in_flight', 'result': None }
+
+    store.finish('msgco-test', 'ev_1', 'Response(200) Ok')
+    assert store.begin('msgco-test', 'ev_1') == { 'status': 'done', 'result': 'Response(200) Ok' }
+
+    assert store.begin('msgco-test', None) is None
+    assert store.begin('tasman-test', 'ev_1') is None
+
+def test_idempotency_releases_a_failed_event_for_the_retry():
+    store = IdempotencyStore(path=None)
+
+    store.begin('msgco-test', 'ev_1')
+    store.abandon('msgco-test', 'ev_1')
+
+    assert store.begin('msgco-test', 'ev_1') is None
+
+def test_idempotency_survives_a_restart_with_sqlite(tmp_path):
+    path = str(tmp_path / 'idempotency.db')
+    store = IdempotencyStore(path=path).open()
+    store.begin('msgco-test', 'ev_1')
+    store.finish('msgco-test', 'ev_1', 'Response(200) Ok')
+    store.begin('msgco-test', 'ev_2')
+    store.abandon('msgco-test', 'ev_2')
+    store.close()
+
+    restarted = IdempotencyStore(path=path).open()
+
+    assert restarted.begin('msgco-test', 'ev_1') == { 'status': 'done', 'result': 'Response(200) Ok' }
+    assert restarted.begin('msgco-test', 'ev_2') is None
+    restarted.close()
@@ -0,0 +1,38 @@
+from webhooks.utils.log import DeferredQueueHandler, JsonFormatter
+import sys, json, queue, logging
+
+
+def record(msg, *args, **extra):
+    record = logging.LogRecord('webhooks', logging.DEBUG, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_json_formatter_redacts_secrets():
+    formatter = JsonFormatter()
+    entry = json.loads(formatter.format(record('Secrets: %s | Authorization: %s', { 'api_key': 'live_abc', 'wh_password': 'hunter2', 'username': 'admin' }, 'Basic dTpwdw==', response={ 'password': 'hunter2', 'status_code': 200 })))
+
+    assert 'live_abc' not in entry['message'] and 'hunter2' not in entry['message'] and 'dTpwdw==' not in entry['message']
+    assert "'username': 'admin'" in entry['message']
+    assert entry['response'] == { 'password': '***', 'status_code': 200 }
+
+def test_json_formatter_caps_large_objects():
+    formatter = JsonFormatter(max_chars=100)
+    entry = json.loads(formatter.format(record('Content: %s', { 'content': 'x' * 1000 })))
+
+    assert len(entry['message']) < 130 and entry['message'].endswith('chars)')
+
+def test_queued_records_keep_the_arguments_as_they_were_when_logged():
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    content = { 'status': 'active', 'api_key': 'live_abc' }
+
+    try:
+        raise ValueError('boom')
+    except (ValueError):
+        handler.handle(logging.LogRecord('webhooks', logging.ERROR, __file__, 1, 'Content: %s', (content,), sys.exc_info()))
+    content['status'] = 'cancelled'
+
+    entry = json.loads(JsonFormatter().format(records.get_nowait()))
+
+    assert "'status': 'active'" in entry['message'] and 'live_abc' not in entry['message']
+    assert 'ValueError: boom' in entry['exc']
@@ -0,0 +1,21 @@
+from webhooks.utils.metrics import MetricsRegistry
+
+
+def test_metrics_render_prometheus_text():
+    registry = MetricsRegistry()
+    events = registry.counter('events_total', 'Events', [ 'tenant', 'event_type' ])
+    latency = registry.histogram('latency_seconds', 'Latency', [ 'upstream' ], buckets=[ 0.1, 1.0 ])
+
+    child = events.labels('msgco', 'customer_created')
+    child.inc()
+    events.labels('msgco', 'customer_created').inc()
+    latency.labels('mailserver').observe(0.1)
+    latency.labels('mailserver').observe(5)
+
+    text = registry.render()
+
+    assert events.labels('msgco', 'customer_created') is child
+    assert 'events_total{tenant="msgco",event_type="customer_created"} 2.0' in text
+    assert 'latency_seconds_bucket{upstream="mailserver",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{upstream="mailserver",le="+Inf"} 2' in text
+    assert 'latency_seconds_count{upstream="mailserver"} 2' in text
@@ -0,0 +1,37 @@
+from webhooks.models.mailserver import AccountState, MailServer
+import pytest
+
+
+@pytest.fixture
+def mock_account():
+    return MailServer(**{
+        "accountId": "1001",
+        "username": "custom01@the-bryants.org",
+        "account_status": "active",
+        "billingCode": "169vzoUZw6qNv6vn",
+        "disableQuotaCheck": "1",
+        "cosProfile": [{
+            "origin": "domain",
+            "profile": [
+                { "id": 7, "name": "Kakadu-Plan-AV1", "active": True },
+                { "id": 8, "name": "Kakadu-Plan-BV1", "active": False }
+            ]
+        }]
+    })
+
+def test_account_state_diff_drops_unchanged_fields(mock_account):
+    state = AccountState().merge({ 'cosProfileId': 7, 'disableQuotaCheck': 1 }).merge({ 'account_status': 'active' })
+
+    assert state.diff(mock_account) == {}
+
+def test_account_state_diff_keeps_last_desired_value(mock_account):
+    state = AccountState().merge({ 'account_status': 'rstrBilling' }).merge({ 'cosProfileId': 8, 'disableQuotaCheck': 1 }).merge({ 'account_status': 'active' })
+
+    assert state.diff(mock_account) == { 'cosProfileId': 8 }
+
+def test_account_with_update_mirrors_cos_profile(mock_account):
+    account = mock_account.with_update({ 'cosProfileId': 8, 'billingCode': '' })
+
+    assert [ profile.active for profile in account.cosProfile[0].profile ] == [ False, True ]
+    assert account.billingCode == ''
+    assert mock_account.with_update({ 'cosProfileId': 99 }) is None
@@ -0,0 +1,26 @@
+from webhooks.models.chargebee import Subscription
+from webhooks.utils.plans import GB, PlanCatalog
+import pytest
+
+
+def subscription(*items):
+    return Subscription(id='sub_01', customer_id='cus_01', status='active', object='subscription', subscription_items=[
+        { 'item_price_id': item_price_id, 'item_type': item_type, 'quantity': 1, 'unit_price': 0, 'amount': 0, 'free_quantity': 0, 'object': 'subscription_item' }
+        for item_price_id, item_type in items
+    ])
+
+@pytest.fixture
+def catalog():
+    return PlanCatalog(path=None)
+
+def test_plan_catalog_classifies_msgco_plan(catalog):
+    plan = catalog.classify('msgco-test', subscription(('Plan-BV-AUD-Monthly', 'plan'), ('Extra-Storage-AUD', 'addon')))
+
+    assert (plan.is_email, plan.is_paid, plan.cos_profile, plan.storage) == (True, True, 'Kakadu-Plan-BV1', 15 * GB)
+
+def test_plan_catalog_derives_tasman_cos_profile(catalog):
+    plan = catalog.classify('tasman', subscription(('email-legacy-plus-AUD-Monthly', 'plan')))
+
+    assert (plan.cos_profile, plan.plan_family) == ('email-legacy-plus.group', 'email-tasman-legacy')
+    assert catalog.classify('tasman', subscription(('email-basic-AUD-Monthly', 'addon'))).is_email is False
+    assert catalog.tenant('tasman').memo['email-legacy-plus-AUD-Monthly'].cos_profile == 'email-legacy-plus.group'
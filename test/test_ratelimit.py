@@ -0,0 +1,40 @@
+from chargebee import APIError
+from webhooks.utils.clients import ChargebeeClient
+from webhooks.utils.ratelimit import BACKGROUND, INTERACTIVE, TokenBucket
+import asyncio
+
+
+def test_token_bucket_serves_interactive_calls_before_background():
+    async def run():
+        bucket = TokenBucket('msgco-test', rate=50, burst=2, reserve=1)
+        order = []
+
+        async def call(name: str, priority: int):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        await bucket.acquire(INTERACTIVE)
+        await bucket.acquire(INTERACTIVE)
+        await asyncio.gather(call('sweep', BACKGROUND), call('webhook', INTERACTIVE))
+
+        return order
+
+    assert asyncio.run(run()) == [ 'webhook', 'sweep' ]
+
+class ThrottledClient(ChargebeeClient):
+    def __init__(self):
+        super().__init__('msgco-test', 'test_key', 1, TokenBucket('msgco-test', rate=1000, burst=5, reserve=0))
+        self.attempts = 0
+
+    async def send(self, func, *args, **kwargs):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise APIError(429, { 'message': 'Sorry, access has been blocked temporarily due to request count exceeding acceptable limits.', 'error_code': 'api_request_limit_exceeded' }, { 'Retry-After': '0' })
+        return 'ok'
+
+def test_chargebee_client_waits_out_a_429_and_retries():
+    client = ThrottledClient()
+
+    assert asyncio.run(client.call(lambda: None)) == 'ok'
+    assert client.attempts == 2
+    assert client.limiter.stats()['blocked_for'] == 0
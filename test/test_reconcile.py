@@ -0,0 +1,83 @@
+from webhooks.models.chargebee import Customer, Subscription
+from webhooks.models.mailserver import MailServer
+from webhooks.utils.clients import ChargebeeClient
+from webhooks.reconcile import Checkpoint, Expected, Reconciler, account_changes, expected_state
+import asyncio, chargebee
+
+
+def subscription(id: str, status: str, item_price_id: str, due_invoices_count: int=0):
+    return Subscription(id=id, customer_id='cust_1', status=status, due_invoices_count=due_invoices_count, object='subscription', subscription_items=[
+        { 'item_price_id': item_price_id, 'item_type': 'plan', 'quantity': 1, 'unit_price': 500, 'amount': 500, 'free_quantity': 0, 'object': 'subscription_item' }
+    ])
+
+def account(status: str, billing_code: str=None):
+    return MailServer(accountId='1', username='jane@example.com', account_status=status, billingCode=billing_code, cosProfile=[ { 'origin': 'domain', 'profile': [
+        { 'id': 1, 'name': 'Kakadu-Plan-AV1', 'active': True },
+        { 'id': 2, 'name': 'Kakadu-Plan-CV1', 'active': False }
+    ] } ])
+
+def test_expected_state_follows_the_handler_rules():
+    customer = Customer(id='cust_1', email='jane@example.com')
+
+    msgco = expected_state('msgco', customer, [ subscription('sub_2', 'active', 'Plan-CV-AUD-Monthly'), subscription('sub_1', 'active', 'Plan-AV-AUD-Monthly') ])
+    assert msgco == Expected(( 'active', ), 'Kakadu-Plan-CV1', 'cust_1')
+    assert account_changes(msgco, account('rstrBilling')) == { 'account_status': 'active', 'billingCode': 'cust_1', 'cosProfileId': 2, 'disableQuotaCheck': 1 }
+
+    owing = expected_state('msgco', customer, [ subscription('sub_1', 'active', 'Plan-AV-AUD-Monthly', due_invoices_count=50) ])
+    assert account_changes(owing, account('active', 'cust_1')) == { 'account_status': 'rstrBilling' }
+    assert account_changes(owing, account('rstrFrozen', 'cust_1')) == {}
+
+    tasman = expected_state('tasman-test', customer, [ subscription('sub_1', 'cancelled', 'Email-Basic-AUD-Monthly') ])
+    assert tasman == Expected(( 'rstrBilling', 'rstrFrozen' ), 'email-basic.group', 'cust_1')
+
+class Page(list):
+    def __init__(self, entries, next_offset):
+        super().__init__(entries)
+        self.next_offset = next_offset
+
+class Entry:
+    def __init__(self, **response):
+        self._response = response
+
+class FakeChargebee(ChargebeeClient):
+    def __init__(self, customers: int, page_size: int):
+        super().__init__('msgco', 'test_key', 1, page_size=page_size)
+        self.customer_pages = [ [ Entry(customer={ 'id': f'cust_{ n }', 'email': f'user{ n }@example.com' }) for n in range(start, min(start + page_size, customers)) ] for start in range(0, customers, page_size) ]
+
+    async def call(self, func, params):
+        if func is not chargebee.Customer.list:
+            return Page([], None)
+
+        page = int(params.get('offset', 0))
+        return Page(self.customer_pages[page], str(page + 1) if page + 1 < len(self.customer_pages) else None)
+
+class FlakyReconciler(Reconciler):
+    def __init__(self, *args, fail_on: str=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail_on = fail_on
+        self.seen = []
+
+    async def reconcile_customer(self, content, subscriptions):
+        if content['id'] == self.fail_on:
+            raise KeyboardInterrupt
+        self.seen.append(content['id'])
+        return 'unchanged'
+
+def test_reconcile_resumes_from_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'reconcile.json'))
+    secrets = { 'chargebee': FakeChargebee(customers=25, page_size=10) }
+
+    first = FlakyReconciler('msgco', secrets, checkpoint, concurrency=1, page_size=10, fail_on='cust_15')
+    try:
+        asyncio.run(first.run())
+    except (KeyboardInterrupt):
+        pass
+
+    assert checkpoint.load('msgco')['offset'] == '1'
+
+    second = FlakyReconciler('msgco', secrets, checkpoint, concurrency=4, page_size=10)
+    stats = asyncio.run(second.run())
+
+    assert sorted(second.seen) == sorted(f'cust_{ n }' for n in range(10, 25))
+    assert stats['processed'] == 25
+    assert checkpoint.load('msgco') == {}
@@ -0,0 +1,38 @@
+from fastapi.testclient import TestClient
+from webhooks.main import app
+from webhooks.chargebee.v2.endpoints.management import handle_payment_succeeded, handle_subscription_changed
+from webhooks.utils.registry import EventRegistry, event_registry
+
+
+client = TestClient(app)
+
+def test_registry_resolves_handlers_per_tenant():
+    registry = EventRegistry(( 'msgco', 'tasman' ))
+    handler = registry.register('subscription_changed')(lambda: None)
+    registry.register('payment_succeeded', tenants=[ 'msgco' ])(handler)
+
+    assert registry.resolve('tasman-test', 'subscription_changed') == (handler, None)
+    assert registry.resolve('msgco', 'payment_succeeded') == (handler, None)
+    assert registry.resolve('tasman', 'payment_succeeded') == (None, None)
+    assert registry.resolve('unknown', 'subscription_changed') == (None, None)
+
+def test_registry_ignores_events_per_tenant():
+    registry = EventRegistry(( 'msgco', 'tasman' ))
+    registry.ignore([ 'tasman' ], [ 'invoice_updated' ], 'Ignored Event')
+
+    assert registry.resolve('tasman-test', 'invoice_updated') == (None, 'Ignored Event')
+    assert registry.resolve('msgco-test', 'invoice_updated') == (None, None)
+
+def test_handlers_are_registered_for_their_tenants():
+    assert event_registry.resolve('msgco-test', 'subscription_changed') == (handle_subscription_changed, None)
+    assert event_registry.resolve('msgco', 'payment_succeeded') == (handle_payment_succeeded, None)
+    assert event_registry.resolve('tasman', 'payment_succeeded')[1].startswith('Ignored Event')
+
+def test_unknown_event_types_are_rejected():
+    app.state.secrets = { 'msgco': { 'api_key': 'test_key', 'wh_username': 'user', 'wh_password': 'pass' }, 'mailserver': {} }
+    payload = { 'id': 'ev_registry_1', 'event_type': 'coupon_created', 'webhook_status': 'scheduled', 'content': {} }
+
+    response = client.post('/webhooks/chargebee/v2/mail-service/management/?cb_instance=msgco-test', json=payload, headers={ 'Authorization': 'Basic test_token', 'User-Agent': 'ChargeBee' })
+
+    assert response.status_code == 400
+    assert 'Unhandled Event Type' in response.json()['detail']
@@ -0,0 +1,57 @@
+from webhooks.utils.clients import MailServerClient
+from webhooks.utils.resilience import CircuitBreaker, CircuitOpenError
+import asyncio, httpx, pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_circuit_breaker_opens_fails_fast_and_recovers():
+    clock = Clock()
+    breaker = CircuitBreaker('mailserver', 'mail.test', failure_threshold=2, reset_timeout=30, clock=clock)
+    changes = []
+    breaker.on_change(lambda breaker, previous, state: changes.append(state))
+
+    breaker.allow()
+    breaker.failure()
+    breaker.allow()
+    breaker.failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    clock.now = 31
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.success()
+
+    assert changes == [ 'open', 'half_open', 'closed' ]
+
+def test_mailserver_retries_views_but_not_updates():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(503) if len(calls) == 1 else httpx.Response(200, json={ 'status': 'success' })
+
+    async def run():
+        client = MailServerClient(retries=2, backoff_base=0)
+        client.clients['mail.test'] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        view = await client.get('https://mail.test/accounts/view')
+        calls.clear()
+        update = await client.post('https://mail.test/accounts/update')
+        await client.close()
+
+        return view, update
+
+    view, update = asyncio.run(run())
+
+    assert view.status_code == 200
+    assert update.status_code == 503
+    assert calls == [ 'POST' ]
@@ -0,0 +1,52 @@
+from webhooks.utils.scheduler import KeyedScheduler
+import asyncio
+
+
+def test_scheduler_runs_one_keys_work_in_arrival_order():
+    scheduler = KeyedScheduler()
+    order = []
+
+    async def work(name: str, delay: float):
+        order.append(f'{ name } start')
+        await asyncio.sleep(delay)
+        order.append(f'{ name } end')
+
+    async def run():
+        await asyncio.gather(*[ scheduler.run('msgco:cust_1', work, f'event { n }', 0.03 - n * 0.01) for n in range(3) ])
+
+    asyncio.run(run())
+
+    assert order == [ 'event 0 start', 'event 0 end', 'event 1 start', 'event 1 end', 'event 2 start', 'event 2 end' ]
+
+def test_scheduler_runs_different_keys_concurrently():
+    scheduler = KeyedScheduler()
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def run():
+        await asyncio.gather(*[ scheduler.run(f'msgco:cust_{ n }', work) for n in range(5) ])
+
+    asyncio.run(run())
+
+    assert peak == 5
+
+def test_scheduler_forgets_idle_keys():
+    scheduler = KeyedScheduler()
+
+    async def run():
+        async with scheduler.slot('msgco:cust_1'):
+            waiting = asyncio.ensure_future(scheduler.run('msgco:cust_1', asyncio.sleep, 0))
+            await asyncio.sleep(0)
+            depth = scheduler.depth('msgco:cust_1')
+        await waiting
+        return depth
+
+    assert asyncio.run(run()) == 2
+    assert scheduler.locks == {} and scheduler.depths == {}
+    assert scheduler.stats()['max_depth_seen'] == 2
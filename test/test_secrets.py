@@ -0,0 +1,42 @@
+from webhooks.utils.secrets import SecretsProvider, basic_authorization
+import asyncio, pytest
+
+
+class RotatingBackend:
+    def __init__(self):
+        self.password = 'first'
+        self.fail = False
+
+    def fetch(self):
+        if self.fail:
+            raise ConnectionError('secrets manager unavailable')
+
+        return {
+            'MSGCO_API_KEY': 'live_msgco', 'MSGCO_WEBHOOK_USERNAME': 'chargebee', 'MSGCO_WEBHOOK_PASSWORD': self.password,
+            'TASMAN_API_KEY': 'live_tasman', 'TASMAN_WEBHOOK_USERNAME': 'chargebee', 'TASMAN_WEBHOOK_PASSWORD': self.password,
+            'MAILSERVER_URL': 'https://[platform].mail.example', 'MAILSERVER_USERNAME': 'admin', 'MAILSERVER_PASSWORD': 'secret'
+        }
+
+def test_secrets_provider_rotates_and_serves_stale_on_failure():
+    backend = RotatingBackend()
+    provider = SecretsProvider(backend)
+
+    asyncio.run(provider.refresh())
+    assert provider.tenant('msgco-test')['wh_authorization'] == basic_authorization('chargebee', 'first')
+    assert provider.tenant('msgco')['api_url'] == 'https://pc5.mail.example'
+
+    backend.password = 'second'
+    asyncio.run(provider.refresh())
+    assert provider.tenant('tasman')['wh_authorization'] == basic_authorization('chargebee', 'second')
+
+    backend.fail = True
+    asyncio.run(provider.refresh())
+    assert provider.failures == 1
+    assert provider.tenant('tasman')['wh_authorization'] == basic_authorization('chargebee', 'second')
+
+def test_secrets_provider_fails_without_a_first_snapshot():
+    backend = RotatingBackend()
+    backend.fail = True
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(SecretsProvider(backend).refresh())
@@ -0,0 +1,41 @@
+from webhooks.utils.helpers import res_body, timer
+from webhooks.utils.timing import request_scope, request_timer, timed
+import asyncio, contextvars
+
+
+def test_concurrent_requests_keep_their_own_timings():
+    async def request(event_type, delay):
+        with request_scope(event_type) as timer:
+            with timed('mailserver'):
+                await asyncio.sleep(delay)
+            return request_timer.get() is timer, timer
+
+    async def main():
+        return await asyncio.gather(request('customer_created', 0.05), request('invoice_updated', 0.01))
+
+    (slow_is_own, slow), (fast_is_own, fast) = asyncio.run(main())
+
+    assert slow_is_own and fast_is_own
+    assert (slow.event_type, fast.event_type) == ('customer_created', 'invoice_updated')
+    assert slow.phases['mailserver'] > fast.phases['mailserver']
+    assert slow.server_timing().startswith('mailserver;dur=')
+
+def test_timer_outside_a_request_leaves_the_context_alone():
+    def unscoped():
+        timer(event='customer_created', timer='start', tenant='msgco')
+        response = res_body(200, 'Ok')
+        return request_timer.get(), response
+
+    leaked, response = contextvars.copy_context().run(unscoped)
+
+    assert leaked is None
+    assert response.startswith('Response(200) Ok: Ok')
+
+def test_timer_names_the_event_only_when_told_to():
+    # the endpoint starts the clock before auth and names the event once it has been authorized and resolved
+    with request_scope() as request:
+        timer(timer='start')
+        assert (request.event_type, request.tenant, list(request.phases)) == (None, None, [ 'parse' ])
+
+        timer(event='customer_created', tenant='msgco')
+        assert (request.event_type, request.tenant) == ('customer_created', 'msgco')
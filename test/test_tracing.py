@@ -0,0 +1,41 @@
+from webhooks.utils.tracing import Tracer
+import asyncio
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+    def close(self):
+        pass
+
+def test_spans_link_children_to_their_parent():
+    tracer = Tracer(MemoryExporter(), sample_rate=1.0)
+
+    @tracer.traced()
+    async def handle_customer_changed():
+        with tracer.span('chargebee.Subscription.list', resource_id='cus_01'):
+            pass
+
+    async def main():
+        with tracer.span('chargebee_webhook', tenant='msgco'):
+            await handle_customer_changed()
+
+    asyncio.run(main())
+    child, handler, root = tracer.exporter.spans
+
+    assert [ span['name'] for span in (child, handler, root) ] == [ 'chargebee.Subscription.list', 'handle_customer_changed', 'chargebee_webhook' ]
+    assert child['parent_id'] == handler['span_id'] and handler['parent_id'] == root['span_id'] and root['parent_id'] is None
+    assert len({ span['trace_id'] for span in (child, handler, root) }) == 1
+
+def test_unsampled_traces_export_nothing():
+    tracer = Tracer(MemoryExporter(), sample_rate=0.0)
+
+    with tracer.span('chargebee_webhook'):
+        with tracer.span('mailserver_api') as span:
+            span.set_attribute('action', 'view')
+
+    assert tracer.exporter.spans == []
@@ -0,0 +1,42 @@
+from webhooks.chargebee.v2.endpoints.management import stale_event
+from webhooks.utils.versions import VersionIndex, version_index
+from datetime import datetime, timezone
+
+
+def test_version_index_drops_strictly_older_versions_only():
+    index = VersionIndex(path=None)
+    older, current = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+    assert not index.is_stale('subscription', 'msgco:sub_1', older)
+    index.record('subscription', 'msgco:sub_1', current)
+
+    assert index.is_stale('subscription', 'msgco:sub_1', older)
+    assert not index.is_stale('subscription', 'msgco:sub_1', current)
+    assert not index.is_stale('subscription', 'msgco:sub_2', older)
+    assert not index.is_stale('subscription', 'msgco:sub_1', None)
+
+    # recording an older version never moves the index backwards
+    index.record('subscription', 'msgco:sub_1', older)
+    assert index.is_stale('subscription', 'msgco:sub_1', older)
+
+def subscription(resource_version: int):
+    return { 'subscription': { 'id': 'sub_versions', 'customer_id': 'cust_1', 'status': 'active', 'resource_version': resource_version, 'object': 'subscription' } }
+
+def test_out_of_order_events_are_ignored():
+    dropped = version_index.dropped
+
+    assert stale_event('msgco-test', 'subscription_changed', subscription(1700000002000)) is None
+    assert stale_event('msgco-test', 'subscription_changed', subscription(1700000002000)) is None
+    assert stale_event('msgco-test', 'subscription_changed', subscription(1700000001000)) == 'subscription sub_versions has a newer version'
+    assert version_index.dropped == dropped + 1
+
+def test_an_older_embedded_snapshot_does_not_drop_the_event():
+    # a customer_changed has moved the customer on; a new subscription still carries the customer as it was before that
+    assert stale_event('tasman-test', 'customer_changed', { 'customer': { 'id': 'cust_2', 'resource_version': 1700000005000 } }) is None
+    assert stale_event('tasman-test', 'subscription_created', {
+        'subscription': { 'id': 'sub_new', 'customer_id': 'cust_2', 'resource_version': 1700000006000 },
+        'customer': { 'id': 'cust_2', 'resource_version': 1700000004000 }
+    }) is None
+
+    # and the older snapshot is not recorded over the newer one
+    assert version_index.is_stale('customer', 'tasman:cust_2', datetime.fromtimestamp(1700000004.5, timezone.utc))
@@ -0,0 +1,127 @@
+from fastapi.testclient import TestClient
+from webhooks.chargebee.v2.endpoints import management
+from webhooks.main import app
+from webhooks.models.chargebee import Subscription
+from webhooks.utils.cache import subscription_cache
+from webhooks.utils.clients import mailserver_client
+from webhooks.utils.dead_letter import dead_letter_store
+from webhooks.utils.metrics import webhook_events
+import httpx, pytest
+
+
+client = TestClient(app)
+
+SECRETS = {
+    'tasman': { 'api_key': 'test_key', 'wh_username': 'user', 'wh_password': 'pass' },
+    'msgco': { 'api_key': 'test_key', 'wh_username': 'user', 'wh_password': 'pass' },
+    'mailserver': { 'api_url': 'https://mail.test/api', 'username': 'admin', 'password': 'secret' }
+}
+
+
+class MailServerStub:
+    def __init__(self):
+        self.requests = []
+        self.update_status = 200
+        self.account = { 'accountId': '1', 'account_status': 'active', 'billingCode': 'old_code', 'mailUsedBytes': 0, 'fileUsedBytes': 0, 'cosProfile': [ { 'origin': 'domain', 'profile': [ { 'id': 1, 'name': 'Basic', 'active': True } ] } ] }
+
+    def __call__(self, request: httpx.Request):
+        self.requests.append((request.method, request.url.path.rsplit('/', 1)[-1], dict(request.url.params)))
+
+        if request.method == 'GET':
+            username = request.url.params.get('username')
+            return httpx.Response(200, json={ 'status': 'success', 'response': { 'results': { **self.account, 'username': username } } })
+
+        if self.update_status != 200:
+            return httpx.Response(self.update_status, json={ 'status': 'error', 'response': { 'message': 'mail server unavailable' } })
+
+        return httpx.Response(200, json={ 'status': 'success', 'response': { 'results': { 'updated': True } } })
+
+@pytest.fixture
+def mailserver():
+    stub = MailServerStub()
+    app.state.secrets = SECRETS
+    mailserver_client.clients['mail.test'] = httpx.AsyncClient(transport=httpx.MockTransport(stub))
+    yield stub
+    mailserver_client.clients.pop('mail.test', None)
+
+@pytest.fixture
+def dead_letters(tmp_path):
+    dead_letter_store.close()
+    dead_letter_store.path = str(tmp_path / 'webhooks.db')
+    yield dead_letter_store.open()
+    dead_letter_store.close()
+
+def customer_changed(event_id: str, email: str):
+    return { 'id': event_id, 'occurred_at': 1700000000, 'event_type': 'customer_changed', 'webhook_status': 'not_configured', 'content': { 'customer': { 'id': 'cust_1', 'email': email } } }
+
+def post(payload):
+    return client.post('/webhooks/chargebee/v2/mail-service/management/?cb_instance=tasman-test', json=payload, headers={ 'Authorization': 'Basic test_token', 'User-Agent': 'ChargeBee' })
+
+def test_webhook_is_processed_and_answered(mailserver, dead_letters):
+    response = post(customer_changed('ev_webhook_1', 'webhook1@example.com'))
+
+    assert response.status_code == 200
+    assert 'Update Success' in response.json()
+    assert dead_letters.stats() == {}
+
+def test_failed_webhook_is_dead_lettered_until_a_retry_succeeds(mailserver, dead_letters):
+    mailserver.update_status = 500
+    assert post(customer_changed('ev_webhook_2', 'webhook2@example.com')).status_code == 500
+    assert [ letter['event_id'] for letter in dead_letters.select() ] == [ 'ev_webhook_2' ]
+
+    mailserver.update_status = 200
+    assert post(customer_changed('ev_webhook_2', 'webhook2@example.com')).status_code == 200
+    assert dead_letters.stats() == { 'replayed': 1 }
+
+def test_redelivered_webhook_is_answered_from_the_first_response(mailserver, dead_letters):
+    first = post(customer_changed('ev_webhook_3', 'webhook3@example.com'))
+    calls = len(mailserver.requests)
+    second = post(customer_changed('ev_webhook_3', 'webhook3@example.com'))
+
+    assert first.status_code == second.status_code == 200
+    assert second.json().startswith('Response(200) Ok: Duplicate Event `ev_webhook_3` (done)')
+    assert first.json() in second.json()
+    assert len(mailserver.requests) == calls
+
+def test_unhandled_errors_are_counted_as_500s(mailserver, dead_letters, monkeypatch):
+    async def run_event(secrets, cb_instance, payload):
+        raise RuntimeError('handler bug')
+
+    monkeypatch.setattr(management, 'run_event', run_event)
+    errors = webhook_events.labels('http', 'tasman', 'customer_changed', 500)
+    before = errors.value
+
+    response = TestClient(app, raise_server_exceptions=False).post(
+        '/webhooks/chargebee/v2/mail-service/management/?cb_instance=tasman-test', json=customer_changed('ev_webhook_4', 'webhook4@example.com'), headers={ 'Authorization': 'Basic test_token', 'User-Agent': 'ChargeBee' }
+    )
+
+    assert response.status_code == 500
+    assert errors.value == before + 1
+    assert [ letter['event_id'] for letter in dead_letters.select() ] == [ 'ev_webhook_4' ]
+
+def test_one_event_reads_the_account_once_and_writes_it_once(mailserver, dead_letters, monkeypatch):
+    # the handler views the account twice and updates it twice: the view is memoized and, with deferred writes on, both updates go out as one write
+    monkeypatch.setenv('MAILSERVER_DEFER_WRITES', 'true')
+    subscription = { 'id': 'sub_memo', 'customer_id': 'cust_memo', 'status': 'active', 'object': 'subscription', 'subscription_items': [
+        { 'item_price_id': 'email-tasman-standard-v1-NZD-Monthly', 'item_type': 'plan', 'quantity': 1, 'unit_price': 995, 'amount': 995, 'free_quantity': 0, 'object': 'subscription_item' }
+    ] }
+    subscription_cache.set_subscriptions('tasman', 'cust_memo', [ Subscription(**subscription) ])
+    mailserver.account = { **mailserver.account, 'account_status': 'rstrBilling', 'cosProfile': [ { 'origin': 'domain', 'profile': [
+        { 'id': 1, 'name': 'Basic', 'active': True }, { 'id': 2, 'name': 'email-tasman-standard-v1.group', 'active': False }
+    ] } ] }
+
+    response = post({ 'id': 'ev_webhook_5', 'event_type': 'subscription_changed', 'webhook_status': 'scheduled', 'content': { 'subscription': subscription, 'customer': { 'id': 'cust_memo', 'email': 'webhook5@example.com' } } })
+
+    assert response.status_code == 200
+    assert [ (method, action) for method, action, _ in mailserver.requests ] == [ ('GET', 'view'), ('POST', 'update') ]
+    assert { k: v for k, v in mailserver.requests[1][2].items() if k != 'username' } == { 'cosProfileId': '2', 'disableQuotaCheck': '1', 'account_status': 'active' }
+
+def test_rejected_webhooks_are_counted_without_their_claimed_labels(mailserver, dead_letters):
+    unknown = { status: webhook_events.labels('http', 'unknown', 'unknown', status) for status in [ 400, 422 ] }
+    before = { status: counter.value for status, counter in unknown.items() }
+
+    assert post({ 'id': 'ev_webhook_6', 'event_type': 'made_up_event', 'webhook_status': 'scheduled', 'content': {} }).status_code == 400
+    assert post({ 'id': 'ev_webhook_7', 'event_type': 'made_up_event' }).status_code == 422
+
+    assert { status: counter.value - before[status] for status, counter in unknown.items() } == { 400: 1, 422: 1 }
+    assert not any('made_up_event' in labels for labels in webhook_events.children)
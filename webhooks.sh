@@ -42,5 +42,5 @@ if [ "$test_mode" != true ]; then
 else
   echo -e "Running Tests...\n"
   export TEST_MODE=true
-  exec `which python || which python3` -m pytest ./test/test_main.py ./test/test_chargebee.py -W ignore::DeprecationWarning
+  exec `which python || which python3` -m pytest ./test/test_main.py ./test/test_chargebee.py ./test/test_cache.py ./test/test_models.py ./test/test_plans.py ./test/test_timing.py ./test/test_metrics.py ./test/test_tracing.py ./test/test_log.py ./test/test_secrets.py ./test/test_reconcile.py ./test/test_clients.py ./test/test_accounts.py ./test/test_resilience.py ./test/test_ratelimit.py ./test/test_dead_letter.py ./test/test_webhook.py ./test/test_coalescer.py ./test/test_registry.py ./test/test_event_queue.py ./test/test_idempotency.py ./test/test_scheduler.py ./test/test_versions.py -W ignore::DeprecationWarning
 fi
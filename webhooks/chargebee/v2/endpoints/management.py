@@ -1,16 +1,40 @@
-from fastapi import APIRouter, Request, Header, Query
+from contextlib import aclosing
+from fastapi import APIRouter, HTTPException, Request, Header, Query
+from pydantic import TypeAdapter, ValidationError
 from webhooks.models.chargebee import ChargebeeWebhookPayload, Payment, Subscription, Customer, Transaction, Invoice, PaymentSource, Card
 from webhooks.models.response import ResponseBody
-from webhooks.utils.auth import load_secrets, webhook_authorization
-from webhooks.utils.helpers import logger, mailserver_api, res_body, timer
-from typing import Dict, Union, Annotated
-import os, chargebee
+from webhooks.utils.accounts import account_index
+from webhooks.utils.auth import load_secrets, tenant_secrets, webhook_authorization
+from webhooks.utils.cache import subscription_cache
+from webhooks.utils.clients import ChargebeeClient
+from webhooks.utils.context import event_context, event_scope
+from webhooks.utils.dead_letter import dead_letter_store
+from webhooks.utils.event_queue import event_queue
+from webhooks.utils.coalescer import EventCoalescer
+from webhooks.utils.helpers import logger, flush_account_updates, mailserver_api, res_body, timer
+from webhooks.utils.plans import PlanClass, plan_catalog
+from webhooks.utils.idempotency import idempotency_store
+from webhooks.utils.metrics import observe_event, queue_in_flight
+from webhooks.utils.registry import event_registry, tenant_of
+from webhooks.utils.scheduler import customer_scheduler
+from webhooks.utils.timing import request_scope, timed
+from webhooks.utils.tracing import tracer, traced
+from webhooks.utils.versions import version_index
+from typing import Dict, Optional, Union, Annotated
+from datetime import datetime
+import os
 
 
 router = APIRouter()
+resource_version = TypeAdapter(Optional[datetime])
+
+EVENT_RESOURCES = { 'customer': 'customer', 'subscription': 'subscription', 'invoice': 'invoice', 'payment': 'transaction' }
+
+event_registry.ignore([ 'tasman' ], [ 'payment_source_added', 'payment_succeeded', 'payment_initiated', 'payment_failed', 'invoice_updated' ], 'Ignored Event - Not interested in payment events for tasman')
 
 
 @router.post("/")
+@traced()
 async def chargebee_webhook(
     req: Request,
     payload: ChargebeeWebhookPayload,
@@ -18,112 +42,209 @@ async def chargebee_webhook(
     user_agent: Annotated[Union[str, None], Header()]=None,
     cb_instance: str=Query(None, alias="cb-instance")
 ):
-    event_time_start = timer(event=payload.event_type, timer='start')
     cb_instance = cb_instance if os.environ.get('TEST_MODE') != 'true' else req.query_params.get("cb_instance")
-    secrets = load_secrets(req, cb_instance)
-    webhook_authorization(secrets, authorization, user_agent)
+    event_time_start = timer(timer='start')
+
+    with timed('auth'):
+        secrets = load_secrets(req, cb_instance)
+        webhook_authorization(secrets, authorization, user_agent)
     
-    logger.info(f"Received Chargebe Webhook\n\t>> Chargebee Instance :\t{ cb_instance }\n\t>> Event Type :\t{ payload.event_type.title().replace('_', ' ') }\n\t>> Start Time :\t{ event_time_start }")
-    logger.debug(f"Received Chargebee Webhook Payload Content\n\t{ payload.content }")
-
-    if payload.event_type == 'customer_created':
-        response = handle_customer_created(secrets, cb_instance, payload)
-    elif payload.event_type == 'customer_changed':
-        response = handle_customer_changed(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_created':
-        response = handle_subscription_created(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_created_with_backdating':
-        response = handle_subscription_created_with_backdating(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_changed':
-        response = handle_subscription_changed(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_started':
-        response = handle_subscription_started(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_cancelled':
-        response = handle_subscription_cancelled(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_reactivated':
-        response = handle_subscription_reactivated(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_paused':
-        response = handle_subscription_paused(secrets, cb_instance, payload)
-    elif payload.event_type == 'subscription_resumed':
-        response = handle_subscription_resumed(secrets, cb_instance, payload)
-    elif payload.event_type == 'payment_source_added':
-        response = handle_payment_source_added(secrets, cb_instance, payload)
-    elif payload.event_type == 'payment_succeeded':
-        response = handle_payment_succeeded(secrets, cb_instance, payload)
-    elif payload.event_type == 'payment_initiated':
-        response = handle_payment_initiated(secrets, cb_instance, payload)
-    elif payload.event_type == 'payment_failed':
-        response = handle_payment_failed(secrets, cb_instance, payload)
-    elif payload.event_type == 'invoice_updated':
-        response = handle_invoice_updated(secrets, cb_instance, payload)
-    else:
+    logger.info('Received Chargebe Webhook\n\t>> Chargebee Instance :\t%s\n\t>> Event Type :\t%s\n\t>> Start Time :\t%s', cb_instance, payload.event_type.title().replace('_', ' '), event_time_start)
+    logger.debug('Received Chargebee Webhook Payload Content\n\t%s', payload.content)
+    tracer.current_span().set_attributes(tenant=tenant_of(cb_instance), event_type=payload.event_type, event_id=payload.id, customer=event_customer_key(cb_instance, payload.content))
+
+    handler, ignored = event_registry.resolve(cb_instance, payload.event_type)
+
+    if handler is None and ignored is None:
         return res_body(status_code=400, msg='Unhandled Event Type', data=f' { payload.event_type.title().replace('_', ' ') }', api_src='chargebee')
-    
-    return res_body(response.status_code, response.msg, response.data, response.object, response.api_src)
 
-def handle_customer_created(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+    timer(event=payload.event_type, tenant=tenant_of(cb_instance))
+
+    if ignored is not None:
+        return res_body(200, ignored, api_src='chargebee')
+
+    duplicate = idempotency_store.begin(cb_instance, payload.id)
+
+    if duplicate is not None:
+        return res_body(200, f"Duplicate Event `{ payload.id }` ({ duplicate.get('status') }) - skipping | { duplicate.get('result') }", api_src='chargebee')
+
+    try:
+        if os.environ.get('WEBHOOK_MODE') == 'queue':
+            try:
+                validation(payload.event_type, payload.content)
+            except (ValidationError) as e:
+                return res_body(status_code=422, msg=str(e), api_src='chargebee')
+
+            event_id = event_queue.enqueue(cb_instance, payload.model_dump(mode='json'))
+            response = res_body(200, f"Event Queued | ID: { event_id }", api_src='chargebee')
+        else:
+            response = await run_event(secrets, cb_instance, payload)
+            response = res_body(response.status_code, response.msg, response.data, response.object, response.api_src)
+    except (Exception) as e:
+        idempotency_store.abandon(cb_instance, payload.id)
+        # client errors won't change on replay, only upstream failures and crashes are worth keeping
+        if not isinstance(e, HTTPException) or e.status_code >= 500:
+            dead_letter_store.add(cb_instance, payload.model_dump(mode='json'), str(e) or type(e).__name__, getattr(e, 'status_code', None), source='inline')
+        raise
+
+    idempotency_store.finish(cb_instance, payload.id, response)
+    dead_letter_store.resolve(cb_instance, payload.id, response)
+
+    return response
+
+@traced()
+async def process_event(app_secrets, cb_instance, content: Dict):
+    # queue worker entrypoint: replays a persisted webhook through the same handlers as the inline path
+    with request_scope() as request, queue_in_flight.track():
+        with timed('parse'):
+            payload = ChargebeeWebhookPayload(**content)
+
+        event_time_start = timer(event=payload.event_type, timer='start', tenant=tenant_of(cb_instance))
+        status_code = 500
+        tracer.current_span().set_attributes(tenant=tenant_of(cb_instance), event_type=payload.event_type, event_id=payload.id, customer=event_customer_key(cb_instance, payload.content))
+
+        with timed('auth'):
+            secrets = tenant_secrets(app_secrets, cb_instance)
+
+        logger.info('Processing Queued Chargebee Webhook\n\t>> Chargebee Instance :\t%s\n\t>> Event Type :\t%s\n\t>> Start Time :\t%s', cb_instance, payload.event_type.title().replace('_', ' '), event_time_start)
+
+        try:
+            response = await run_event(secrets, cb_instance, payload)
+            status_code = response.status_code
+
+            return res_body(response.status_code, response.msg, response.data, response.object, response.api_src)
+        except (HTTPException) as e:
+            # client errors won't change on retry, only upstream failures go back on the queue
+            status_code = e.status_code
+            if e.status_code >= 500:
+                raise
+            return e.detail
+        finally:
+            observe_event('queue', request.tenant, request.event_type, status_code, request.elapsed())
+
+async def run_event(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    return await event_coalescer.submit(event_customer_key(cb_instance, payload.content), (secrets, cb_instance, payload))
+
+async def run_batch(key, events: list):
+    # a burst for one customer shares one context: reads are memoized and account updates are diffed into one write
+    results = [ None ] * len(events)
+    # only a later event of the same type for the same resource makes an earlier one redundant
+    latest = { (payload.event_type, resource): n for n, (_, _, payload) in enumerate(events) if (resource := event_resource(payload.event_type, payload.content)) }
+    secrets, cb_instance, payload = events[-1]
+
+    async with customer_scheduler.slot(key):
+        with event_scope(cb_instance, payload.event_type) as ctx:
+            ctx.defer_writes = os.environ.get('MAILSERVER_DEFER_WRITES', 'false') == 'true' or len(events) > 1
+
+            for n, (secrets, cb_instance, payload) in enumerate(events):
+                if latest.get((payload.event_type, event_resource(payload.event_type, payload.content)), n) != n:
+                    results[n] = ResponseBody(status_code=200, msg=f"Coalesced Event - superseded by a later { payload.event_type.title().replace('_', ' ') }", api_src='chargebee')
+                    continue
+
+                stale = stale_event(cb_instance, payload.event_type, payload.content)
+
+                if stale is not None:
+                    results[n] = ResponseBody(status_code=200, msg=f"Ignored Event - out of order, { stale }", api_src='chargebee')
+                    continue
+
+                observe_subscription(cb_instance, payload.content)
+                ctx.event_type = payload.event_type
+
+                try:
+                    results[n] = await dispatch_event(secrets, cb_instance, payload)
+                except (HTTPException) as e:
+                    results[n] = e
+
+            await flush_account_updates(secrets, ctx)
+
+    return results
+
+event_coalescer = EventCoalescer(run_batch)
+
+async def dispatch_event(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    handler, ignored = event_registry.resolve(cb_instance, payload.event_type)
+
+    if ignored is not None:
+        return ResponseBody(status_code=200, msg=ignored, data=payload.content, api_src='chargebee')
+
+    if handler is None:
+        return res_body(status_code=400, msg='Unhandled Event Type', data=f' { payload.event_type.title().replace('_', ' ') }', api_src='chargebee')
+
+    return await handler(secrets, cb_instance, payload)
+
+@event_registry.register('customer_created')
+@traced()
+async def handle_customer_created(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
 
-    logger.debug(f"Customer | cf_has_selected_a_paid_plan: { customer.cf_has_selected_a_paid_plan } { type(customer.cf_has_selected_a_paid_plan) } ")
-    logger.debug(f"Customer | cf_already_paying_with_provider: { customer.cf_already_paying_with_provider } { type(customer.cf_already_paying_with_provider) } ")
+    logger.debug('Customer | cf_has_selected_a_paid_plan: %s %s ', customer.cf_has_selected_a_paid_plan, type(customer.cf_has_selected_a_paid_plan))
+    logger.debug('Customer | cf_already_paying_with_provider: %s %s ', customer.cf_already_paying_with_provider, type(customer.cf_already_paying_with_provider))
     
     validation(payload.event_type, payload.content)
 
     if cb_instance.__contains__('tasman'):
-        status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
+        status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
         result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
         response = ResponseBody(**result)
 
     if cb_instance.__contains__('msgco'):
         if not cb_customer_marked_as_already_selected_paid_plan(customer):
             try:
-                result = chargebee.Customer.update(customer.id, { 'locale': 'en-AU', 'cf_has_selected_a_paid_plan': 'False' })
+                result = await secrets['chargebee'].customer_update(customer.id, { 'locale': 'en-AU', 'cf_has_selected_a_paid_plan': 'False' })
             except (Exception) as e:
                 return res_body(status_code=500, msg=str(e), api_src='chargebee')
         
-            logger.info(f"Update Success: <cf_has_selected_a_paid_plan>: { result }")
+            logger.info('Update Success: <cf_has_selected_a_paid_plan>: %s', result)
         
         if not cb_customer_already_paying_with_provider(customer):
             try:
-                result = chargebee.Customer.update(customer.id, { 'locale': 'en-AU', 'cf_already_paying_with_provider': 'False' })
+                result = await secrets['chargebee'].customer_update(customer.id, { 'locale': 'en-AU', 'cf_already_paying_with_provider': 'False' })
             except (Exception) as e:
                 return res_body(status_code=500, msg=str(e), api_src='chargebee')
         
-            logger.info(f"Update Success: <cf_already_paying_with_provider>: { result }")
+            logger.info('Update Success: <cf_already_paying_with_provider>: %s', result)
 
             payload.event_type = "customer_changed"
 
-            response = handle_customer_changed(secrets, cb_instance, payload) # fallthrough
+            response = await handle_customer_changed(secrets, cb_instance, payload) # fallthrough
 
     return response
 
-def handle_customer_changed(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('customer_changed')
+@traced()
+async def handle_customer_changed(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
 
     validation(payload.event_type, payload.content)
 
     if cb_instance.__contains__('tasman'):
-        status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-        logger.debug(f"Email: { customer.email } | Username: { get_ms_account.username }")
-        logger.debug(f"Customer ID: { customer.id } | Billing Code: { get_ms_account.billingCode }")
+        # accounts still holding this customer's billing code under another username, looked up before the code moves to the new one
+        previous_accounts = [ account for account in account_index.by_billing_code(customer.id) if account.username != customer.email.lower() ] if account_index.enabled else None
+        status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+        logger.debug('Email: %s | Username: %s', customer.email, get_ms_account.username)
+        logger.debug('Customer ID: %s | Billing Code: %s', customer.id, get_ms_account.billingCode)
         if get_ms_account.billingCode != customer.id:
-            logger.debug(f"Billing Code (change event): Customer ID: { customer.id } | Billing Code: { get_ms_account.billingCode }")
-            status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
+            logger.debug('Billing Code (change event): Customer ID: %s | Billing Code: %s', customer.id, get_ms_account.billingCode)
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
             result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
-        if get_ms_account.username != customer.email:
-            logger.debug(f"Customer Email (change event): Email: { customer.email } | Username: { get_ms_account.username }")
-            status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', get_ms_account.billingCode, { 'billingCode': '' })
+        for previous_account in previous_accounts or []:
+            logger.debug('Customer Email (change event): Email: %s | Previous Username: %s', customer.email, previous_account.username)
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', previous_account.username, { 'billingCode': '' })
+            result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
+        if previous_accounts is None and get_ms_account.username != customer.email:
+            logger.debug('Customer Email (change event): Email: %s | Username: %s', customer.email, get_ms_account.username)
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', get_ms_account.billingCode, { 'billingCode': '' })
             result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
     if cb_instance.__contains__('msgco'):
         if customer.email.lower().endswith("@themessaging.co") or customer.email.lower().endswith("@team.atmail.com"):
             result = { 'status_code': 201, 'msg': 'Customer Create Success! | User', 'data': f"{ customer.email }", 'api_src': 'chargebee' }
         else:
-            status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'billingCode': customer.id })
             msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
             result = { 'status_code': status_code, 'msg': f"Customer Create Success! | User: { customer.email } and { msg }", 'data': str(data), 'object': update_ms_account, 'api_src': 'mailserver' }
 
@@ -136,8 +257,10 @@ def handle_customer_changed(secrets, cb_instance, payload: ChargebeeWebhookPaylo
 
     return response
 
-def handle_subscription_created(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_created')
+@traced()
+async def handle_subscription_created(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -146,32 +269,32 @@ def handle_subscription_created(secrets, cb_instance, payload: ChargebeeWebhookP
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event - has non-email subscription', 'data': payload.content, 'api_src': 'chargebee' }
         else:
             if cb_is_active_subscription(subscription):
-                result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-                logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
+                result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+                logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
             else:
                 result = { 'status_code': 200, 'msg': f'Ignored Event - myAccount `{ customer.email }` responsible for setting up', 'data': payload.content, 'api_src': 'chargebee' }
 
     if cb_instance.__contains__('msgco'):
         if cb_is_paid_plan(customer, subscription) and not cb_customer_marked_as_already_selected_paid_plan(customer):
             try:
-                result = chargebee.Customer.update(customer.id, { 'locale': 'en-AU', 'cf_has_selected_a_paid_plan': 'True' })
+                result = await secrets['chargebee'].customer_update(customer.id, { 'locale': 'en-AU', 'cf_has_selected_a_paid_plan': 'True' })
             except (Exception) as e:
                 return res_body(status_code=500, msg=str(e), api_src='chargebee')
             
-            logger.info(f"Update Success: { result }")
+            logger.info('Update Success: %s', result)
         else:
-            logger.info(f"Not Applicable: { customer.email }")
+            logger.info('Not Applicable: %s', customer.email)
 
-        is_owing, amount_owed = cb_active_subscriptions_fully_paid(customer)
+        is_owing, amount_owed = await cb_active_subscriptions_fully_paid(secrets['chargebee'], customer)
 
         if is_owing or amount_owed < 50:
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
             if get_ms_account.account_status != 'active':
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
+                status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
                 msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
             else:
                 msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
@@ -189,8 +312,10 @@ def handle_subscription_created(secrets, cb_instance, payload: ChargebeeWebhookP
 
     return response
 
-def handle_subscription_created_with_backdating(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_created_with_backdating')
+@traced()
+async def handle_subscription_created_with_backdating(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -199,21 +324,21 @@ def handle_subscription_created_with_backdating(secrets, cb_instance, payload: C
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event - has non-email subscription', 'data': payload.content, 'api_src': 'chargebee' }
         else:
             if cb_is_active_subscription(subscription):
-                result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-                logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
+                result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+                logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
             else:
                 result = { 'status_code': 200, 'msg': f'Ignored Event - myAccount `{ customer.email }` responsible for setting up', 'data': payload.content, 'api_src': 'chargebee' }
 
     if cb_instance.__contains__('msgco'):
-        cancel_active_sponsored_subs_for_customer_other_than(payload.content)
+        await cancel_active_sponsored_subs_for_customer_other_than(payload.content, cb_instance, secrets['chargebee'])
 
         if cb_is_paid_plan(customer, subscription):
-            result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-            logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
+            result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+            logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
         else:
             result = { 'status_code': 201, 'msg': f'Not a paid plan. Subscription created successfully. | User: { customer.email }', 'data': f'Subscription: { subscription }', 'api_src': 'chargebee' }
 
@@ -226,8 +351,10 @@ def handle_subscription_created_with_backdating(secrets, cb_instance, payload: C
 
     return response
 
-def handle_subscription_changed(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_changed')
+@traced()
+async def handle_subscription_changed(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -236,43 +363,43 @@ def handle_subscription_changed(secrets, cb_instance, payload: ChargebeeWebhookP
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
-            active_subs = cb_all_subscriptions(customer, { 'status[is]': 'active' })
+            active_subs = await cb_all_subscriptions(secrets['chargebee'], customer, { 'status[is]': 'active' })
             sub_status_set = [ 'rstrBilling', 'rstrFrozen', 'disabled', 'deleted' ] if not cb_is_active_subscription(subscription) else [ 'active' ] if len(active_subs) or cb_is_active_subscription(subscription) else []
-            logger.debug(f'Active Subs: { active_subs }, length: { len(active_subs) } | Account Status: { sub_status_set }')
+            logger.debug('Active Subs: %s, length: %s | Account Status: %s', active_subs, len(active_subs), sub_status_set)
 
-            result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload) if cb_is_active_subscription(subscription) else { 'status_code': 200, 'msg': f'Ignored Event', 'data': f' { payload.event_type.title().replace('_', ' ') } - dont care if changes not to active subscription | User: { customer.email }', 'api_src': 'chargebee' }
-            logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }') if cb_is_active_subscription(subscription) else None
+            result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload) if cb_is_active_subscription(subscription) else { 'status_code': 200, 'msg': f'Ignored Event', 'data': f' { payload.event_type.title().replace('_', ' ') } - dont care if changes not to active subscription | User: { customer.email }', 'api_src': 'chargebee' }
+            logger.debug('Response Code Modify COS Profile: %s', result.get('status_code')) if cb_is_active_subscription(subscription) else None
 
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-            logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
 
             if get_ms_account.account_status not in sub_status_set:
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': sub_status_set[0] })
+                status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': sub_status_set[0] })
                 result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
     if cb_instance.__contains__('msgco'):
         if cb_is_paid_plan(customer, subscription) and subscription.status != 'future':
-            result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-            logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
+            result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+            logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
 
-            is_owing, amount_owed = cb_active_subscriptions_fully_paid(customer)
-            logger.debug(f"Is Owing: { is_owing } | Amount Owing: { amount_owed }")
+            is_owing, amount_owed = await cb_active_subscriptions_fully_paid(secrets['chargebee'], customer)
+            logger.debug('Is Owing: %s | Amount Owing: %s', is_owing, amount_owed)
 
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-            logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
 
             if is_owing or amount_owed < 50:
                 if get_ms_account.account_status != 'active':
-                    status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
+                    status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
                     msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
                 else:
                     msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
             else:
                 if get_ms_account.account_status == 'active':
-                    status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' }) # set restricted billing if active
+                    status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' }) # set restricted billing if active
                     msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
                 else:
                     msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
@@ -289,8 +416,10 @@ def handle_subscription_changed(secrets, cb_instance, payload: ChargebeeWebhookP
 
     return response
 
-def handle_subscription_started(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_started')
+@traced()
+async def handle_subscription_started(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -299,16 +428,16 @@ def handle_subscription_started(secrets, cb_instance, payload: ChargebeeWebhookP
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
             if cb_is_active_subscription(subscription):
-                result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-                logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
-                status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-                logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+                result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+                logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
+                status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+                logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
                 if get_ms_account.account_status != 'active':
-                    status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
+                    status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
                     result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
             else:
                 result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
@@ -321,15 +450,17 @@ def handle_subscription_started(secrets, cb_instance, payload: ChargebeeWebhookP
             response = ResponseBody(**result)
 
     if cb_instance.__contains__('msgco'):
-        cancel_active_sponsored_subs_for_customer_other_than(payload.content) # check number of subscription_items here
+        await cancel_active_sponsored_subs_for_customer_other_than(payload.content, cb_instance, secrets['chargebee']) # check number of subscription_items here
         payload.event_type='subscription_changed'
 
-        response = handle_subscription_changed(secrets, cb_instance, payload) # fallthrough
+        response = await handle_subscription_changed(secrets, cb_instance, payload) # fallthrough
 
     return response
 
-def handle_subscription_cancelled(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_cancelled')
+@traced()
+async def handle_subscription_cancelled(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -338,41 +469,41 @@ def handle_subscription_cancelled(secrets, cb_instance, payload: ChargebeeWebhoo
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
-            active_subs = cb_all_subscriptions(customer, { 'status[is]': 'active' })
-            logger.debug(f'Active Subs: { active_subs }, length: { len(active_subs) }')
+            active_subs = await cb_all_subscriptions(secrets['chargebee'], customer, { 'status[is]': 'active' })
+            logger.debug('Active Subs: %s, length: %s', active_subs, len(active_subs))
             sub_status_set = [ 'rstrBilling', 'rstrFrozen' ] if cb_plan_family(cb_instance, customer, subscription) == 'email-tasman' else [ 'rstrBilling' ]
 
             if len(active_subs):
                 result = { 'status_code': 200, 'msg': 'Ignored Event - has active subscription', 'data': payload.content, 'api_src': 'chargebee' }
             else:
-                result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-                logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
-                status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-                logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+                result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+                logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
+                status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+                logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
                 if get_ms_account.account_status not in sub_status_set:
-                    status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': sub_status_set[0] })
+                    status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': sub_status_set[0] })
                     result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
     if cb_instance.__contains__('msgco'):
-        for plan in cb_all_subscriptions(customer):
+        for plan in await cb_all_subscriptions(secrets['chargebee'], customer):
             if cb_is_paid_plan(plan):
                 if plan.status in [ 'active', 'future', 'non_renewing' ]:
                     if plan.id != subscription.id:
                         if cb_plan_check(cb_instance, plan, 'storage') > cb_plan_check(cb_instance, subscription, 'storage', cb_plan_check=cb_instance):
-                            logger.debug(f"Active Subscription: { cb_plan_check(cb_instance, plan, 'storage') } > Subscription Payload: { cb_plan_check(cb_instance, subscription, 'storage') }")
+                            logger.debug('Active Subscription: %s > Subscription Payload: %s', cb_plan_check(cb_instance, plan, 'storage'), cb_plan_check(cb_instance, subscription, 'storage'))
                             highest_quota_subcription = plan
 
                         try:
                             highest_quota_subcription
-                            logger.debug(f"Highest Quota Subcription: { highest_quota_subcription }")
+                            logger.debug('Highest Quota Subcription: %s', highest_quota_subcription)
                         except (Exception) as e:
                             return res_body(status_code=422, msg=str(e), api_src='chargebee')
                         else:
-                            result = modify_cos_profile(secrets, cb_instance, customer, highest_quota_subcription)
-                            logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
+                            result = await modify_cos_profile(secrets, cb_instance, customer, highest_quota_subcription)
+                            logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
     
     try:
         result
@@ -383,27 +514,29 @@ def handle_subscription_cancelled(secrets, cb_instance, payload: ChargebeeWebhoo
 
     return response
 
-def handle_subscription_reactivated(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_reactivated')
+@traced()
+async def handle_subscription_reactivated(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer')) if fallthrough is None else ''
     subscription = Subscription(**payload.content.get('subscription')) if fallthrough is None else ''
 
-    logger.debug(f"Customer ID: { customer.id } | Customer Email: { customer.email } | Subscription ID: { subscription.id }") if fallthrough is None else ''
+    logger.debug('Customer ID: %s | Customer Email: %s | Subscription ID: %s', customer.id, customer.email, subscription.id) if fallthrough is None else ''
     
     validation(payload.event_type if fallthrough is None else fallthrough, payload.content)
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
-            result = modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
-            logger.debug(f'Response Code Modify COS Profile: { result.get('status_code') }')
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-            logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+            result = await modify_cos_profile(secrets, cb_instance, customer, subscription, payload)
+            logger.debug('Response Code Modify COS Profile: %s', result.get('status_code'))
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
             if get_ms_account.account_status != 'active':
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
+                status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
                 result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
         try:
@@ -417,12 +550,14 @@ def handle_subscription_reactivated(secrets, cb_instance, payload: ChargebeeWebh
         event_source = payload.event_type
         payload.event_type = "payment_succeeded"
 
-        response = handle_payment_succeeded(payload, cb_instance, fallthrough if fallthrough is not None else event_source) # fallthrough
+        response = await handle_payment_succeeded(payload, cb_instance, fallthrough if fallthrough is not None else event_source) # fallthrough
 
     return response
 
-def handle_subscription_paused(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_paused')
+@traced()
+async def handle_subscription_paused(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer'))
     subscription = Subscription(**payload.content.get('subscription'))
@@ -431,13 +566,13 @@ def handle_subscription_paused(secrets, cb_instance, payload: ChargebeeWebhookPa
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-            logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
             if get_ms_account.account_status not in [ 'rstrBilling', 'rstrFrozen' ]:
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' })
+                status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' })
                 result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
         try:
@@ -450,12 +585,14 @@ def handle_subscription_paused(secrets, cb_instance, payload: ChargebeeWebhookPa
     if cb_instance.__contains__('msgco'):
         payload.event_type = "subscription_cancelled"
 
-        response = handle_subscription_cancelled(secrets, cb_instance, payload) # fallthrough
+        response = await handle_subscription_cancelled(secrets, cb_instance, payload) # fallthrough
 
     return response
 
-def handle_subscription_resumed(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('subscription_resumed')
+@traced()
+async def handle_subscription_resumed(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
     customer = Customer(**payload.content.get('customer')) if fallthrough is None else ''
     subscription = Subscription(**payload.content.get('subscription')) if fallthrough is None else ''
@@ -464,13 +601,13 @@ def handle_subscription_resumed(secrets, cb_instance, payload: ChargebeeWebhookP
 
     if cb_instance.__contains__('tasman'):
         if not cb_is_email_plan(cb_instance, customer, subscription):
-            logger.debug(f'Subscription Status: { subscription.status }')
+            logger.debug('Subscription Status: %s', subscription.status)
             result = { 'status_code': 200, 'msg': 'Ignored Event', 'data': payload.content, 'api_src': 'chargebee' }
         else:
-            status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-            logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+            status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+            logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
             if get_ms_account.account_status != 'active':
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
+                status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' })
                 result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { data }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
         try:
@@ -484,46 +621,44 @@ def handle_subscription_resumed(secrets, cb_instance, payload: ChargebeeWebhookP
         event_source = payload.event_type if fallthrough is None else fallthrough
         payload.event_type = 'subscription_reactivated'
 
-        response = handle_subscription_reactivated(secrets, cb_instance, payload, event_source) # fallthrough
+        response = await handle_subscription_reactivated(secrets, cb_instance, payload, event_source) # fallthrough
 
     return response
 
-def handle_payment_source_added(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
-
-    if cb_instance.__contains__('tasman'):
-        result = { 'status_code': 200, 'msg': 'Ignored Event - Not interested in payment events for tasman', 'data': payload.content, 'api_src': 'chargebee' }
+@event_registry.register('payment_source_added', tenants=[ 'msgco' ])
+@traced()
+async def handle_payment_source_added(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
-    if cb_instance.__contains__('msgco'):
-        payment_source = PaymentSource(**payload.content.get('customer'))
-        card = Card(**payload.content.get('customer'))
+    payment_source = PaymentSource(**payload.content.get('customer'))
+    card = Card(**payload.content.get('customer'))
 
-        logger.debug(f"Payment Source: { payment_source }")
+    logger.debug('Payment Source: %s', payment_source)
 
-        validation(payload.event_type, payload.content)
+    validation(payload.event_type, payload.content)
 
-        if payment_source.billing_address is None or payment_source.billing_address == '' and payment_source.payment_method.type == 'card':
-            if payment_source.card_status is None or payment_source.card_status != 'valid':
-                return res_body(status_code=400, msg='Invalid card content', api_src='chargebee')
+    if payment_source.billing_address is None or payment_source.billing_address == '' and payment_source.payment_method.type == 'card':
+        if payment_source.card_status is None or payment_source.card_status != 'valid':
+            return res_body(status_code=400, msg='Invalid card content', api_src='chargebee')
 
-            logger.debug(f"card: { card }")
+        logger.debug('card: %s', card)
 
-            billing_address = {
-                'first_name': card.first_name,
-                'last_name': card.last_name,
-                'line1': card.billing_addr1,
-                'city': card.billing_city,
-                'state': card.billing_state,
-                'country': card.billing_country,
-                'zip': card.billing_zip
-            }
+        billing_address = {
+            'first_name': card.first_name,
+            'last_name': card.last_name,
+            'line1': card.billing_addr1,
+            'city': card.billing_city,
+            'state': card.billing_state,
+            'country': card.billing_country,
+            'zip': card.billing_zip
+        }
 
-            try:
-                result = chargebee.Customer.update_billing_info(payment_source.id, { 'first_name': card.first_name, 'last_name': card.last_name, 'billing_address': billing_address })
-            except (Exception) as e:
-                return res_body(status_code=500, msg=str(e), api_src='chargebee')
-            
-            result = { 'status_code': 201, 'msg': 'Customer Create Success! | User', 'data': f"{ payment_source.email }", 'api_src': 'chargebee' }
+        try:
+            result = await secrets['chargebee'].customer_update_billing_info(payment_source.id, { 'first_name': card.first_name, 'last_name': card.last_name, 'billing_address': billing_address })
+        except (Exception) as e:
+            return res_body(status_code=500, msg=str(e), api_src='chargebee')
+        
+        result = { 'status_code': 201, 'msg': 'Customer Create Success! | User', 'data': f"{ payment_source.email }", 'api_src': 'chargebee' }
 
     try:
         result
@@ -534,44 +669,42 @@ def handle_payment_source_added(secrets, cb_instance, payload: ChargebeeWebhookP
 
     return response
 
-def handle_payment_succeeded(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('payment_succeeded', tenants=[ 'msgco' ])
+@traced()
+async def handle_payment_succeeded(secrets, cb_instance, payload: ChargebeeWebhookPayload, fallthrough: str=None):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
-    if cb_instance.__contains__('tasman'):
-        result = { 'status_code': 200, 'msg': 'Ignored Event - Not interested in payment events for tasman', 'data': payload.content, 'api_src': 'chargebee' }
-
-    if cb_instance.__contains__('msgco'):
-        logger.debug(f"Content: { payload.content }")
-        logger.debug(f"Fallthrough: { fallthrough }")
+    logger.debug('Content: %s', payload.content)
+    logger.debug('Fallthrough: %s', fallthrough)
 
-        customer = Payment(**payload.content).customer if fallthrough is None else \
-            Customer(**payload.content.get('customer')) if fallthrough.split('_')[0] == 'subscription' else \
-            Invoice(**payload.content.get('invoice')).customer_id if fallthrough.split('_')[0] == 'invoice' else ''
-        
-        logger.debug(f"Data Type: { type(customer) }")
+    customer = Payment(**payload.content).customer if fallthrough is None else \
+        Customer(**payload.content.get('customer')) if fallthrough.split('_')[0] == 'subscription' else \
+        Invoice(**payload.content.get('invoice')).customer_id if fallthrough.split('_')[0] == 'invoice' else ''
+    
+    logger.debug('Data Type: %s', type(customer))
 
-        validation(payload.event_type if fallthrough is None else fallthrough, payload.content)
-        
-        is_owing, amount_owed = cb_active_subscriptions_fully_paid(customer)
-        logger.debug(f"Is Owing: { is_owing } | Amount Owing: { amount_owed }")
-        
-        status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
-        logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
+    validation(payload.event_type if fallthrough is None else fallthrough, payload.content)
+    
+    is_owing, amount_owed = await cb_active_subscriptions_fully_paid(secrets['chargebee'], customer)
+    logger.debug('Is Owing: %s | Amount Owing: %s', is_owing, amount_owed)
+    
+    status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+    logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
 
-        if is_owing or amount_owed < 50:
-            if get_ms_account.account_status != 'active':
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
-                msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
-            else:
-                msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
+    if is_owing or amount_owed < 50:
+        if get_ms_account.account_status != 'active':
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'active' }) # set active if not active
+            msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
         else:
-            if get_ms_account.account_status == 'active':
-                status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' }) # set billing restricted if active
-                msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
-            else:
-                msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
+            msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
+    else:
+        if get_ms_account.account_status == 'active':
+            status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'account_status': 'rstrBilling' }) # set billing restricted if active
+            msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
+        else:
+            msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
 
-        result = { 'status_code': status_code, 'msg': msg, 'data': str(data), 'object': update_ms_account if get_ms_account.account_status != 'active' else get_ms_account, 'api_src': 'mailserver' }
+    result = { 'status_code': status_code, 'msg': msg, 'data': str(data), 'object': update_ms_account if get_ms_account.account_status != 'active' else get_ms_account, 'api_src': 'mailserver' }
 
     try:
         result
@@ -582,31 +715,29 @@ def handle_payment_succeeded(secrets, cb_instance, payload: ChargebeeWebhookPayl
     
     return response
 
-def handle_payment_initiated(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('payment_initiated', tenants=[ 'msgco' ])
+@traced()
+async def handle_payment_initiated(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
-    if cb_instance.__contains__('tasman'):
-        result = { 'status_code': 200, 'msg': 'Ignored Event - Not interested in payment events for tasman', 'data': payload.content, 'api_src': 'chargebee' }
-
-    if cb_instance.__contains__('msgco'):
-        payment = Payment(**payload.content)
+    payment = Payment(**payload.content)
 
-        logger.debug(f"Payment Customer ID { payment.customer.id } { payment.customer.email }")
-        logger.debug(f"Payment Subscription ID { payment.subscription.id }")
-        logger.debug(f"Payment Invoice ID { payment.invoice.id }")
-        logger.debug(f"Payment Transaction ID { payment.transaction.id }")
+    logger.debug('Payment Customer ID %s %s', payment.customer.id, payment.customer.email)
+    logger.debug('Payment Subscription ID %s', payment.subscription.id)
+    logger.debug('Payment Invoice ID %s', payment.invoice.id)
+    logger.debug('Payment Transaction ID %s', payment.transaction.id)
 
-        validation(payload.event_type, payload.content)
+    validation(payload.event_type, payload.content)
 
-        status_code, action, data, get_ms_account = mailserver_api(secrets, 'GET', 'view', payment.customer, 'account_status')
-        logger.debug(f'Mail Server Account Status: { get_ms_account.account_status }')
-        if get_ms_account.account_status != 'active':
-            status_code, action, data, update_ms_account = mailserver_api(secrets, 'POST', 'update', payment.customer, { 'account_status': 'active' }) # set active if not active
-            msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
-        else:
-            msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
+    status_code, action, data, get_ms_account = await mailserver_api(secrets, 'GET', 'view', payment.customer, 'account_status')
+    logger.debug('Mail Server Account Status: %s', get_ms_account.account_status)
+    if get_ms_account.account_status != 'active':
+        status_code, action, data, update_ms_account = await mailserver_api(secrets, 'POST', 'update', payment.customer, { 'account_status': 'active' }) # set active if not active
+        msg = f"{ action.capitalize() }d { ', '.join(f"<{ k }> { get_ms_account.model_dump().get(k, '') } => { update_ms_account.model_dump().get(k, '') }" for k in data.keys()) } | User: { update_ms_account.username }"
+    else:
+        msg = f"Account: { get_ms_account.username } <{ data }> is already '{ get_ms_account.account_status }'. Skipping update"
 
-        result = { 'status_code': status_code, 'msg': msg, 'data': str(data), 'object': update_ms_account if get_ms_account.account_status != 'active' else get_ms_account, 'api_src': 'mailserver' }
+    result = { 'status_code': status_code, 'msg': msg, 'data': str(data), 'object': update_ms_account if get_ms_account.account_status != 'active' else get_ms_account, 'api_src': 'mailserver' }
 
     try:
         result
@@ -617,152 +748,167 @@ def handle_payment_initiated(secrets, cb_instance, payload: ChargebeeWebhookPayl
     
     return response
 
-def handle_payment_failed(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+@event_registry.register('invoice_updated', tenants=[ 'msgco' ])
+@traced()
+async def handle_invoice_updated(secrets, cb_instance, payload: ChargebeeWebhookPayload):
+    logger.debug('[ EVENT ] - %s', payload.event_type)
 
-    if cb_instance.__contains__('tasman'):
-        result = { 'status_code': 200, 'msg': 'Ignored Event - Not interested in payment events for tasman', 'data': payload.content, 'api_src': 'chargebee' }
-        response = ResponseBody(**result)
-    
-    if cb_instance.__contains__('msgco'):
-        return res_body(status_code=400, msg='Unhandled Event Type', data=f' { payload.event_type.title().replace('_', ' ') }', api_src='chargebee')
+    invoice = Invoice(**payload.content.get('invoice'))
+
+    logger.debug('Invoice ID %s || Customer ID: %s', invoice.id, invoice.customer_id)
+
+    validation(payload.event_type, payload.content)
+
+    try:
+        transactions_in_progress = await secrets['chargebee'].transaction_list({ 'customer_id[is]': invoice.customer_id, 'limit': 2, 'status[is]': 'in_progress' })
+    except (Exception) as e:
+        return res_body(status_code=500, msg=str(e), api_src='chargebee')    
     
+    if len(transactions_in_progress) > 0:
+        result = { 'status_code': 200, 'msg': f"Transactions in progress: { len(transactions_in_progress) }, not changing account status", 'api_src': 'chargebee' }
+        response = ResponseBody(**result)
+    else:
+        logger.info('No payment transactions in progress: %s', len(transactions_in_progress))
+        
+        event_source = payload.event_type
+        payload.event_type = 'subscription_resumed'
+
+        response = await handle_subscription_resumed(secrets, cb_instance, payload, event_source) # fallthrough
+
     return response
 
-def handle_invoice_updated(secrets, cb_instance, payload: ChargebeeWebhookPayload):
-    logger.debug(f"[ EVENT ] - { payload.event_type }")
+def event_customer_key(cb_instance, content: Dict):
+    # events for one customer run in arrival order; different customers run concurrently
+    customer_id = (content.get('customer') or {}).get('id') or \
+        next(((content.get(k) or {}).get('customer_id') for k in [ 'subscription', 'invoice', 'transaction' ] if (content.get(k) or {}).get('customer_id')), None)
 
-    if cb_instance.__contains__('tasman'):
-        result = { 'status_code': 200, 'msg': 'Ignored Event - Not interested in payment events for tasman', 'data': payload.content, 'api_src': 'chargebee' }
-        response = ResponseBody(**result)
+    return f"{ cb_instance.removesuffix('-test') }:{ customer_id }" if customer_id else None
 
-    if cb_instance.__contains__('msgco'):
-        invoice = Invoice(**payload.content.get('invoice'))
+def event_kind(event_type: str):
+    # the resource an event is about: subscription_* events a subscription, payment_* a transaction, payment_source_* the customer
+    return 'customer' if event_type.startswith('payment_source') else EVENT_RESOURCES.get(event_type.split('_')[0])
 
-        logger.debug(f"Invoice ID { invoice.id } || Customer ID: { invoice.customer_id }")
+def event_resource(event_type: str, content: Dict):
+    kind = event_kind(event_type)
 
-        validation(payload.event_type, payload.content)
+    return (content.get(kind) or {}).get('id') if kind else None
 
-        try:
-            transactions_in_progress = chargebee.Transaction.list({ 'customer_id[is]': invoice.customer_id, 'limit': 2, 'status[is]': 'in_progress' })
-        except (Exception) as e:
-            return res_body(status_code=500, msg=str(e), api_src='chargebee')    
-        
-        if len(transactions_in_progress) > 0:
-            result = { 'status_code': 200, 'msg': f"Transactions in progress: { len(transactions_in_progress) }, not changing account status", 'api_src': 'chargebee' }
-            response = ResponseBody(**result)
-        else:
-            logger.info(f"No payment transactions in progress: { len(transactions_in_progress) }")
-            
-            event_source = payload.event_type
-            payload.event_type = 'subscription_resumed'
+def stale_event(cb_instance, event_type: str, content: Dict):
+    # runs inside the customer's slot, so check-then-record can't interleave with another event for the same customer
+    tenant = tenant_of(cb_instance)
+    resources = [ (kind, content.get(kind).get('id'), content.get(kind).get('resource_version')) for kind in [ 'customer', 'subscription' ] if isinstance(content.get(kind), dict) and content.get(kind).get('id') ]
+    versions = [ (kind, f"{ tenant }:{ id }", resource_version.validate_python(version)) for kind, id, version in resources ]
 
-            response = handle_subscription_resumed(secrets, cb_instance, payload, event_source) # fallthrough
+    # only the event's own resource can make it stale; the other snapshots it carries are recorded but never drop it
+    for kind, key, version in versions:
+        if kind == event_kind(event_type) and version_index.is_stale(kind, key, version):
+            version_index.dropped += 1
+            logger.info('Stale Event: %s `%s` resource_version %s is older than last seen', kind, key, version)
+            return f"{ kind } { key.split(':', 1)[1] } has a newer version"
 
-    return response
+    for kind, key, version in versions:
+        version_index.record(kind, key, version)
+
+def observe_subscription(cb_instance, content: Dict):
+    if not content.get('subscription'):
+        return
+
+    try:
+        subscription = Subscription(**content.get('subscription'))
+    except (Exception) as e:
+        logger.debug('Subscription not cached: %s', e)
+        return
 
-def cb_all_subscriptions(customer: Union[Customer, str], data: str=None):
-    params = { 'customer_id[is]': customer if isinstance(customer, str) else customer.id }
+    if subscription_cache.observe(tenant_of(cb_instance), subscription):
+        logger.debug('Subscription Cache Updated: %s | Customer ID: %s | Status: %s', subscription.id, subscription.customer_id, subscription.status)
+
+async def cb_subscriptions(cb_client: ChargebeeClient, customer: Union[Customer, str], data: str=None):
+    customer_id = customer if isinstance(customer, str) else customer.id
+    tenant = tenant_of(cb_client.site)
+    params = { 'customer_id[is]': customer_id }
     params.update(data) if data else params
 
+    ctx = event_context.get()
+    all_subscriptions = ctx.get_subscriptions(customer_id, data) if ctx is not None else None
+
+    if all_subscriptions is not None:
+        logger.debug('All Subscriptions (memoized): %s', all_subscriptions)
+        for subscription in all_subscriptions:
+            yield subscription
+        return
+
+    all_subscriptions = subscription_cache.get_subscriptions(tenant, customer_id, data)
+
+    if all_subscriptions is not None:
+        logger.debug('All Subscriptions (cached): %s', all_subscriptions)
+        ctx.set_subscriptions(customer_id, data, all_subscriptions) if ctx is not None else None
+        for subscription in all_subscriptions:
+            yield subscription
+        return
+
+    # fetch the customer's full list once so later status filters can be served from the cache
+    cacheable = subscription_cache.maxsize > 0 and (not data or set(data).issubset(subscription_cache.FILTERS))
+    params = { 'customer_id[is]': customer_id } if cacheable else params
+    status = (data or {}).get('status[is]') if cacheable else None
+    fetched = []
+
     try:
-        subscriptions = chargebee.Subscription.list(params=params)
+        async with aclosing(cb_client.subscriptions(params)) as subscriptions:
+            async for subscription in subscriptions:
+                fetched.append(subscription)
+                if status is None or subscription.status == status:
+                    yield subscription
     except (Exception) as e:
-        return res_body(status_code=400, msg=str(e) if not data else f'No { data } in subscriptions', data=f'| User: { customer.email }', api_src='chargebee')
-    
-    all_subscriptions = [ Subscription(**sub._response['subscription']) for sub in subscriptions ]
+        res_body(status_code=400, msg=str(e) if not data else f'No { data } in subscriptions', data=f'| User: { customer if isinstance(customer, str) else customer.email }', api_src='chargebee')
+
+    # only a list that was read to the end can be remembered; a caller that stopped early never gets here
+    if cacheable:
+        subscription_cache.set_subscriptions(tenant, customer_id, fetched)
+        fetched = subscription_cache.get_subscriptions(tenant, customer_id, data)
 
-    logger.debug(f"All Subscriptions: { all_subscriptions }")
+    ctx.set_subscriptions(customer_id, data, fetched) if ctx is not None else None
 
-    return all_subscriptions
+    logger.debug('All Subscriptions: %s', fetched)
+
+async def cb_all_subscriptions(cb_client: ChargebeeClient, customer: Union[Customer, str], data: str=None):
+    return [ subscription async for subscription in cb_subscriptions(cb_client, customer, data) ]
 
 def cb_plan_check(cb_instance: str, subscription: Subscription, params: str=None):
-    storage = 0
-    cos_profile = ''
-    prefixes = [ 'email-' ] if cb_instance.__contains__('tasman') else [ 'plan-av', 'plan-bv', 'plan-cv', 'complimentary-plan-' ] if cb_instance.__contains__('msgco') else None
-    plan_types = [ 'plan' ] if cb_instance.__contains__('tasman') else [ 'plan', 'addon', 'charge' ] if cb_instance.__contains__('msgco') else None
+    plan = plan_catalog.classify(cb_instance, subscription)
 
-    for plan in subscription.subscription_items:
-        if plan.item_type in plan_types:
-            plan_name = plan.item_price_id.lower()
-            prefix = next((prefix for prefix in prefixes if plan.item_price_id.lower().startswith(prefix)), None)
-
-            if prefix and cb_instance.__contains__('tasman'):
-                cos_profile = '-'.join(plan.item_price_id.lower().rsplit('-', 2)[:-2]) + '.group'
-            if prefix and cb_instance.__contains__('msgco'):
-                if prefix == 'plan-av':
-                    storage = 2 * 1024 * 1024 * 1024 # 2GB
-                    cos_profile = 'Kakadu-Plan-AV1'
-                if prefix == 'plan-bv':
-                    storage = 15 * 1024 * 1024 * 1024 # 15GB
-                    cos_profile = 'Kakadu-Plan-BV1'
-                if prefix == 'plan-cv':
-                    storage = 100 * 1024 * 1024 * 1024 # 100GB
-                    cos_profile = 'Kakadu-Plan-CV1'
-                if prefix == 'complimentary-plan-':
-                    storage = 100 * 1024 * 1024 * 1024 # 100GB
-                    cos_profile = 'Kakadu-complimentary-plan'
-
-    logger.debug(f"Plan Name: { plan_name } | Storage: { storage }") if params == 'storage' else logger.debug(f"Plan Name: { plan_name } | COS Profile Name: { cos_profile }") if params == 'cos_profile' \
-        else logger.debug(f"Plan Name: { plan_name } | Storage: { storage } | COS Profile Name: { cos_profile }") if params is None else ''
+    logger.debug('Plan Name: %s | Storage: %s', plan.plan_name, plan.storage) if params == 'storage' else logger.debug('Plan Name: %s | COS Profile Name: %s', plan.plan_name, plan.cos_profile) if params == 'cos_profile' \
+        else logger.debug('Plan Name: %s | Storage: %s | COS Profile Name: %s', plan.plan_name, plan.storage, plan.cos_profile) if params is None else ''
         
-    return storage if params == 'storage' else cos_profile if params == 'cos_profile' \
-        else (storage, cos_profile) if params is None \
+    return plan.storage if params == 'storage' else plan.cos_profile if params == 'cos_profile' \
+        else (plan.storage, plan.cos_profile) if params is None \
         else res_body(status_code=400, msg='Incorrect parameters for cb_plan_check function', api_src='mailserver')
 
-def cb_plan_family(cb_instance, customer: Customer, subscription: Subscription):
-    prefixes = [ 'email-' ] if cb_instance.__contains__('tasman') else [ 'plan-av', 'plan-bv', 'plan-cv', 'complimentary-plan-' ] if cb_instance.__contains__('msgco') else ''
-    plan_types = [ 'plan' ] if cb_instance.__contains__('tasman') else [ 'plan', 'addon', 'charge' ] if cb_instance.__contains__('msgco') else None
-
+def cb_plan_classify(cb_instance, customer: Customer, subscription: Subscription):
     try:
         if subscription.subscription_items is None:
             raise Exception('No subscription items')
     except (Exception) as e:
         return res_body(status_code=422, msg=f"{ e } | User", data=f" { customer.email }",  api_src='chargebee')
-    
-    for plan in subscription.subscription_items:
-        if plan.item_type in plan_types and any(plan.item_price_id.lower().startswith(prefix) for prefix in prefixes):
-            plan_family = 'email-tasman-legacy' if 'legacy'.lower() in plan.item_price_id.lower() else 'email-tasman'
-            logger.debug(f"Plan Name: { plan.item_price_id.lower() } | Subscription Item ID: { subscription.id } | Plan Family: { plan_family }")
-                
-    return plan_family
+
+    plan = plan_catalog.classify(cb_instance, subscription)
+    logger.debug('Plan Name: %s | Subscription Item ID: %s | Is Email Plan: %s | Is Paid Plan: %s | Plan Family: %s', plan.plan_name, subscription.id, plan.is_email, plan.is_paid, plan.plan_family)
+
+    return plan
+
+def cb_plan_family(cb_instance, customer: Customer, subscription: Subscription):
+    plan = cb_plan_classify(cb_instance, customer, subscription)
+
+    return plan.plan_family if isinstance(plan, PlanClass) else plan
 
 def cb_is_email_plan(cb_instance, customer: Customer, subscription: Subscription):
-    is_email_plan = False
-    prefixes = [ 'email-' ] if cb_instance.__contains__('tasman') else [ 'plan-av', 'plan-bv', 'plan-cv', 'complimentary-plan-' ] if cb_instance.__contains__('msgco') else ''
-    plan_types = [ 'plan' ] if cb_instance.__contains__('tasman') else [ 'plan', 'addon', 'charge' ] if cb_instance.__contains__('msgco') else None
+    plan = cb_plan_classify(cb_instance, customer, subscription)
 
-    try:
-        if subscription.subscription_items is None:
-            raise Exception('No subscription items')
-    except (Exception) as e:
-        return res_body(status_code=422, msg=f"{ e } | User", data=f" { customer.email }",  api_src='chargebee')
-    
-    for plan in subscription.subscription_items:
-        if plan.item_type in plan_types and any(plan.item_price_id.lower().startswith(prefix) for prefix in prefixes):
-            is_email_plan = True
-            logger.debug(f"Plan Name: { plan.item_price_id.lower() } | Subscription Item ID: { subscription.id } | Is Email Plan: { is_email_plan }")
-                
-    return is_email_plan
+    return plan.is_email if isinstance(plan, PlanClass) else plan
 
 def cb_is_paid_plan(customer: Customer, subscription: Subscription, cb_instance):
-    is_paid_plan = False
-    prefixes = [ 'email-' ] if cb_instance.__contains__('tasman') else [ 'plan-av', 'plan-bv', 'plan-cv', 'complimentary-plan-' ] if cb_instance.__contains__('msgco') else ''
-    plan_types = [ 'plan' ] if cb_instance.__contains__('tasman') else [ 'plan', 'addon', 'charge' ] if cb_instance.__contains__('msgco') else None
+    plan = cb_plan_classify(cb_instance, customer, subscription)
 
-    try:
-        if subscription.subscription_items is None:
-            raise Exception('No subscription items')
-    except (Exception) as e:
-        return res_body(status_code=422, msg=f"{ e } | User", data=f" { customer.email }",  api_src='chargebee')
-    
-    for plan in subscription.subscription_items:
-        if plan.item_type in plan_types and any(plan.item_price_id.lower().startswith(prefix) for prefix in prefixes):
-            # is_paid_plan = False if 'legacy'.lower() in plan.item_price_id.lower() else True
-            is_paid_plan = True
-            logger.debug(f"Plan Name: { plan.item_price_id.lower() } | Subscription Item ID: { subscription.id } | Is Paid Plan: { is_paid_plan }")
-                
-    return is_paid_plan
+    return plan.is_email and plan.is_paid if isinstance(plan, PlanClass) else plan
 
 def cb_customer_marked_as_already_selected_paid_plan(customer: Customer):
     try:
@@ -782,14 +928,16 @@ def cb_customer_already_paying_with_provider(customer: Customer):
 
     return True
 
-def cb_active_subscriptions_fully_paid(customer: Union[Customer, str]):
+async def cb_active_subscriptions_fully_paid(cb_client: ChargebeeClient, customer: Union[Customer, str]):
     total_amount_due = 0
 
-    for plan in cb_all_subscriptions(customer):
-        if plan.status in [ 'active', 'future', 'non_renewing' ]:
-            total_amount_due += plan.due_invoices_count
-        else:
-            return res_body(status_code=500, msg=f'No active subscriptions | User: { customer if isinstance(customer, str) else customer.email }', api_src='chargebee')
+    # a lapsed subscription settles it, so stop there rather than paging through the rest
+    async with aclosing(cb_subscriptions(cb_client, customer)) as subscriptions:
+        async for plan in subscriptions:
+            if plan.status in [ 'active', 'future', 'non_renewing' ]:
+                total_amount_due += plan.due_invoices_count
+            else:
+                return res_body(status_code=500, msg=f'No active subscriptions | User: { customer if isinstance(customer, str) else customer.email }', api_src='chargebee')
 
     if total_amount_due == 0:
         return True, total_amount_due
@@ -797,20 +945,21 @@ def cb_active_subscriptions_fully_paid(customer: Union[Customer, str]):
     return False, total_amount_due
 
 def cb_is_active_subscription(subscription: Subscription):
-    logger.debug(f"Subscription { subscription }")
+    logger.debug('Subscription %s', subscription)
 
     if subscription.status in [ 'active', 'non_renewing' ]:
-        logger.debug(f"Is Active Subscription")
+        logger.debug('Is Active Subscription')
         return True
     else:
-        logger.debug(f"Is Not Active Subscription")
+        logger.debug('Is Not Active Subscription')
         return False
 
-def cancel_active_sponsored_subs_for_customer_other_than(content: Dict, cb_instance):
+async def cancel_active_sponsored_subs_for_customer_other_than(content: Dict, cb_instance, cb_client: ChargebeeClient):
     customer = Customer(**content.get('customer'))
     subscription = Subscription(**content.get('subscription'))
 
-    plan_types = [ 'plan' ] if cb_instance.__contains__('tasman') else [ 'plan', 'addon', 'charge' ] if cb_instance.__contains__('msgco') else None
+    plan_types = plan_catalog.tenant(cb_instance).item_types
+    ctx = event_context.get()
 
     try:
         if subscription.subscription_items is None:
@@ -821,19 +970,19 @@ def cancel_active_sponsored_subs_for_customer_other_than(content: Dict, cb_insta
     for plan in subscription.subscription_items:
         if plan.item_type in plan_types:
             new_plan_price = plan.unit_price
-            logger.debug(f"New Plan | Item Price ID: { plan.item_price_id }, Unit Price: { plan.unit_price }")
+            logger.debug('New Plan | Item Price ID: %s, Unit Price: %s', plan.item_price_id, plan.unit_price)
 
-    for plan in cb_all_subscriptions(customer, { 'status[is]': 'active' }):
+    for plan in await cb_all_subscriptions(cb_client, customer, { 'status[is]': 'active' }):
         if plan.id != subscription.id:
             for sub_item in plan.subscription_items:
                 if sub_item.item_type in plan_types:
-                    logger.debug(f"Subscription Item | Item Price ID: { sub_item.item_price_id } | Unit Pirce: { sub_item.unit_price } | Item Type: { sub_item.item_type }")
+                    logger.debug('Subscription Item | Item Price ID: %s | Unit Pirce: %s | Item Type: %s', sub_item.item_price_id, sub_item.unit_price, sub_item.item_type)
                     if sub_item.item_price_id == 'email-account-AUD-Monthly' and sub_item.unit_price == 0:
                         cancel_reason = 'Duplicate Subscription'
                         if new_plan_price > 0 and sub_item.unit_price == 0:
                             cancel_reason = "Moved to a Paid Plan"
                         try:
-                            chargebee.Subscription.cancel_for_items(plan.id, {
+                            await cb_client.subscription_cancel_for_items(plan.id, {
                                 'end_of_term': False,
                                 'credit_option_for_current_term_charges': 'None',
                                 "unbilled_charges_option": 'Delete',
@@ -843,17 +992,20 @@ def cancel_active_sponsored_subs_for_customer_other_than(content: Dict, cb_insta
                             })
                         except (Exception) as e:
                             return res_body(status_code=500, msg=str(e), api_src='chargebee')
-                        logger.info(f"Cancelled subscription { plan.id }: { cancel_reason }")                      
+                        ctx.invalidate_subscriptions(customer.id) if ctx is not None else None
+                        subscription_cache.invalidate_customer(tenant_of(cb_instance), customer.id)
+                        logger.info('Cancelled subscription %s: %s', plan.id, cancel_reason)                      
                     else:
-                        logger.info(f"Subscription doesn't quality for cancellation: { plan.id }")
+                        logger.info("Subscription doesn't quality for cancellation: %s", plan.id)
                 else:
-                    logger.info(f"Found subscription to not delete: { customer.email } | { customer.id }")
+                    logger.info('Found subscription to not delete: %s | %s', customer.email, customer.id)
 
-def modify_cos_profile(secrets, cb_instance, customer: Customer, subscription: Subscription, payload: ChargebeeWebhookPayload):
-    logger.debug(f"Customer { customer }")
-    logger.debug(f"Subscription { subscription }")
+@traced()
+async def modify_cos_profile(secrets, cb_instance, customer: Customer, subscription: Subscription, payload: ChargebeeWebhookPayload):
+    logger.debug('Customer %s', customer)
+    logger.debug('Subscription %s', subscription)
     
-    _, _, _, get_ms_account = mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
+    _, _, _, get_ms_account = await mailserver_api(secrets, 'GET', 'view', customer, 'account_status')
     storage_usage = get_ms_account.mailUsedBytes + get_ms_account.fileUsedBytes
 
     try:
@@ -862,6 +1014,7 @@ def modify_cos_profile(secrets, cb_instance, customer: Customer, subscription: S
         return res_body(status_code=500, msg='No COS profiles returned from mailserver', api_src='mailserver')
     
     include_storage, new_cos_profile_name = cb_plan_check(cb_instance, subscription)
+    tracer.current_span().set_attributes(customer=customer.id, cos_profile=new_cos_profile_name, storage=include_storage)
 
     try:
         new_cos_profile = next((profile for profile in cos_profiles if profile.name == new_cos_profile_name), None)
@@ -873,21 +1026,21 @@ def modify_cos_profile(secrets, cb_instance, customer: Customer, subscription: S
         return res_body(status_code=422, msg=str(e), api_src='mailserver')
 
     if cb_instance.__contains__('msgco'):
-        logger.debug(f"Storage used: { storage_usage }, Entitlement: { include_storage }")
+        logger.debug('Storage used: %s, Entitlement: %s', storage_usage, include_storage)
 
         if include_storage == 0:
             # This is an unhandled COS profile / plan combination
             result = { 'status_code': 200, 'msg': 'Unknown COS equivalent, saying OK - probably needs to change in the future'}
         if storage_usage >= include_storage:
-            logger.info(f"Modifying COS will put account over quota. Current usage: { storage_usage } Bytes")
+            logger.info('Modifying COS will put account over quota. Current usage: %s Bytes', storage_usage)
 
     current_cos_profile = next(profile for profile in cos_profiles if profile.active)
-    logger.debug(f"Current COS Profile: { current_cos_profile }")
+    logger.debug('Current COS Profile: %s', current_cos_profile)
 
     if new_cos_profile.name == current_cos_profile.name:
         result = { 'status_code': 200, 'msg': f'Ignored Event: Current COS profile { current_cos_profile } already selected. Skipping update', 'api_src': 'mailserver'}
     else:
-        status_code, action, _, update_ms_account = mailserver_api(secrets, 'POST', 'update', customer, { 'cosProfileId': new_cos_profile.id, 'disableQuotaCheck': 1 })
+        status_code, action, _, update_ms_account = await mailserver_api(secrets, 'POST', 'update', customer, { 'cosProfileId': new_cos_profile.id, 'disableQuotaCheck': 1 })
         result = { 'status_code': status_code, 'msg': f'{ action.capitalize() } Success ! { current_cos_profile.name } => { new_cos_profile.name }', 'data': payload.content, 'object': update_ms_account, 'api_src': 'mailserver' }
 
     return result
@@ -919,4 +1072,4 @@ def validation(event_type: str, content: Dict):
         if invoice.id == '' or invoice.customer_id == '':
             return res_body(status_code=422, msg=f"{ 'Invoice ID' if invoice.id == '' else 'Customer ID' } is empty.", data=f"{ 'id', invoice.id if invoice.id == '' else invoice.customer_id }", api_src='chargebee')
         
-    logger.debug(f"Validation: { event_type.title().replace('_', ' ') } Success!")
+    logger.debug('Validation: %s Success!', event_type.title().replace('_', ' '))
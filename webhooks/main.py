@@ -1,22 +1,77 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import PlainTextResponse
 from webhooks.chargebee import chargebee
-from .utils.auth import get_secrets
-import sys
+from webhooks.chargebee.v2.endpoints.management import process_event, event_coalescer
+from .utils.accounts import account_index
+from .utils.cache import account_cache, subscription_cache
+from .utils.clients import mailserver_client, chargebee_gateway
+from .utils.dead_letter import dead_letter_store
+from .utils.event_queue import event_queue, EventWorkers
+from .utils.idempotency import idempotency_store
+from .utils.metrics import UNKNOWN, metrics, observe_event, http_in_flight
+from .utils.scheduler import customer_scheduler
+from .utils.secrets import secrets_provider
+from .utils.timing import request_scope
+from .utils.tracing import tracer
+from .utils.versions import version_index
+import os, sys
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        app.state.secrets = get_secrets()
+        await secrets_provider.start()
     except (Exception) as e:
         sys.exit(1)
+    app.state.secrets = secrets_provider
+    tracer.configure()
+    await mailserver_client.open()
+    await chargebee_gateway.open()
+    idempotency_store.open()
+    dead_letter_store.open()
+    version_index.open()
+    account_index.open()
+    if os.environ.get('WEBHOOK_MODE') == 'queue':
+        event_queue.open()
+        app.state.workers = EventWorkers(event_queue, lambda cb_instance, content: process_event(app.state.secrets, cb_instance, content))
+        app.state.workers.start()
     yield
+    if os.environ.get('WEBHOOK_MODE') == 'queue':
+        await app.state.workers.stop()
+        event_queue.close()
+    idempotency_store.close()
+    dead_letter_store.close()
+    version_index.close()
+    account_index.close()
+    await chargebee_gateway.close()
+    await mailserver_client.close()
+    await secrets_provider.stop()
+    tracer.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def server_timing(req: Request, call_next):
+    with request_scope() as request, http_in_flight.track():
+        # webhooks are counted under a fixed label until the endpoint names the tenant and event it has authorized and resolved
+        if req.url.path.startswith('/webhooks/'):
+            request.tenant = request.event_type = UNKNOWN
+
+        try:
+            response = await call_next(req)
+        except (Exception):
+            # unhandled errors still count, as the 500 the server will answer with
+            observe_event('http', request.tenant, request.event_type, 500, request.elapsed())
+            raise
+
+        response.headers['Server-Timing'] = request.server_timing()
+        observe_event('http', request.tenant, request.event_type, response.status_code, request.elapsed())
+
+    return response
+
 @app.get("/")
 async def read_root():
     return [ "Root" ]
@@ -26,4 +81,20 @@ async def health_check(response: Response):
     response.status_code = status.HTTP_200_OK 
     return { "message": "Health Check", "status": "ok" }
 
+@app.get("/health/cache")
+async def cache_stats():
+    return { "accounts": account_cache.stats(), "subscriptions": subscription_cache.stats(), "idempotency": idempotency_store.stats(), "versions": version_index.stats(), "secrets": secrets_provider.stats(), "index": account_index.stats() }
+
+@app.get("/health/queue")
+async def queue_stats():
+    return { "mode": os.environ.get('WEBHOOK_MODE', 'inline'), "events": event_queue.stats() if os.environ.get('WEBHOOK_MODE') == 'queue' else {}, "customers": customer_scheduler.stats(), "coalescing": event_coalescer.stats(), "dead_letters": dead_letter_store.stats() }
+
+@app.get("/health/upstreams")
+async def upstream_stats():
+    return { "mailserver": mailserver_client.stats(), "chargebee": chargebee_gateway.stats() }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 app.include_router(chargebee.router, prefix="/webhooks/chargebee")
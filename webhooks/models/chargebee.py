@@ -216,6 +216,7 @@ class Customer(BaseModel):
     cf_has_selected_a_paid_plan: Optional[str] = None
     cf_reactivation_service_exempted: Optional[str] = None
     cf_customer_passcode: Optional[str] = None
+    resource_version: Optional[datetime] = None
 
 class SubscriptionItems(BaseModel):
     item_price_id: str
@@ -261,6 +262,8 @@ class Payment(BaseModel):
     subscription: Subscription
 
 class ChargebeeWebhookPayload(BaseModel):
+    id: Optional[str] = None
+    occurred_at: Optional[datetime] = None
     event_type: str
     webhook_status: str
     content: Dict
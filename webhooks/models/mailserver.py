@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Dict, List, Optional, Union
 from datetime import datetime
 
@@ -46,4 +46,56 @@ class MailServer(BaseModel):
     quotaStatus: Optional[str] = None
     disableQuotaCheck: Optional[str] = None
     account_status_updated_at: Optional[datetime] = None
-    
\ No newline at end of file
+
+    def with_update(self, data: Dict):
+        # mirror a successful `accounts/update` on a snapshot, or None when the change can't be applied locally
+        fields = {}
+
+        for k, v in data.items():
+            if k == 'cosProfileId':
+                if not any(profile.id == int(v) for cos in self.cosProfile for profile in cos.profile):
+                    return None
+                fields['cosProfile'] = [
+                    cos.model_copy(update={ 'profile': [ profile.model_copy(update={ 'active': profile.id == int(v) }) for profile in cos.profile ] })
+                    for cos in self.cosProfile
+                ]
+            elif k in MailServer.model_fields and k not in [ 'accountId', 'username' ]:
+                fields[k] = str(v) if v is not None else None
+            else:
+                return None
+
+        return self.model_copy(update=fields)
+
+class AccountState(BaseModel):
+    # desired account fields; anything left unset is "don't care"
+    model_config = ConfigDict(extra='allow')
+
+    account_status: Optional[str] = None
+    billingCode: Optional[str] = None
+    cosProfileId: Optional[int] = None
+    disableQuotaCheck: Optional[Union[int, str]] = None
+
+    def merge(self, data: Dict):
+        return AccountState(**{ **self.fields(), **data })
+
+    def fields(self):
+        return self.model_dump(exclude_unset=True)
+
+    def diff(self, account: Optional[MailServer]):
+        # only the fields that differ from the account as the mail server last reported it
+        if account is None:
+            return self.fields()
+
+        changes = {}
+
+        for k, v in self.fields().items():
+            if k == 'cosProfileId':
+                current = next((profile.id for cos in account.cosProfile for profile in cos.profile if profile.active), None)
+            else:
+                current = getattr(account, k, None)
+
+            if str(current if current is not None else '') != str(v if v is not None else ''):
+                changes[k] = v
+
+        return changes
+
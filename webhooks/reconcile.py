@@ -0,0 +1,286 @@
+from argparse import ArgumentParser
+from contextlib import aclosing
+from fastapi import HTTPException
+from webhooks.models.chargebee import Customer, Subscription
+from webhooks.models.mailserver import MailServer
+from webhooks.utils.accounts import account_index
+from webhooks.utils.auth import tenant_secrets
+from webhooks.utils.clients import ChargebeeClient, chargebee_gateway, mailserver_client
+from webhooks.utils.helpers import mailserver_api
+from webhooks.utils.plans import plan_catalog
+from webhooks.utils.ratelimit import background
+from webhooks.utils.registry import tenant_of
+from webhooks.utils.secrets import secrets_provider
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
+import os, sys, json, time, asyncio, logging, chargebee
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ( 'active', 'non_renewing' )
+CURRENT = ( 'active', 'future', 'non_renewing' )
+RESTRICTED = ( 'rstrBilling', 'rstrFrozen', 'disabled', 'deleted' )
+INTERNAL_DOMAINS = ( '@themessaging.co', '@team.atmail.com' )
+STATS = ( 'processed', 'changed', 'unchanged', 'missing', 'skipped', 'failed' )
+
+
+class Expected(NamedTuple):
+    # account_status lists the statuses that are already fine, the first one is what gets set otherwise (the handlers' `sub_status_set`)
+    account_status: Tuple[str, ...] = ()
+    cos_profile: Optional[str] = None
+    billing_code: Optional[str] = None
+
+
+def expected_state(cb_instance: str, customer: Customer, subscriptions: List[Subscription]) -> Expected:
+    # where the webhook handlers would have left the account; subscriptions are newest first
+    tenant = plan_catalog.tenant(cb_instance)
+    email = [ (subscription, plan) for subscription in subscriptions if (plan := tenant.classify(subscription.subscription_items)).is_email ]
+
+    if tenant_of(cb_instance) == 'tasman':
+        active = [ (subscription, plan) for subscription, plan in email if subscription.status in ACTIVE ]
+
+        if active:
+            return Expected(( 'active', ), active[0][1].cos_profile, customer.id)
+        if email:
+            plan = email[0][1]
+            return Expected(( 'rstrBilling', 'rstrFrozen' ) if plan.plan_family == 'email-tasman' else ( 'rstrBilling', ), plan.cos_profile, customer.id)
+
+        return Expected(billing_code=customer.id)
+
+    billing_code = None if customer.email.lower().endswith(INTERNAL_DOMAINS) else customer.id
+    paid = [ (subscription, plan) for subscription, plan in email if plan.is_paid and subscription.status in CURRENT ]
+
+    if not paid:
+        return Expected(billing_code=billing_code)
+
+    amount_owed = sum(subscription.due_invoices_count or 0 for subscription in subscriptions if subscription.status in CURRENT)
+    started = [ plan for subscription, plan in paid if subscription.status != 'future' ]
+    cos_profile = max(started, key=lambda plan: plan.storage).cos_profile if started else None
+
+    return Expected(( 'active', ) if amount_owed < 50 else RESTRICTED, cos_profile, billing_code)
+
+def account_changes(expected: Expected, account: MailServer) -> Dict:
+    changes = {}
+
+    if expected.account_status and account.account_status not in expected.account_status:
+        changes['account_status'] = expected.account_status[0]
+
+    if expected.billing_code is not None and account.billingCode != expected.billing_code:
+        changes['billingCode'] = expected.billing_code
+
+    if expected.cos_profile:
+        profile = next((profile for cos in account.cosProfile for profile in cos.profile if profile.name == expected.cos_profile), None)
+        if profile is None:
+            raise ValueError(f'Unknown COS profile name: { expected.cos_profile }')
+        if not profile.active:
+            changes.update({ 'cosProfileId': profile.id, 'disableQuotaCheck': 1 })
+
+    return changes
+
+
+class Checkpoint:
+    # the Chargebee offset of the first customer page not fully reconciled yet, plus running totals
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, cb_instance: str) -> Dict:
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError):
+            return {}
+
+        return state if state.get('cb_instance') == cb_instance and not state.get('complete') else {}
+
+    def save(self, state: Dict):
+        # write-then-rename so an interrupted run never leaves half a checkpoint behind
+        tmp = f'{ self.path }.tmp'
+
+        with open(tmp, 'w') as f:
+            json.dump({ **state, 'updated_at': datetime.now(timezone.utc).isoformat() }, f)
+        os.replace(tmp, self.path)
+
+
+class Reconciler:
+    def __init__(self, cb_instance: str, secrets: Dict, checkpoint: Checkpoint,
+        concurrency: int=int(os.environ.get('RECONCILE_CONCURRENCY', 16)),
+        page_size: int=int(os.environ.get('RECONCILE_PAGE_SIZE', 100)),
+        progress_interval: float=float(os.environ.get('RECONCILE_PROGRESS_INTERVAL', 10)),
+        dry_run: bool=False
+    ):
+        self.cb_instance = cb_instance
+        self.secrets = secrets
+        self.client: ChargebeeClient = secrets['chargebee']
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.dry_run = dry_run
+        self.stats = dict.fromkeys(STATS, 0)
+        self.pages: Dict[int, list] = {}
+        self.offset: Optional[str] = None
+        self.processed = 0
+        self.started = time.monotonic()
+
+    async def customer_pages(self, offset: Optional[str]):
+        # a page of customers and every subscription they hold, in two list calls per page instead of one per customer
+        params = { 'sort_by[asc]': 'created_at' }
+        params.update({ 'offset': offset }) if offset else params
+
+        async with aclosing(self.client.pages(chargebee.Customer.list, params, self.page_size)) as pages:
+            async for customers in pages:
+                subscriptions = await self.subscriptions([ entry._response['customer']['id'] for entry in customers ]) if len(customers) else {}
+
+                yield customers.next_offset, [ (entry._response['customer'], subscriptions.get(entry._response['customer']['id'], [])) for entry in customers ]
+
+    async def subscriptions(self, customer_ids: List[str]):
+        by_customer: Dict[str, List[Subscription]] = {}
+
+        async for subscription in self.client.subscriptions({ 'customer_id[in]': json.dumps(customer_ids), 'sort_by[desc]': 'created_at' }):
+            by_customer.setdefault(subscription.customer_id, []).append(subscription)
+
+        return by_customer
+
+    async def reconcile_customer(self, content: Dict, subscriptions: List[Subscription]):
+        try:
+            customer = Customer(**content)
+        except (Exception) as e:
+            logger.warning('Reconcile skipped customer %s: %s', content.get('id'), e)
+            return 'skipped'
+
+        try:
+            _, _, _, account = await mailserver_api(self.secrets, 'GET', 'view', customer, 'account_status')
+            changes = account_changes(expected_state(self.cb_instance, customer, subscriptions), account)
+
+            if not changes:
+                return 'unchanged'
+
+            logger.info('Reconcile %s: %s%s', customer.email, changes, ' (dry run)' if self.dry_run else '')
+            await mailserver_api(self.secrets, 'POST', 'update', customer, changes) if not self.dry_run else None
+        except (HTTPException) as e:
+            return 'missing' if e.status_code == 501 else 'failed'
+        except (Exception) as e:
+            logger.warning('Reconcile failed for %s: %s', customer.email, e)
+            return 'failed'
+
+        return 'changed'
+
+    def done(self, page: int):
+        self.pages[page][0] -= 1
+        self.advance()
+
+    def advance(self):
+        # pages finish out of order; the checkpoint only moves past a page once it and every page before it are done
+        while self.pages and self.pages[min(self.pages)][0] == 0:
+            _, next_offset = self.pages.pop(min(self.pages))
+            if next_offset is not None:
+                self.offset = next_offset
+                self.save()
+
+    def save(self, complete: bool=False):
+        self.checkpoint.save({ 'cb_instance': self.cb_instance, 'offset': self.offset, 'complete': complete, **self.stats })
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started
+        logger.info('Reconcile %s | %s | %.1f customers/s', self.cb_instance, ' | '.join(f'{ k }: { v }' for k, v in self.stats.items()), self.processed / elapsed if elapsed else 0)
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.progress()
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            page, content, subscriptions = await queue.get()
+            try:
+                outcome = await self.reconcile_customer(content, subscriptions)
+                self.stats['processed'] += 1
+                self.stats[outcome] += 1
+                self.processed += 1
+                self.done(page)
+            finally:
+                queue.task_done()
+
+    async def run(self):
+        state = self.checkpoint.load(self.cb_instance)
+        self.offset = state.get('offset')
+        self.stats.update({ k: state.get(k, 0) for k in STATS })
+
+        logger.info('Reconcile %s | Concurrency: %s | Page Size: %s | %s', self.cb_instance, self.concurrency, self.page_size, f'Resuming at offset { self.offset }' if self.offset else 'Starting from the first customer')
+
+        # bounded so listing stays at most a couple of pages ahead of the mail server
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [ asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency) ]
+        reporter = asyncio.create_task(self.report())
+
+        try:
+            async for page, (next_offset, customers) in aenumerate(self.customer_pages(self.offset)):
+                self.pages[page] = [ len(customers), next_offset ]
+                self.advance()
+                for content, subscriptions in customers:
+                    await queue.put((page, content, subscriptions))
+
+            await queue.join()
+        finally:
+            for task in [ *workers, reporter ]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+
+        self.save(complete=True)
+        self.progress()
+
+        return self.stats
+
+
+async def aenumerate(iterator):
+    n = 0
+
+    async for item in iterator:
+        yield n, item
+        n += 1
+
+
+async def reconcile(cb_instance: str, checkpoint: str, restart: bool=False, **options):
+    await asyncio.to_thread(secrets_provider.load)
+    secrets = tenant_secrets(secrets_provider, cb_instance)
+
+    if secrets is None:
+        raise SystemExit(f'Unknown Chargebee instance: { cb_instance }')
+
+    checkpoint = Checkpoint(checkpoint)
+    os.remove(checkpoint.path) if restart and os.path.exists(checkpoint.path) else None
+
+    # every account the sweep views or updates also refreshes the local index
+    account_index.open()
+
+    try:
+        with background():
+            return await Reconciler(cb_instance, secrets, checkpoint, **options).run()
+    finally:
+        account_index.close()
+        await mailserver_client.close()
+        await chargebee_gateway.close()
+
+
+def main(argv: List[str]=None):
+    parser = ArgumentParser(prog='python -m webhooks.reconcile', description='Bring mail server accounts in line with Chargebee subscriptions')
+    parser.add_argument('cb_instance', help='Chargebee site, e.g. msgco or tasman-test')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('RECONCILE_CONCURRENCY', 16)), help='customers reconciled at once')
+    parser.add_argument('--page-size', type=int, default=int(os.environ.get('RECONCILE_PAGE_SIZE', 100)), help='customers per Chargebee list call (max 100)')
+    parser.add_argument('--checkpoint', help='checkpoint file, defaults to reconcile-<cb_instance>.json')
+    parser.add_argument('--progress-interval', type=float, default=float(os.environ.get('RECONCILE_PROGRESS_INTERVAL', 10)), help='seconds between progress reports')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the first customer')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing them')
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(reconcile(
+        args.cb_instance, args.checkpoint or f'reconcile-{ args.cb_instance }.json', args.restart,
+        concurrency=args.concurrency, page_size=min(args.page_size, 100), progress_interval=args.progress_interval, dry_run=args.dry_run
+    ))
+
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
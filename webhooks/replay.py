@@ -0,0 +1,145 @@
+from argparse import ArgumentParser
+from collections import Counter
+from webhooks.chargebee.v2.endpoints.management import process_event
+from webhooks.utils.accounts import account_index
+from webhooks.utils.clients import chargebee_gateway, mailserver_client
+from webhooks.utils.dead_letter import DeadLetterStore, dead_letter_store
+from webhooks.utils.ratelimit import background
+from webhooks.utils.secrets import secrets_provider
+from webhooks.utils.versions import version_index
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import os, sys, time, asyncio, logging
+
+
+logger = logging.getLogger(__name__)
+
+STATS = ( 'processed', 'replayed', 'failed' )
+
+
+class Replayer:
+    def __init__(self, app_secrets, store: DeadLetterStore,
+        concurrency: int=int(os.environ.get('REPLAY_CONCURRENCY', 8)),
+        progress_interval: float=float(os.environ.get('REPLAY_PROGRESS_INTERVAL', 10))
+    ):
+        self.app_secrets = app_secrets
+        self.store = store
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.stats = dict.fromkeys(STATS, 0)
+        self.started = time.monotonic()
+
+    async def replay(self, letter: Dict):
+        # same entrypoint as the queue workers, so coalescing and per-customer ordering apply; with VERSION_INDEX_PATH shared with
+        # the server, a dead letter older than what was applied live since is dropped, not re-applied
+        try:
+            response = await process_event(self.app_secrets, letter.get('cb_instance'), letter.get('payload'))
+        except (Exception) as e:
+            self.store.failed(letter.get('id'), str(e) or type(e).__name__)
+            logger.warning('Replay failed for %s %s (%s): %s', letter.get('cb_instance'), letter.get('event_id'), letter.get('event_type'), e)
+            return 'failed'
+
+        self.store.replayed(letter.get('id'), response)
+        return 'replayed'
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started
+        logger.info('Replay | %s | %.1f events/s', ' | '.join(f'{ k }: { v }' for k, v in self.stats.items()), self.stats['processed'] / elapsed if elapsed else 0)
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.progress()
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            letter = await queue.get()
+            try:
+                outcome = await self.replay(letter)
+                self.stats['processed'] += 1
+                self.stats[outcome] += 1
+            finally:
+                queue.task_done()
+
+    async def run(self, letters: List[Dict]):
+        logger.info('Replay | Events: %s | Concurrency: %s', len(letters), self.concurrency)
+
+        # oldest first off a shared queue, so a customer's events reach the scheduler in the order they happened
+        queue = asyncio.Queue()
+        for letter in letters:
+            queue.put_nowait(letter)
+
+        workers = [ asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency) ]
+        reporter = asyncio.create_task(self.report())
+
+        try:
+            await queue.join()
+        finally:
+            for task in [ *workers, reporter ]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+
+        self.progress()
+
+        return self.stats
+
+
+def timestamp(value: Optional[str]):
+    if value is None:
+        return None
+
+    moment = datetime.fromisoformat(value)
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+
+async def replay(tenant: str=None, event_types: List[str]=None, since: str=None, until: str=None, limit: int=None, dry_run: bool=False, **options):
+    letters = dead_letter_store.select(tenant=tenant, event_types=event_types, since=timestamp(since), until=timestamp(until), limit=limit)
+
+    if dry_run or not letters:
+        for (cb_instance, event_type), count in sorted(Counter((letter.get('cb_instance'), letter.get('event_type')) for letter in letters).items()):
+            logger.info('Replay (dry run) | %s | %s: %s', cb_instance, event_type, count)
+        return { 'processed': 0, 'replayed': 0, 'failed': 0, 'selected': len(letters) }
+
+    await asyncio.to_thread(secrets_provider.load)
+    account_index.open()
+
+    if version_index.open().conn is None:
+        logger.warning('Replay | VERSION_INDEX_PATH is not set, events are replayed without checking for newer versions')
+
+    try:
+        with background():
+            return { **await Replayer(secrets_provider, dead_letter_store, **options).run(letters), 'selected': len(letters) }
+    finally:
+        account_index.close()
+        version_index.close()
+        await mailserver_client.close()
+        await chargebee_gateway.close()
+
+
+def main(argv: List[str]=None):
+    parser = ArgumentParser(prog='python -m webhooks.replay', description='Re-drive dead-lettered Chargebee webhook events through the handlers')
+    parser.add_argument('--tenant', help='tenant or Chargebee site, e.g. msgco or tasman-test')
+    parser.add_argument('--event-type', action='append', dest='event_types', help='only this event type, may be repeated')
+    parser.add_argument('--since', help='only events that failed at or after this ISO time (UTC unless given)')
+    parser.add_argument('--until', help='only events that failed before this ISO time (UTC unless given)')
+    parser.add_argument('--limit', type=int, help='replay at most this many events, oldest first')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('REPLAY_CONCURRENCY', 8)), help='events replayed at once')
+    parser.add_argument('--progress-interval', type=float, default=float(os.environ.get('REPLAY_PROGRESS_INTERVAL', 10)), help='seconds between progress reports')
+    parser.add_argument('--dry-run', action='store_true', help='list the matching events without replaying them')
+    args = parser.parse_args(argv)
+
+    try:
+        stats = asyncio.run(replay(
+            args.tenant, args.event_types, args.since, args.until, args.limit, args.dry_run,
+            concurrency=args.concurrency, progress_interval=args.progress_interval
+        ))
+    finally:
+        dead_letter_store.close()
+
+    logger.info('Replay | Selected: %s | Replayed: %s | Failed: %s', stats['selected'], stats['replayed'], stats['failed'])
+
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+from webhooks.models.mailserver import MailServer
+from webhooks.utils.log import setup_logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import os, sys, json, time, logging, sqlite3, threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class AccountRecord(NamedTuple):
+    account_id: str
+    username: str
+    billing_code: Optional[str] = None
+    account_status: Optional[str] = None
+    cos_profile_id: Optional[int] = None
+
+
+def account_record(account: Dict) -> AccountRecord:
+    # accepts a mail server account as `accounts/view` or the bulk export returns it
+    cos_profile_id = next((profile.get('id') for cos in account.get('cosProfile') or [] for profile in cos.get('profile') or [] if profile.get('active')), None)
+
+    return AccountRecord(str(account['accountId']), account['username'].lower(), account.get('billingCode') or None, account.get('account_status'), cos_profile_id)
+
+
+class AccountIndex:
+    # username, accountId and billingCode -> compact account record, so lookups by Chargebee customer id never go to the mail server
+    COLUMNS = { 'billingCode': 'billing_code', 'account_status': 'account_status', 'cosProfileId': 'cos_profile_id' }
+
+    def __init__(self, path: Optional[str]=os.environ.get('ACCOUNT_INDEX_PATH')):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.conn is not None
+
+    def open(self):
+        if self.path is None or self.conn is not None:
+            return self
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id TEXT PRIMARY KEY,
+                username TEXT NOT NULL UNIQUE,
+                billing_code TEXT,
+                account_status TEXT,
+                cos_profile_id INTEGER,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS accounts_billing_code ON accounts (billing_code) WHERE billing_code IS NOT NULL')
+
+        logger.info('Account Index | Path: %s | Accounts: %s', self.path, self.count())
+
+        return self
+
+    def close(self):
+        conn, self.conn = self.conn, None
+
+        if conn is not None:
+            conn.close()
+
+    def upsert(self, records: Iterable[AccountRecord]):
+        now = time.time()
+
+        with self.lock:
+            # a username can move to a new accountId after a re-create, so the old row has to go first
+            self.conn.execute('BEGIN')
+            try:
+                for record in records:
+                    self.conn.execute('DELETE FROM accounts WHERE username = ? AND account_id != ?', (record.username, record.account_id))
+                    self.conn.execute('INSERT OR REPLACE INTO accounts (account_id, username, billing_code, account_status, cos_profile_id, updated_at) VALUES (?, ?, ?, ?, ?, ?)', (*record, now))
+                self.conn.execute('COMMIT')
+            except (BaseException):
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def load(self, accounts: Iterable[Dict], batch: int=5000):
+        # bulk export: one transaction per batch keeps a large import from holding the write lock for its whole run
+        loaded, records = 0, []
+
+        for account in accounts:
+            records.append(account_record(account))
+            if len(records) >= batch:
+                self.upsert(records)
+                loaded, records = loaded + len(records), []
+
+        self.upsert(records)
+
+        return loaded + len(records)
+
+    def observe(self, account: MailServer):
+        if self.conn is not None:
+            self.upsert([ account_record(account.model_dump(mode='json')) ])
+
+    def update(self, username: str, data: Dict):
+        # mirror a successful `accounts/update`; fields the index doesn't hold are ignored
+        fields = { self.COLUMNS[k]: v if v != '' else None for k, v in data.items() if k in self.COLUMNS }
+
+        if self.conn is None or not fields:
+            return
+
+        with self.lock:
+            self.conn.execute(f"UPDATE accounts SET { ', '.join(f'{ column } = ?' for column in fields) }, updated_at = ? WHERE username = ?", (*fields.values(), time.time(), username.lower()))
+
+    def find(self, column: str, value) -> List[AccountRecord]:
+        if self.conn is None or value is None:
+            return []
+
+        rows = self.conn.execute(f'SELECT account_id, username, billing_code, account_status, cos_profile_id FROM accounts WHERE { column } = ?', (value,)).fetchall()
+        self.hits, self.misses = (self.hits + 1, self.misses) if rows else (self.hits, self.misses + 1)
+
+        return [ AccountRecord(*row) for row in rows ]
+
+    def by_username(self, username: str) -> Optional[AccountRecord]:
+        return next(iter(self.find('username', username.lower())), None)
+
+    def by_account_id(self, account_id: str) -> Optional[AccountRecord]:
+        return next(iter(self.find('account_id', str(account_id))), None)
+
+    def by_billing_code(self, billing_code: str) -> List[AccountRecord]:
+        return self.find('billing_code', billing_code)
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM accounts').fetchone()[0] if self.conn is not None else 0
+
+    def stats(self):
+        return { 'enabled': self.enabled, 'accounts': self.count(), 'hits': self.hits, 'misses': self.misses }
+
+
+def read_export(path: str):
+    # a JSON array or JSON lines of mail server account objects
+    with open(path) as f:
+        if f.read(1) == '[':
+            f.seek(0)
+            yield from json.load(f)
+            return
+
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+account_index = AccountIndex()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or account_index.path is None:
+        sys.exit('usage: ACCOUNT_INDEX_PATH=<index.db> python -m webhooks.utils.accounts <export.json>')
+
+    setup_logging()
+    loaded = account_index.open().load(read_export(sys.argv[1]))
+    logger.info('Account Index | Loaded: %s | Accounts: %s', loaded, account_index.count())
+    account_index.close()
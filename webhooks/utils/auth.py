@@ -1,58 +1,36 @@
+from .clients import chargebee_gateway
 from .helpers import logger, res_body
-import os, boto3, chargebee, base64, json
+from .secrets import AwsSecretsBackend, SecretsProvider, build_secrets, merge_tenant
+import os, hmac
 
 
 def get_secrets():
-    session = boto3.Session()
-
     try:
-        cb_secrets = session.client('secretsmanager', region_name='ap-southeast-2').get_secret_value(SecretId='chargebee-secrets')
+        cb_secrets = AwsSecretsBackend().fetch()
     except (Exception) as e:
         return res_body(status_code=403, msg=f'Unauthorized Access! - { str(e) }', api_src='chargebee')
-    
-    cb_secrets = json.loads(cb_secrets['SecretString'])
-
-    secrets = {
-        'msgco': {
-            'api_key': cb_secrets.get("MSGCO_API_KEY"),
-            'wh_username': cb_secrets.get('MSGCO_WEBHOOK_USERNAME'),
-            'wh_password': cb_secrets.get('MSGCO_WEBHOOK_PASSWORD')
-        },
-        'tasman': {
-            'api_key': cb_secrets.get("TASMAN_API_KEY"),
-            'wh_username': cb_secrets.get('TASMAN_WEBHOOK_USERNAME'),
-            'wh_password': cb_secrets.get('TASMAN_WEBHOOK_PASSWORD')
-        },
-        'mailserver': {
-            'api_url': cb_secrets.get('MAILSERVER_URL').replace('[platform]', 'pc5'),
-            'username': cb_secrets.get('MAILSERVER_USERNAME'),
-            'password': cb_secrets.get('MAILSERVER_PASSWORD')
-        }
-    }
-
-    return secrets
+
+    return build_secrets(cb_secrets)
 
 def load_secrets(req, cb_instance):
-    cb_secrets = req.app.state.secrets.get(cb_instance.removesuffix('-test'))
-    ms_secrets = req.app.state.secrets.get('mailserver')
+    return tenant_secrets(req.app.state.secrets, cb_instance)
 
-    secrets = {}
-    secrets.update(cb_secrets)
-    secrets.update(ms_secrets)
+def tenant_secrets(app_secrets, cb_instance):
+    # the provider hands out the tenant's merged secrets prebuilt on refresh; a plain dict (tests) is merged here
+    secrets = app_secrets.tenant(cb_instance) if isinstance(app_secrets, SecretsProvider) else merge_tenant(app_secrets, cb_instance.removesuffix('-test'))
 
-    logger.debug(f'Secrets: { secrets }')
+    logger.debug('Secrets: %s', secrets)
 
-    chargebee.configure(secrets.get('api_key'), cb_instance)
+    if secrets is None:
+        return secrets
 
-    return secrets
+    # the tenant's own Chargebee client travels with its secrets, so concurrent tenants never share SDK state
+    return { **secrets, 'chargebee': chargebee_gateway.client(cb_instance, secrets.get('api_key')) }
 
 def webhook_authorization(secrets, authorization, user_agent):
-    logger.debug(f"================= HTTP REQUEST HEADERS =================\n\t>> Authorization : { authorization }\n\t>> User-Agent : { user_agent }")
-
-    credentials = f"{ secrets.get('wh_username') }:{ secrets.get('wh_password') }"
-    encoded_creds = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
+    logger.debug('================= HTTP REQUEST HEADERS =================\n\t>> Authorization : %s\n\t>> User-Agent : %s', authorization, user_agent)
 
-    if f"Basic { encoded_creds }" != authorization:
+    if not hmac.compare_digest(secrets.get('wh_authorization', '').encode('utf-8'), (authorization or '').encode('utf-8')):
         return res_body(403, "Authentication Failed!") if os.environ.get('TEST_MODE') != 'true' else None
     
     if "ChargeBee" not in user_agent:
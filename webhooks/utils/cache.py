@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from webhooks.models.chargebee import Subscription
+from webhooks.models.mailserver import MailServer
+from typing import Any, Dict, Hashable, List, Optional
+import os, time, threading
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any=None):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def peek(self, key: Hashable, default: Any=None):
+        # read without touching LRU order or counters
+        entry = self.entries.get(key)
+
+        return entry[1] if entry is not None and entry[0] > self.clock() else default
+
+    def set(self, key: Hashable, value: Any, ttl: float=None):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (self.clock() + (ttl if ttl is not None else self.ttl), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'expirations': self.expirations,
+            'evictions': self.evictions
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable):
+        return self.peek(key) is not None
+
+
+class AccountCache(TTLCache):
+    # fields the handlers actually read off a `MailServer` account
+    SLIM_FIELDS = { 'accountId', 'username', 'account_status', 'billingCode', 'cosProfile', 'mailUsedBytes', 'fileUsedBytes', 'disableQuotaCheck' }
+
+    def __init__(self, maxsize: int, ttl: float, slim: bool=False, clock=time.monotonic):
+        super().__init__(maxsize, ttl, clock)
+        self.slim = slim
+
+    def get_account(self, username: str) -> Optional[MailServer]:
+        return self.get(username.lower())
+
+    def set_account(self, username: str, account: Optional[MailServer]):
+        if account is None:
+            return self.pop(username.lower())
+
+        self.set(username.lower(), MailServer(**account.model_dump(include=self.SLIM_FIELDS)) if self.slim else account)
+
+    def update_account(self, username: str, data: Dict):
+        account = self.peek(username.lower())
+        self.set_account(username, account.with_update(data) if account is not None else None)
+
+    def invalidate_account(self, username: str):
+        self.pop(username.lower())
+
+
+class SubscriptionCache(TTLCache):
+    # only plain status filters can be answered from a customer's full subscription list
+    FILTERS = { 'status[is]' }
+
+    def key(self, tenant: str, customer_id: str):
+        # customer ids are only unique within a Chargebee site
+        return f"{ tenant }:{ customer_id }"
+
+    def get_subscriptions(self, tenant: str, customer_id: str, params: Dict=None) -> Optional[List[Subscription]]:
+        if params and not set(params).issubset(self.FILTERS):
+            return None
+
+        subscriptions = self.get(self.key(tenant, customer_id))
+
+        if subscriptions is None:
+            return None
+
+        status = (params or {}).get('status[is]')
+
+        return [ sub for sub in subscriptions.values() if status is None or sub.status == status ]
+
+    def set_subscriptions(self, tenant: str, customer_id: str, subscriptions: List[Subscription]):
+        self.set(self.key(tenant, customer_id), { sub.id: sub for sub in subscriptions })
+
+    def observe(self, tenant: str, subscription: Subscription):
+        # fold a webhook's subscription into an already cached list, rejecting anything older than what we hold
+        key = self.key(tenant, subscription.customer_id)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] <= self.clock():
+                return False
+
+            current = entry[1].get(subscription.id)
+
+            if current is not None and current.resource_version and subscription.resource_version and subscription.resource_version < current.resource_version:
+                return False
+
+            self.entries[key] = (entry[0], { **entry[1], subscription.id: subscription })
+
+        return True
+
+    def invalidate_customer(self, tenant: str, customer_id: str):
+        self.pop(self.key(tenant, customer_id))
+
+
+account_cache = AccountCache(
+    maxsize=int(os.environ.get('MAILSERVER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('MAILSERVER_CACHE_TTL', 60)),
+    slim=os.environ.get('MAILSERVER_CACHE_SLIM', 'true') == 'true'
+)
+
+subscription_cache = SubscriptionCache(
+    maxsize=int(os.environ.get('CHARGEBEE_SUBSCRIPTION_CACHE_SIZE', 5000)),
+    ttl=float(os.environ.get('CHARGEBEE_SUBSCRIPTION_CACHE_TTL', 300))
+)
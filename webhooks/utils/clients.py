@@ -0,0 +1,268 @@
+from chargebee.environment import Environment
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from webhooks.models.chargebee import ChargebeeWebhookPayload, Customer, Subscription, Transaction
+from webhooks.utils.metrics import upstream
+from webhooks.utils.ratelimit import TokenBucket
+from webhooks.utils.resilience import CircuitBreaker, backoff
+from webhooks.utils.timing import timed
+from webhooks.utils.tracing import tracer
+from functools import partial
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import os, time, asyncio, threading, contextvars, logging, httpx, chargebee
+
+
+logger = logging.getLogger(__name__)
+
+
+class MailServerClient:
+    def __init__(self,
+        max_connections: int=int(os.environ.get('MAILSERVER_MAX_CONNECTIONS', 20)),
+        max_keepalive_connections: int=int(os.environ.get('MAILSERVER_MAX_KEEPALIVE_CONNECTIONS', 10)),
+        keepalive_expiry: float=float(os.environ.get('MAILSERVER_KEEPALIVE_EXPIRY', 30)),
+        connect_timeout: float=float(os.environ.get('MAILSERVER_CONNECT_TIMEOUT', 5)),
+        read_timeout: float=float(os.environ.get('MAILSERVER_READ_TIMEOUT', 15)),
+        pool_timeout: float=float(os.environ.get('MAILSERVER_POOL_TIMEOUT', 10)),
+        retries: int=int(os.environ.get('MAILSERVER_RETRIES', 2)),
+        backoff_base: float=float(os.environ.get('MAILSERVER_BACKOFF_BASE', 0.2)),
+        backoff_cap: float=float(os.environ.get('MAILSERVER_BACKOFF_CAP', 2))
+    ):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        # clients are created lazily per host; opening just resets any stale pools left from a previous loop
+        await self.close()
+        logger.info('Mail Server Client | Max Connections (per host): %s | Keep-Alive: %s @ %ss', self.limits.max_connections, self.limits.max_keepalive_connections, self.limits.keepalive_expiry)
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self):
+        return { host: breaker.stats() for host, breaker in self.breakers.items() }
+
+    async def client(self, url: str):
+        host = urlsplit(url).netloc
+        client = self.clients.get(host)
+
+        if client is None or client.is_closed:
+            async with self.lock:
+                client = self.clients.get(host)
+                if client is None or client.is_closed:
+                    client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, verify=True)
+                    self.clients[host] = client
+
+        return client
+
+    def breaker(self, url: str):
+        host = urlsplit(url).netloc
+        breaker = self.breakers.get(host)
+
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker('mailserver', host)
+
+        return breaker
+
+    async def request(self, method: str, url: str, auth: tuple=None, headers: Dict=None, params: Dict=None, timeout: Optional[httpx.Timeout]=None, retries: int=0):
+        client = await self.client(url)
+        breaker = self.breaker(url)
+        observer = upstream('mailserver', url.rsplit('/', 1)[-1])
+
+        for attempt in range(retries + 1):
+            breaker.allow()
+            start, failed = time.perf_counter(), True
+
+            try:
+                with timed('mailserver'):
+                    response = await client.request(method, url, auth=auth, headers=headers, params=params, timeout=timeout or self.timeout)
+                failed = response.is_error
+            except (httpx.TransportError) as e:
+                # timeouts and connection failures: the mail server never answered
+                breaker.failure()
+                if attempt == retries:
+                    raise
+                logger.warning('Mail Server %s %s failed (%s), retry %s/%s', method, url.rsplit('/', 1)[-1], type(e).__name__, attempt + 1, retries)
+            except (BaseException):
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code < 500:
+                    breaker.success()
+                    return response
+                breaker.failure()
+                if attempt == retries:
+                    return response
+                logger.warning('Mail Server %s %s returned %s, retry %s/%s', method, url.rsplit('/', 1)[-1], response.status_code, attempt + 1, retries)
+            finally:
+                observer.observe(time.perf_counter() - start, failed)
+
+            observer.retries.inc()
+            await asyncio.sleep(backoff(attempt, self.backoff_base, self.backoff_cap))
+
+    async def get(self, url: str, **kwargs):
+        # views are idempotent, so they are the only calls worth retrying
+        return await self.request('GET', url, **{ 'retries': self.retries, **kwargs })
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+
+class ChargebeeClient:
+    # one per Chargebee site: the SDK calls get this client's environment passed explicitly, never the process-global one
+    def __init__(self, site: str, api_key: str, max_workers: int, limiter: TokenBucket=None,
+        page_size: int=int(os.environ.get('CHARGEBEE_PAGE_SIZE', 100)),
+        throttle_retries: int=int(os.environ.get('CHARGEBEE_THROTTLE_RETRIES', 3)),
+        retry_after: float=float(os.environ.get('CHARGEBEE_RETRY_AFTER', 60))
+    ):
+        self.site = site
+        self.api_key = api_key
+        self.limiter = limiter or TokenBucket(site)
+        self.page_size = min(page_size, 100)
+        self.throttle_retries = throttle_retries
+        self.retry_after = retry_after
+        self.env = Environment({ 'api_key': api_key, 'site': site })
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'chargebee-{ site }')
+        self.in_flight = 0
+        self.retired = False
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def retire(self):
+        # replaced after a key rotation: calls already running keep the pool until the last one returns
+        self.retired = True
+
+        if self.in_flight == 0:
+            self.executor.shutdown(wait=False)
+
+    async def call(self, func, *args, **kwargs):
+        # every call spends a token from the site's bucket; a 429 was never processed, so it is safe to send again once Chargebee allows
+        for attempt in range(self.throttle_retries + 1):
+            with timed('chargebee_wait'):
+                await self.limiter.acquire()
+
+            try:
+                return await self.send(func, *args, **kwargs)
+            except (chargebee.APIError) as e:
+                if e.http_status_code != 429 or attempt == self.throttle_retries:
+                    raise
+                retry_after = (e.http_headers or {}).get('Retry-After')
+                self.limiter.throttle(float(retry_after) if retry_after and retry_after.isdigit() else self.retry_after)
+
+    async def send(self, func, *args, **kwargs):
+        # the SDK is blocking (requests), so keep it off the event loop on this site's own pool
+        ctx = contextvars.copy_context()
+
+        observer = upstream('chargebee', func.__qualname__)
+        start, failed = time.perf_counter(), True
+        self.in_flight += 1
+
+        try:
+            with tracer.span(f'chargebee.{ func.__qualname__ }', site=self.site, resource_id=args[0] if args and isinstance(args[0], str) else None), timed('chargebee'):
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, partial(ctx.run, func, *args, env=self.env, **kwargs))
+            failed = False
+            return result
+        finally:
+            observer.observe(time.perf_counter() - start, failed)
+            self.in_flight -= 1
+            if self.retired and self.in_flight == 0:
+                self.executor.shutdown(wait=False)
+
+    async def pages(self, func, params: Dict, page_size: int=None):
+        # follows next_offset, fetching the next page while the caller is still working through the current one
+        params = { **params, 'limit': page_size or self.page_size }
+        pending = asyncio.ensure_future(self.call(func, params))
+
+        try:
+            while pending is not None:
+                page = await pending
+                pending = asyncio.ensure_future(self.call(func, { **params, 'offset': page.next_offset })) if page.next_offset else None
+                yield page
+        finally:
+            # the caller stopped early: drop the prefetch instead of leaving it to fail unobserved
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    async def iterate(self, func, key: str, model, params: Dict, page_size: int=None):
+        # entries are only parsed as they are consumed, so stopping early skips the rest of the page too
+        async with aclosing(self.pages(func, params, page_size)) as pages:
+            async for page in pages:
+                for entry in page:
+                    yield model(**entry._response[key])
+
+    def subscriptions(self, params: Dict, page_size: int=None):
+        return self.iterate(chargebee.Subscription.list, 'subscription', Subscription, params, page_size)
+
+    def transactions(self, params: Dict, page_size: int=None):
+        return self.iterate(chargebee.Transaction.list, 'transaction', Transaction, params, page_size)
+
+    def customers(self, params: Dict, page_size: int=None):
+        return self.iterate(chargebee.Customer.list, 'customer', Customer, params, page_size)
+
+    def events(self, params: Dict, page_size: int=None):
+        return self.iterate(chargebee.Event.list, 'event', ChargebeeWebhookPayload, params, page_size)
+
+    async def customer_update(self, id: str, params: Dict):
+        return await self.call(chargebee.Customer.update, id, params)
+
+    async def customer_update_billing_info(self, id: str, params: Dict):
+        return await self.call(chargebee.Customer.update_billing_info, id, params)
+
+    async def subscription_cancel_for_items(self, id: str, params: Dict):
+        return await self.call(chargebee.Subscription.cancel_for_items, id, params)
+
+    async def transaction_list(self, params: Dict):
+        return await self.call(chargebee.Transaction.list, params)
+
+
+class ChargebeeGateway:
+    def __init__(self, max_workers: int=int(os.environ.get('CHARGEBEE_MAX_WORKERS', 8))):
+        self.max_workers = max_workers
+        self.clients: Dict[str, ChargebeeClient] = {}
+        self.limiters: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    async def open(self):
+        await self.close()
+        logger.info('Chargebee Gateway | Max Workers (per site): %s', self.max_workers)
+
+    async def close(self):
+        with self.lock:
+            clients, self.clients, self.limiters = self.clients, {}, {}
+
+        for client in clients.values():
+            client.close()
+
+    def stats(self):
+        return { site: limiter.stats() for site, limiter in self.limiters.items() }
+
+    def client(self, site: str, api_key: str):
+        # created once per site and only replaced when the key rotates
+        client = self.clients.get(site)
+
+        if client is None or client.api_key != api_key:
+            with self.lock:
+                client = self.clients.get(site)
+                if client is None or client.api_key != api_key:
+                    # the rate limit belongs to the site, so its bucket carries over to the new client
+                    limiter = self.limiters.get(site) or self.limiters.setdefault(site, TokenBucket(site))
+                    previous, client = client, ChargebeeClient(site, api_key, self.max_workers, limiter)
+                    self.clients[site] = client
+                    previous.retire() if previous is not None else None
+                    logger.info('Chargebee Client | Site: %s', site)
+
+        return client
+
+
+mailserver_client = MailServerClient()
+chargebee_gateway = ChargebeeGateway()
@@ -0,0 +1,69 @@
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set
+import os, asyncio, logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventCoalescer:
+    def __init__(self, run_batch: Callable[[Hashable, List], Awaitable[List]], window: float=float(os.environ.get('EVENT_COALESCE_WINDOW', 0)), max_batch: int=int(os.environ.get('EVENT_COALESCE_MAX_BATCH', 20))):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: Dict[Hashable, List[tuple]] = {}
+        self.timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.coalesced = 0
+
+    async def submit(self, key: Optional[Hashable], item):
+        if self.window <= 0 or key is None:
+            result = (await self.run_batch(key, [ item ]))[0]
+            return self.unwrap(result)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((item, future))
+
+        if len(batch) == 1:
+            self.timers[key] = loop.call_later(self.window, self.schedule, key)
+        elif len(batch) >= self.max_batch:
+            self.timers.pop(key).cancel()
+            self.schedule(key)
+
+        return self.unwrap(await future)
+
+    def schedule(self, key: Hashable):
+        self.timers.pop(key, None)
+        task = asyncio.create_task(self.flush(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self, key: Hashable):
+        batch = self.pending.pop(key, [])
+
+        if not batch:
+            return
+
+        self.batches += 1
+        self.coalesced += len(batch) - 1
+        logger.debug('Coalesced Batch: %s | Events: %s', key, len(batch))
+
+        try:
+            results = await self.run_batch(key, [ item for item, _ in batch ])
+        except (Exception) as e:
+            results = [ e ] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def unwrap(self, result):
+        if isinstance(result, BaseException):
+            raise result
+
+        return result
+
+    def stats(self):
+        return { 'window': self.window, 'pending_keys': len(self.pending), 'batches': self.batches, 'coalesced': self.coalesced }
@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from webhooks.models.chargebee import Subscription
+from webhooks.models.mailserver import AccountState, MailServer
+from typing import Dict, List, Optional
+
+
+class EventContext:
+    def __init__(self, cb_instance: str=None, event_type: str=None):
+        self.cb_instance = cb_instance
+        self.event_type = event_type
+        self.accounts: Dict[str, MailServer] = {}
+        self.base: Dict[str, MailServer] = {}
+        self.subscriptions: Dict[tuple, List[Subscription]] = {}
+        self.defer_writes = False
+        self.desired: Dict[str, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_account(self, username: str):
+        account = self.accounts.get(username.lower())
+        self.hits, self.misses = (self.hits + 1, self.misses) if account is not None else (self.hits, self.misses + 1)
+
+        return account
+
+    def set_account(self, username: str, account: Optional[MailServer]):
+        # `base` is the account as the mail server holds it, `accounts` also reflects staged changes
+        if account is None:
+            return self.invalidate_account(username)
+
+        self.accounts[username.lower()] = account
+        self.base[username.lower()] = account
+
+    def update_account(self, username: str, data: Dict):
+        account = self.base.get(username.lower())
+        self.set_account(username, account.with_update(data) if account is not None else None)
+
+    def defer_update(self, username: str, data: Dict):
+        # stage an update against the memoized snapshot; None means it has to go out now
+        account = self.accounts.get(username.lower())
+        updated = account.with_update(data) if account is not None else None
+
+        if updated is None:
+            return None
+
+        self.accounts[username.lower()] = updated
+        _, state = self.desired.get(username.lower(), (username, AccountState()))
+        self.desired[username.lower()] = (username, state.merge(data))
+
+        return updated
+
+    def pop_changes(self, username: str=None):
+        # desired state diffed against the server's copy: (username, changed fields) per account
+        if username is not None:
+            _, state = self.desired.pop(username.lower(), (username, AccountState()))
+            return state.diff(self.base.get(username.lower()))
+
+        desired, self.desired = self.desired, {}
+
+        return [ (username, state.diff(self.base.get(key))) for key, (username, state) in desired.items() ]
+
+    def invalidate_account(self, username: str):
+        self.accounts.pop(username.lower(), None)
+        self.base.pop(username.lower(), None)
+
+    def get_subscriptions(self, customer_id: str, params: Dict=None):
+        subscriptions = self.subscriptions.get((customer_id, frozenset((params or {}).items())))
+        self.hits, self.misses = (self.hits + 1, self.misses) if subscriptions is not None else (self.hits, self.misses + 1)
+
+        return subscriptions
+
+    def set_subscriptions(self, customer_id: str, params: Dict, subscriptions: List[Subscription]):
+        self.subscriptions[(customer_id, frozenset((params or {}).items()))] = subscriptions
+
+    def invalidate_subscriptions(self, customer_id: str):
+        for key in [ key for key in self.subscriptions if key[0] == customer_id ]:
+            del self.subscriptions[key]
+
+
+event_context: ContextVar[Optional[EventContext]] = ContextVar('event_context', default=None)
+
+
+@contextmanager
+def event_scope(cb_instance: str=None, event_type: str=None):
+    # one context per webhook event; fallthrough handlers reuse it since they run inside the same scope
+    ctx = EventContext(cb_instance, event_type)
+    token = event_context.set(ctx)
+
+    try:
+        yield ctx
+    finally:
+        event_context.reset(token)
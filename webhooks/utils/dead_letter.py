@@ -0,0 +1,133 @@
+from pydantic import TypeAdapter
+from webhooks.utils.registry import tenant_of
+from typing import Dict, List, Optional, Sequence
+from datetime import datetime, timezone
+import os, json, time, logging, sqlite3, threading
+
+
+logger = logging.getLogger(__name__)
+
+occurred = TypeAdapter(Optional[datetime])
+
+
+def epoch(value) -> Optional[float]:
+    # payloads arrive JSON-dumped, so occurred_at is an ISO string; the column has to hold numbers to sort against failed_at
+    moment = occurred.validate_python(value)
+
+    if moment is None:
+        return None
+
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class DeadLetterStore:
+    # events that ran out of attempts, kept with their raw payload so they can be replayed through the handlers later
+    def __init__(self, path: str=os.environ.get('DEAD_LETTER_PATH', 'webhooks.db')):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+
+    def open(self):
+        if self.conn is not None:
+            return self
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT,
+                cb_instance TEXT NOT NULL,
+                tenant TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'dead',
+                status_code INTEGER,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                occurred_at REAL,
+                failed_at REAL NOT NULL,
+                replayed_at REAL,
+                result TEXT
+            )
+        ''')
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS dead_letters_event ON dead_letters (cb_instance, event_id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS dead_letters_status ON dead_letters (status, failed_at)')
+
+        return self
+
+    def close(self):
+        conn, self.conn = self.conn, None
+
+        if conn is not None:
+            conn.close()
+
+    def add(self, cb_instance: str, payload: Dict, error: str, status_code: Optional[int]=None, attempts: int=1, source: str='inline'):
+        # a later failure of the same event (a Chargebee retry, a failed replay) updates its entry rather than adding another
+        now = time.time()
+
+        with self.lock:
+            self.open().conn.execute('''
+                INSERT INTO dead_letters (event_id, cb_instance, tenant, event_type, payload, source, status_code, error, attempts, occurred_at, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cb_instance, event_id) DO UPDATE SET
+                    status = 'dead', status_code = excluded.status_code, error = excluded.error, attempts = attempts + excluded.attempts, failed_at = excluded.failed_at
+            ''', (payload.get('id'), cb_instance, tenant_of(cb_instance), payload.get('event_type'), json.dumps(payload, default=str), source, status_code, error, attempts, epoch(payload.get('occurred_at')), now))
+
+        logger.warning('Dead Letter | %s %s (%s) from %s: %s', cb_instance, payload.get('id'), payload.get('event_type'), source, error)
+
+    def resolve(self, cb_instance: str, event_id: Optional[str], result: str=None):
+        # the event went through after all (Chargebee's own retry, or a replay)
+        if not event_id or self.conn is None:
+            return 0
+
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE dead_letters SET status = 'replayed', replayed_at = ?, result = ? WHERE cb_instance = ? AND event_id = ? AND status = 'dead'", (time.time(), result, cb_instance, event_id)
+            ).rowcount
+
+    def replayed(self, id: int, result: str=None):
+        with self.lock:
+            self.open().conn.execute("UPDATE dead_letters SET status = 'replayed', replayed_at = ?, result = ? WHERE id = ?", (time.time(), result, id))
+
+    def failed(self, id: int, error: str):
+        # stays dead, with the replay's error, so the next replay picks it up again
+        with self.lock:
+            self.open().conn.execute("UPDATE dead_letters SET error = ?, attempts = attempts + 1, result = NULL WHERE id = ?", (error, id))
+
+    def select(self, tenant: str=None, event_types: Sequence[str]=None, since: float=None, until: float=None, status: str='dead', limit: int=None) -> List[Dict]:
+        clauses, params = [ 'status = ?' ], [ status ]
+
+        if tenant:
+            clauses.append('(tenant = ? OR cb_instance = ?)')
+            params += [ tenant, tenant ]
+        if event_types:
+            clauses.append(f"event_type IN ({ ', '.join('?' for _ in event_types) })")
+            params += list(event_types)
+        if since is not None:
+            clauses.append('failed_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('failed_at < ?')
+            params.append(until)
+
+        # oldest first so a customer's events are replayed in the order they happened
+        sql = f"SELECT id, event_id, cb_instance, event_type, payload, attempts, error FROM dead_letters WHERE { ' AND '.join(clauses) } ORDER BY COALESCE(occurred_at, failed_at), id"
+        sql += f' LIMIT { int(limit) }' if limit else ''
+
+        with self.lock:
+            rows = self.open().conn.execute(sql, params).fetchall()
+
+        return [ { 'id': row[0], 'event_id': row[1], 'cb_instance': row[2], 'event_type': row[3], 'payload': json.loads(row[4]), 'attempts': row[5], 'error': row[6] } for row in rows ]
+
+    def stats(self):
+        with self.lock:
+            rows = self.open().conn.execute("SELECT status, COUNT(*) FROM dead_letters GROUP BY status").fetchall()
+
+        return { status: count for status, count in rows }
+
+
+dead_letter_store = DeadLetterStore()
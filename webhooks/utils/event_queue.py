@@ -0,0 +1,164 @@
+from webhooks.utils.dead_letter import dead_letter_store
+from typing import Callable, Dict, List, Optional
+import os, json, time, asyncio, logging, sqlite3, threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    def __init__(self, path: str=os.environ.get('EVENT_QUEUE_PATH', 'webhooks.db'), max_attempts: int=int(os.environ.get('EVENT_MAX_ATTEMPTS', 5))):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+        self.available = asyncio.Event()
+
+    def open(self):
+        if self.conn is not None:
+            return self
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT,
+                cb_instance TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                available_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS events_pending ON events (status, available_at)")
+
+        # anything left 'processing' was interrupted by a restart, hand it back to the workers
+        with self.lock:
+            recovered = self.conn.execute("UPDATE events SET status = 'pending' WHERE status = 'processing'").rowcount
+
+        logger.info('Event Queue | Path: %s | Recovered: %s', self.path, recovered)
+
+        return self
+
+    def close(self):
+        conn, self.conn = self.conn, None
+
+        if conn is not None:
+            conn.close()
+
+    def enqueue(self, cb_instance: str, payload: Dict):
+        now = time.time()
+
+        with self.lock:
+            row_id = self.open().conn.execute(
+                "INSERT INTO events (event_id, cb_instance, event_type, payload, created_at, updated_at, available_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (payload.get('id'), cb_instance, payload.get('event_type'), json.dumps(payload, default=str), now, now, now)
+            ).lastrowid
+
+        self.available.set()
+
+        return row_id
+
+    def claim(self, limit: int=1):
+        now = time.time()
+
+        with self.lock:
+            self.open().conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.conn.execute(
+                    "SELECT id, cb_instance, payload, attempts FROM events WHERE status = 'pending' AND available_at <= ? ORDER BY id LIMIT ?", (now, limit)
+                ).fetchall()
+                self.conn.executemany("UPDATE events SET status = 'processing', attempts = attempts + 1, updated_at = ? WHERE id = ?", [ (now, row[0]) for row in rows ])
+                self.conn.execute('COMMIT')
+            except (Exception):
+                self.conn.execute('ROLLBACK')
+                raise
+
+        return [ { 'id': row[0], 'cb_instance': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1 } for row in rows ]
+
+    def complete(self, id: int):
+        with self.lock:
+            self.open().conn.execute("UPDATE events SET status = 'done', error = NULL, updated_at = ? WHERE id = ?", (time.time(), id))
+
+    def fail(self, id: int, attempts: int, error: str):
+        now = time.time()
+        status = 'failed' if attempts >= self.max_attempts else 'pending'
+        # exponential backoff between attempts, capped at five minutes
+        available_at = now + min(2 ** attempts, 300)
+
+        with self.lock:
+            self.open().conn.execute("UPDATE events SET status = ?, error = ?, updated_at = ?, available_at = ? WHERE id = ?", (status, error, now, available_at, id))
+
+        return status
+
+    def release(self, id: int):
+        with self.lock:
+            self.open().conn.execute("UPDATE events SET status = 'pending', attempts = attempts - 1, updated_at = ? WHERE id = ?", (time.time(), id))
+
+    def purge(self, older_than: float):
+        with self.lock:
+            return self.open().conn.execute("DELETE FROM events WHERE status = 'done' AND updated_at < ?", (time.time() - older_than,)).rowcount
+
+    def stats(self):
+        with self.lock:
+            rows = self.open().conn.execute("SELECT status, COUNT(*) FROM events GROUP BY status").fetchall()
+
+        return { status: count for status, count in rows }
+
+
+class EventWorkers:
+    def __init__(self, queue: EventQueue, process: Callable, concurrency: int=int(os.environ.get('EVENT_WORKERS', 4)), poll_interval: float=float(os.environ.get('EVENT_POLL_INTERVAL', 1))):
+        self.queue = queue
+        self.process = process
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.queue.available = asyncio.Event()
+        self.tasks = [ asyncio.create_task(self.worker(n)) for n in range(self.concurrency) ]
+        logger.info('Event Workers | Concurrency: %s', self.concurrency)
+
+    async def stop(self):
+        tasks, self.tasks = self.tasks, []
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def worker(self, n: int):
+        while True:
+            self.queue.available.clear()
+            events = self.queue.claim()
+
+            if not events:
+                try:
+                    await asyncio.wait_for(self.queue.available.wait(), timeout=self.poll_interval)
+                except (asyncio.TimeoutError):
+                    pass
+                continue
+
+            for event in events:
+                try:
+                    await self.process(event.get('cb_instance'), event.get('payload'))
+                except (asyncio.CancelledError):
+                    self.queue.release(event.get('id'))
+                    raise
+                except (Exception) as e:
+                    status = self.queue.fail(event.get('id'), event.get('attempts'), str(e) or type(e).__name__)
+                    logger.error('Event Worker %s | Event %s (%s) failed on attempt %s: %s | Status: %s', n, event.get('id'), event.get('payload').get('event_type'), event.get('attempts'), e, status)
+                    if status == 'failed':
+                        dead_letter_store.add(event.get('cb_instance'), event.get('payload'), str(e) or type(e).__name__, getattr(e, 'status_code', None), event.get('attempts'), source='queue')
+                else:
+                    self.queue.complete(event.get('id'))
+
+
+event_queue = EventQueue()
@@ -1,32 +1,67 @@
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
-from webhooks.models.chargebee import Customer, Subscription
+from webhooks.models.chargebee import Customer
 from webhooks.models.mailserver import MailServer
 from webhooks.models.response import ResponseBody, CustomException
+from webhooks.utils.accounts import account_index
+from webhooks.utils.cache import account_cache
+from webhooks.utils.clients import mailserver_client
+from webhooks.utils.context import event_context
+from webhooks.utils.log import setup_logging
+from webhooks.utils.resilience import CircuitOpenError
+from webhooks.utils.timing import RequestTimer, request_timer
+from webhooks.utils.tracing import tracer, traced
 from typing import Dict, List, Optional, Union
 from datetime import datetime, timezone
-import time, os, logging, requests
+import os, logging
 
 
-log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
-logging.basicConfig(level=getattr(logging, log_level, logging.INFO), format="\n%(asctime)s - %(name)s - \n[%(levelname)s] - %(message)s\n")
+setup_logging()
 logger = logging.getLogger(__name__)
 
-event_type = str
-event_time = object
 
-
-def mailserver_api(secrets, method, action, customer: Union[Customer, str], data):
+@traced()
+async def mailserver_api(secrets, method, action, customer: Union[Customer, str], data):
     headers = { 'Content-Type': 'application/json', 'Accept': 'application/json' }
     # query here customer_id to get Customer object or email
     params = { 'username': customer if isinstance(customer, str) else customer.email }
-    logger.debug(f"Mail Server Account: { params } | Method: { method }")
+    span = tracer.current_span()
+    span.set_attributes(method=method, action=action, username=params.get('username'))
+    logger.debug('Mail Server Account: %s | Method: %s', params, method)
+
+    ctx = event_context.get()
+
+    if method == 'GET' and action == 'view' and ctx is not None:
+        account = ctx.get_account(params.get('username'))
+        if account is not None:
+            logger.debug('Mail Server Account (memoized): %s', params)
+            span.set_attribute('source', 'memo')
+            return 200, action, data, account
+
+    if method == 'GET' and action == 'view':
+        account = account_cache.get_account(params.get('username'))
+        if account is not None:
+            logger.debug('Mail Server Account (cached): %s', params)
+            span.set_attribute('source', 'cache')
+            ctx.set_account(params.get('username'), account) if ctx is not None else None
+            return 200, action, data, account
+
+    if method == 'POST' and action == 'update' and ctx is not None and ctx.defer_writes and data:
+        account = ctx.defer_update(params.get('username'), data)
+        if account is not None:
+            logger.debug('Mail Server Update (deferred): %s | %s', params, data)
+            span.set_attribute('source', 'deferred')
+            return 201, action, data, account
+        # can't be staged, so send it now together with anything already staged for the account
+        data = { **ctx.pop_changes(params.get('username')), **data }
 
     if method == 'GET':
         try:
-            result = requests.get(f"{ secrets.get('api_url') }/accounts/{ action }", auth=(secrets.get('username'), secrets.get('password')), headers=headers, params=params, verify=True).json()
+            result = (await mailserver_client.get(f"{ secrets.get('api_url') }/accounts/{ action }", auth=(secrets.get('username'), secrets.get('password')), headers=headers, params=params)).json()
             if result.get('status') != 'success':
                 raise Exception(result.get('response').get('message'))
+        except (CircuitOpenError) as e:
+            return res_body(status_code=502, msg=str(e), data=None, api_src='mailserver')
         except (Exception) as e:
             status_code = 501 if str(e).__contains__('Specify accountId/username argument') else 500
             msg = 'Customer does not exist' if isinstance(customer, str) and status_code == 501 else f'Customer: `{ customer.email }` does not exist' if status_code == 501 else ''
@@ -40,27 +75,56 @@ def mailserver_api(secrets, method, action, customer: Union[Customer, str], data
         except (Exception) as e:
             return res_body(status_code=422, msg=str(e), data=data, api_src='mailserver')
         
-        logger.debug(f"{ method } params: { params }")
+        logger.debug('%s params: %s', method, params)
 
         try:
-            result = requests.post(f"{ secrets.get('api_url') }/accounts/{ action }", auth=(secrets.get('username'), secrets.get('password')), headers=headers, params=params, verify=True).json()
+            result = (await mailserver_client.post(f"{ secrets.get('api_url') }/accounts/{ action }", auth=(secrets.get('username'), secrets.get('password')), headers=headers, params=params)).json()
             if result.get('status') != 'success':
                 raise Exception(result.get('response').get('message'))
+        except (CircuitOpenError) as e:
+            # nothing was sent, so the cached account is still what the server holds
+            return res_body(status_code=502, msg=str(e), data=None, api_src='mailserver')
         except (Exception) as e:
+            account_cache.invalidate_account(params.get('username'))
             status_code = 501 if str(e).__contains__('does not exist') else 500
             return res_body(status_code=status_code, msg=str(e) if status_code != 500 else '', data=data if status_code != 500 else None, api_src='mailserver')
 
     response = result.get('response').get('results')
     status_code = 200 if method == 'GET' else 201
-
-    return status_code, action, data, MailServer(**response) if method == 'GET' else response
+    span.set_attributes(source='mailserver', status_code=status_code)
+
+    if action == 'view':
+        account = MailServer(**response)
+        account_cache.set_account(params.get('username'), account)
+        account_index.observe(account)
+        ctx.set_account(params.get('username'), account) if ctx is not None else None
+    if action == 'update':
+        account_cache.update_account(params.get('username'), data)
+        account_index.update(params.get('username'), data)
+        ctx.update_account(params.get('username'), data) if ctx is not None else None
+
+    return status_code, action, data, account if action == 'view' else MailServer(**response) if method == 'GET' else response
+
+async def flush_account_updates(secrets, ctx):
+    # one `accounts/update` per account with only the fields that actually changed, none if nothing did
+    defer_writes, ctx.defer_writes = ctx.defer_writes, False
+
+    try:
+        for username, changes in ctx.pop_changes():
+            if not changes:
+                logger.debug('Mail Server Account: %s already in desired state. Skipping update', username)
+                continue
+            await mailserver_api(secrets, 'POST', 'update', username, changes)
+    finally:
+        ctx.defer_writes = defer_writes
 
 def res_body(status_code: int, msg: str, data: Dict=None, object: ResponseBody=None, api_src: str=None):
     event_time_start, event_time_end, duration = timer(timer='stop')
+    request = request_timer.get() or RequestTimer()
 
-    logger.debug(f'[Msg: ] { msg }')
-    logger.debug(f'[Data: ] { data if data else None }')
-    logger.debug(f'[Object: ] { object if object else None }')
+    logger.debug('[Msg: ] %s', msg)
+    logger.debug('[Data: ] %s', data if data else None)
+    logger.debug('[Object: ] %s', object if object else None)
     
     if status_code == 200 or status_code == 201:
         status_reason = 'Ok'
@@ -79,25 +143,22 @@ def res_body(status_code: int, msg: str, data: Dict=None, object: ResponseBody=N
     if status_code == 502:
         status_reason = 'Bad Gateway'
 
-    customer = Customer(**data.get('customer')) if data and data.get('customer') else None
-    subscription = Subscription(**data.get('subscription')) if data and data.get('subscription') else None
+    customer = data.get('customer') if isinstance(data, dict) and isinstance(data.get('customer'), dict) else None
+    subscription = data.get('subscription') if isinstance(data, dict) and isinstance(data.get('subscription'), dict) else None
 
     response_log = {
         'status_code': status_code,
         'status_reason': status_reason,
         'message': msg,
-        'event_type': event_type.title().replace('_', ' ') if event_type else None,
+        'event_type': request.event_type.title().replace('_', ' ') if request.event_type else None,
         'event_started': event_time_start,
         'event_ended': event_time_end,
-        'duration': duration
+        'duration': duration,
+        'timings': request.timings()
     }
 
-    response_log.update({ 'customer': { 'id': customer.id, 'email': customer.email } }) if customer else None
-    response_log.update({ 'subscription': { 'id': subscription.id, 'status': subscription.status } }) if subscription else None
-
-    logger.debug('\n\t> ' + '\n\t> '.join(f'{ k.title().replace('_', ' ') }\t: ' + 
-        ('\n\t     -' + '\n\t     -'.join(f'\t{ sub_k }\t: { sub_v }' for sub_k, sub_v in v.items())  
-        if isinstance(v, dict) else str(v)) for k, v in response_log.items()))
+    response_log.update({ 'customer': { 'id': customer.get('id'), 'email': customer.get('email') } }) if customer else None
+    response_log.update({ 'subscription': { 'id': subscription.get('id'), 'status': subscription.get('status') } }) if subscription else None
     
     response = f'Response({ response_log.get('status_code') }) { response_log.get('status_reason') }: { response_log.get('message') } || @{ duration }]'
 
@@ -105,35 +166,30 @@ def res_body(status_code: int, msg: str, data: Dict=None, object: ResponseBody=N
         try:
             raise CustomException(status_code, msg, data, api_src)
         except (CustomException):
-            logger.error(f'Response: { response_log }')
+            logger.error('Response(%s) %s: %s', status_code, status_reason, msg, extra={ 'response': response_log })
                         
             return JSONResponse(status_code=status_code, content=response)
         finally:
             # only if CustomException still has errors force execute HTTPException
             raise HTTPException(status_code=status_code, detail=response)
 
-    logger.info(f'Response: { response_log }')
+    logger.info('Response(%s) %s: %s', status_code, status_reason, msg, extra={ 'response': response_log })
 
     return response
 
-def timer(event: str=None, timer: str=None):
+def timer(event: str=None, timer: str=None, tenant: str=None):
+    # called outside request_scope (e.g. directly from tests): time from here on, without leaking a timer into the caller's context
+    request = request_timer.get() or RequestTimer(event)
+
+    # the endpoint starts the clock before auth and only names the event once it is authorized and resolved
+    if event is not None:
+        request.event_type = event
+        request.tenant = tenant
+
     if timer == 'start':
-        global event_type
-        global event_time
-        event_type = event
-        event_time = datetime.fromtimestamp(time.time(), timezone.utc)
-                
-    dt_object = datetime.fromtimestamp(time.time(), timezone.utc)
-    date_str = dt_object.strftime('%m/%d/%Y') if timer == 'stop' else event_time.strftime('%m/%d/%Y') if timer == 'start' else None
-    time_str = dt_object.strftime('%H:%M:%S (%Z)') if timer == 'stop' else event_time.strftime('%H:%M:%S (%Z)') if timer == 'start' else None
-    event_time_start = f'{ date_str } { time_str }' if timer == 'start' else event_time.strftime('%m/%d/%Y %H:%M:%S (%Z)') if timer == 'stop' else None
-
-    if timer == 'stop':
-        dt_difference = (dt_object - event_time)
-        event_time_end = f'{ date_str } { time_str }'
-        hours, remainder = divmod(dt_difference.seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        milliseconds = round(dt_difference.microseconds // 1000) % 100
-        duration = f'{ hours }h { minutes }m { seconds }s' if hours > 0 else f'{ minutes }m { seconds }s' if minutes > 0 else f'{ seconds }.{ milliseconds } secs'
-
-    return event_time_start if timer == 'start' else (event_time_start, event_time_end, duration) if timer == 'stop' else None
+        request.mark('parse')
+
+    event_time_start = request.started_at.strftime('%m/%d/%Y %H:%M:%S (%Z)')
+    event_time_end = datetime.now(timezone.utc).strftime('%m/%d/%Y %H:%M:%S (%Z)')
+
+    return event_time_start if timer == 'start' else (event_time_start, event_time_end, request.duration()) if timer == 'stop' else None
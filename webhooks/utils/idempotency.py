@@ -0,0 +1,101 @@
+from webhooks.utils.cache import TTLCache
+from typing import Dict, Optional
+import os, time, logging, sqlite3, threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStore:
+    def __init__(self,
+        maxsize: int=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 50000)),
+        ttl: float=float(os.environ.get('IDEMPOTENCY_TTL', 3 * 24 * 3600)),
+        in_flight_ttl: float=float(os.environ.get('IDEMPOTENCY_IN_FLIGHT_TTL', 600)),
+        path: Optional[str]=os.environ.get('IDEMPOTENCY_PATH')
+    ):
+        self.ttl = ttl
+        self.in_flight_ttl = in_flight_ttl
+        self.path = path
+        self.entries = TTLCache(maxsize, ttl)
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+
+    def open(self):
+        if self.path is None or self.conn is not None:
+            return self
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, expires_at REAL NOT NULL)')
+        self.conn.execute('DELETE FROM idempotency WHERE expires_at < ?', (time.time(),))
+
+        return self
+
+    def close(self):
+        conn, self.conn = self.conn, None
+
+        if conn is not None:
+            conn.close()
+
+    def key(self, cb_instance: str, event_id: str):
+        return f"{ cb_instance.removesuffix('-test') }:{ event_id }"
+
+    def begin(self, cb_instance: str, event_id: Optional[str]) -> Optional[Dict]:
+        # claims the event id; returns the existing entry when it is already in flight or done
+        if not event_id:
+            return None
+
+        key = self.key(cb_instance, event_id)
+
+        with self.lock:
+            entry = self.entries.get(key) or self.load(key)
+
+            if entry is not None:
+                return entry
+
+            self.store(key, { 'status': 'in_flight', 'result': None }, self.in_flight_ttl)
+
+        return None
+
+    def finish(self, cb_instance: str, event_id: Optional[str], result: str=None):
+        if event_id:
+            self.store(self.key(cb_instance, event_id), { 'status': 'done', 'result': result }, self.ttl)
+
+    def abandon(self, cb_instance: str, event_id: Optional[str]):
+        # failed attempts release the id so Chargebee's retry is processed again
+        if not event_id:
+            return
+
+        key = self.key(cb_instance, event_id)
+
+        with self.lock:
+            self.entries.pop(key)
+            if self.conn is not None:
+                self.conn.execute('DELETE FROM idempotency WHERE key = ?', (key,))
+
+    def store(self, key: str, entry: Dict, ttl: float):
+        with self.lock:
+            self.entries.set(key, entry, ttl)
+            if self.conn is not None:
+                self.conn.execute('INSERT OR REPLACE INTO idempotency (key, status, result, expires_at) VALUES (?, ?, ?, ?)', (key, entry.get('status'), entry.get('result'), time.time() + ttl))
+
+    def load(self, key: str):
+        if self.conn is None:
+            return None
+
+        row = self.conn.execute('SELECT status, result, expires_at FROM idempotency WHERE key = ? AND expires_at >= ?', (key, time.time())).fetchone()
+
+        if row is None:
+            return None
+
+        entry = { 'status': row[0], 'result': row[1] }
+        self.entries.set(key, entry, row[2] - time.time())
+
+        return entry
+
+    def stats(self):
+        return self.entries.stats()
+
+
+idempotency_store = IdempotencyStore()
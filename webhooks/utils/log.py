@@ -0,0 +1,161 @@
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+from webhooks.utils.tracing import tracer
+from typing import Optional
+import os, re, sys, copy, json, queue, atexit, logging
+
+
+LOG_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | { 'message', 'asctime', 'taskName' }
+SECRET_KEY = re.compile(r'api_key|password|secret|token|authorization', re.IGNORECASE)
+SECRET_TEXT = [
+    (re.compile(r'\b(Basic|Bearer)\s+[A-Za-z0-9+/=._~-]+'), r'\1 ***'),
+    (re.compile(r"""(['"]?\w*(?:api_key|password|secret|token)\w*['"]?\s*[:=]\s*)(['"])(.*?)\2""", re.IGNORECASE), r'\1\2***\2')
+]
+REDACTED = '***'
+
+
+def cap(text: str, limit: int):
+    return text if len(text) <= limit else f'{ text[:limit] }... (+{ len(text) - limit } chars)'
+
+def redact(value):
+    if isinstance(value, dict):
+        return { k: REDACTED if isinstance(k, str) and SECRET_KEY.search(k) and v else redact(v) for k, v in value.items() }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+
+    return value
+
+def redact_text(text: str):
+    for pattern, replacement in SECRET_TEXT:
+        text = pattern.sub(replacement, text)
+
+    return text
+
+
+class RedactingFormatter(logging.Formatter):
+    # runs on the listener thread: args are only rendered for records that passed the level check
+    def __init__(self, fmt: str=None, max_chars: int=int(os.environ.get('LOG_MAX_CHARS', 4000))):
+        super().__init__(fmt)
+        self.max_chars = max_chars
+
+    def render(self, value):
+        return cap(redact_text(value if isinstance(value, str) else str(redact(value))), self.max_chars)
+
+    def message(self, record: logging.LogRecord):
+        msg = str(record.msg)
+
+        if record.args:
+            args = redact(record.args) if isinstance(record.args, dict) else tuple(redact(arg) for arg in record.args)
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = f'{ msg } { args }'
+
+        return cap(redact_text(msg), self.max_chars)
+
+    def extras(self, record: logging.LogRecord):
+        return { k: v for k, v in vars(record).items() if k not in LOG_RECORD_FIELDS }
+
+
+class TextFormatter(RedactingFormatter):
+    def format(self, record: logging.LogRecord):
+        record.message = self.message(record)
+        record.asctime = self.formatTime(record)
+        extras = self.extras(record)
+        text = self.formatMessage(record)
+
+        if extras:
+            text = text.rstrip('\n') + ''.join(f'\n\t> { k }: { self.render(v) }' for k, v in extras.items()) + '\n'
+        if record.exc_info or record.exc_text:
+            text = text.rstrip('\n') + '\n' + (record.exc_text or self.formatException(record.exc_info)) + '\n'
+
+        return text
+
+
+class JsonFormatter(RedactingFormatter):
+    def structured(self, value):
+        if value is None or isinstance(value, (int, float, bool)):
+            return value
+        if isinstance(value, dict):
+            text = redact_text(json.dumps(redact(value), default=str))
+            return json.loads(text) if len(text) <= self.max_chars else cap(text, self.max_chars)
+
+        return self.render(value)
+
+    def format(self, record: logging.LogRecord):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': self.message(record)
+        }
+
+        for k, v in self.extras(record).items():
+            entry[k] = self.structured(v)
+
+        if record.exc_info or record.exc_text:
+            entry['exc'] = cap(record.exc_text or self.formatException(record.exc_info), self.max_chars)
+
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # context variables are only visible on the emitting side, so attach them before the record is queued
+    def filter(self, record: logging.LogRecord):
+        span = tracer.current.get()
+        trace_id = getattr(span, 'trace_id', None)
+
+        if trace_id is not None:
+            record.trace_id = trace_id
+            record.span_id = span.span_id
+
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.renderer = RedactingFormatter()
+
+    def prepare(self, record: logging.LogRecord):
+        # args (dicts, models) may be mutated once the call returns, so the message is rendered, redacted and capped here;
+        # timestamps, JSON layout and the stream write are still left to the listener thread
+        record = copy.copy(record)
+        record.msg = self.renderer.message(record)
+        record.args = None
+        record.exc_text = self.renderer.formatException(record.exc_info) if record.exc_info else record.exc_text
+        record.exc_info = None
+
+        return record
+
+
+listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str=os.environ.get('LOG_LEVEL', 'INFO'), format: str=os.environ.get('LOG_FORMAT', 'json')):
+    global listener
+
+    if listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if format == 'json' else TextFormatter("\n%(asctime)s - %(name)s - \n[%(levelname)s] - %(message)s\n"))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [ handler ]
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    listener = QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
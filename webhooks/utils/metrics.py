@@ -0,0 +1,218 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+import time
+
+
+# children are only touched from the event loop thread (upstream calls are timed around the await, not inside
+# executor threads), so plain attribute updates are safe without locks; each worker process keeps its own registry
+DEFAULT_BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+
+
+def label_string(names: Sequence[str], values: Sequence[str], extra: str=''):
+    pairs = [ f'{ name }="{ str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') }"' for name, value in zip(names, values) ]
+    pairs += [ extra ] if extra else []
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterChild:
+    __slots__ = ( 'labels', 'value' )
+
+    def __init__(self, labels: str):
+        self.labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float=1):
+        self.value += amount
+
+    def samples(self, name: str):
+        yield f'{ name }{ self.labels } { self.value }'
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float=1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    @contextmanager
+    def track(self):
+        self.value += 1
+        try:
+            yield
+        finally:
+            self.value -= 1
+
+
+class HistogramChild:
+    __slots__ = ( 'names', 'values', 'labels', 'buckets', 'counts', 'sum', 'count' )
+
+    def __init__(self, names: Sequence[str], values: Sequence[str], buckets: Sequence[float]):
+        self.names = names
+        self.values = values
+        self.labels = label_string(names, values)
+        self.buckets = buckets
+        self.counts = [ 0 ] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name: str):
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [ '+Inf' ], self.counts):
+            cumulative += count
+            yield f'{ name }_bucket{ label_string(self.names, self.values, f'le="{ bound }"') } { cumulative }'
+        yield f'{ name }_sum{ self.labels } { self.sum }'
+        yield f'{ name }_count{ self.labels } { self.count }'
+
+
+class Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str]=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple, object] = {}
+
+    def labels(self, *values):
+        # bind once and keep the child on hot paths; lookups after the first are a single dict get
+        child = self.children.get(values)
+
+        if child is None:
+            child = self.children[values] = self.child(tuple(str(value) for value in values))
+
+        return child
+
+    @abstractmethod
+    def child(self, values: Tuple):
+        ...
+
+    def render(self) -> List[str]:
+        lines = [ f'# HELP { self.name } { self.help }', f'# TYPE { self.name } { self.kind }' ]
+
+        for child in list(self.children.values()):
+            lines.extend(child.samples(self.name))
+
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def child(self, values: Tuple):
+        return CounterChild(label_string(self.labelnames, values))
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def child(self, values: Tuple):
+        return GaugeChild(label_string(self.labelnames, values))
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def child(self, values: Tuple):
+        return HistogramChild(self.labelnames, values, self.buckets)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str]=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str]=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str]=(), buckets: Sequence[float]=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics.values() for line in metric.render()) + '\n'
+
+
+metrics = MetricsRegistry()
+
+webhook_events = metrics.counter('webhook_events_total', 'Webhook events handled by source, tenant, event type and response status code', [ 'source', 'tenant', 'event_type', 'status_code' ])
+webhook_duration = metrics.histogram('webhook_event_duration_seconds', 'Webhook event latency from request start to response', [ 'source', 'tenant', 'event_type' ])
+webhook_in_flight = metrics.gauge('webhook_events_in_flight', 'Webhook requests and queued events currently being handled', [ 'source' ])
+upstream_calls = metrics.counter('upstream_calls_total', 'Calls made to upstream APIs', [ 'upstream', 'operation' ])
+upstream_errors = metrics.counter('upstream_errors_total', 'Upstream calls that raised or returned an HTTP error status', [ 'upstream', 'operation' ])
+upstream_duration = metrics.histogram('upstream_call_duration_seconds', 'Upstream API call latency', [ 'upstream', 'operation' ])
+upstream_retries = metrics.counter('upstream_retries_total', 'Upstream calls retried after a transient failure', [ 'upstream', 'operation' ])
+rate_limit_wait = metrics.histogram('chargebee_rate_limit_wait_seconds', 'Time Chargebee calls spent waiting for a rate limit token', [ 'site', 'priority' ], buckets=( 0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0 ))
+rate_limit_throttled = metrics.counter('chargebee_rate_limited_total', 'Chargebee calls answered with 429 Too Many Requests', [ 'site' ])
+circuit_state = metrics.gauge('circuit_breaker_state', 'Circuit breaker state per upstream host: 0 closed, 1 half-open, 2 open', [ 'upstream', 'host' ])
+circuit_transitions = metrics.counter('circuit_breaker_transitions_total', 'Circuit breaker state changes', [ 'upstream', 'host', 'state' ])
+
+http_in_flight = webhook_in_flight.labels('http')
+queue_in_flight = webhook_in_flight.labels('queue')
+
+
+class UpstreamMetrics:
+    __slots__ = ( 'calls', 'errors', 'duration', 'retries' )
+
+    def __init__(self, upstream: str, operation: str):
+        self.calls = upstream_calls.labels(upstream, operation)
+        self.errors = upstream_errors.labels(upstream, operation)
+        self.duration = upstream_duration.labels(upstream, operation)
+        self.retries = upstream_retries.labels(upstream, operation)
+
+    def observe(self, seconds: float, failed: bool=False):
+        self.calls.inc()
+        self.errors.inc() if failed else None
+        self.duration.observe(seconds)
+
+
+upstream_metrics: Dict[Tuple[str, str], UpstreamMetrics] = {}
+
+
+def upstream(name: str, operation: str) -> UpstreamMetrics:
+    observer = upstream_metrics.get((name, operation))
+
+    if observer is None:
+        observer = upstream_metrics[(name, operation)] = UpstreamMetrics(name, operation)
+
+    return observer
+
+
+# label for a webhook whose tenant and event type can't be trusted yet: unauthenticated, malformed or unknown to the registry
+UNKNOWN = 'unknown'
+
+
+def observe_event(source: str, tenant: str, event_type: str, status_code: int, seconds: float):
+    # requests that never reached a webhook endpoint (health checks, scrapes) carry no event type
+    if event_type is None:
+        return
+
+    webhook_events.labels(source, tenant, event_type, status_code).inc()
+    webhook_duration.labels(source, tenant, event_type).observe(seconds)
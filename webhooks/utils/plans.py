@@ -0,0 +1,119 @@
+from webhooks.utils.registry import tenant_of
+from typing import Dict, Iterable, NamedTuple, Optional
+import os, json, logging
+
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 * 1024 * 1024
+
+# prefixes are matched against the lowercased item_price_id; `{stem}` is the item price id without its currency and period suffix
+PLAN_CATALOG = {
+    'tasman': {
+        'item_types': [ 'plan' ],
+        'family': 'email-tasman',
+        'family_markers': { 'legacy': 'email-tasman-legacy' },
+        'plans': {
+            'email-': { 'cos_profile': '{stem}.group', 'storage_gb': 0, 'paid': True }
+        }
+    },
+    'msgco': {
+        'item_types': [ 'plan', 'addon', 'charge' ],
+        'family': 'email-tasman',
+        'family_markers': { 'legacy': 'email-tasman-legacy' },
+        'plans': {
+            'plan-av': { 'cos_profile': 'Kakadu-Plan-AV1', 'storage_gb': 2, 'paid': True },
+            'plan-bv': { 'cos_profile': 'Kakadu-Plan-BV1', 'storage_gb': 15, 'paid': True },
+            'plan-cv': { 'cos_profile': 'Kakadu-Plan-CV1', 'storage_gb': 100, 'paid': True },
+            'complimentary-plan-': { 'cos_profile': 'Kakadu-complimentary-plan', 'storage_gb': 100, 'paid': True }
+        }
+    }
+}
+
+
+class PlanClass(NamedTuple):
+    is_email: bool = False
+    is_paid: bool = False
+    plan_family: Optional[str] = None
+    cos_profile: str = ''
+    storage: int = 0
+    plan_name: Optional[str] = None
+
+
+class TenantPlans:
+    def __init__(self, tenant: str, config: Dict, memo_size: int=10000):
+        self.tenant = tenant
+        self.item_types = frozenset(config.get('item_types', []))
+        self.family = config.get('family')
+        self.family_markers = config.get('family_markers', {})
+        self.trie: Dict = {}
+        self.memo: Dict[str, Optional[PlanClass]] = {}
+        self.memo_size = memo_size
+
+        for prefix, plan in config.get('plans', {}).items():
+            node = self.trie
+            for char in prefix.lower():
+                node = node.setdefault(char, {})
+            node[None] = { 'cos_profile': plan.get('cos_profile', ''), 'storage': int(plan.get('storage_gb', 0) * GB), 'paid': plan.get('paid', True) }
+
+    def match(self, plan_name: str):
+        node, found = self.trie, None
+
+        for char in plan_name:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(None, found)
+
+        return found
+
+    def classify_item(self, item_price_id: str) -> Optional[PlanClass]:
+        if item_price_id in self.memo:
+            return self.memo[item_price_id]
+
+        plan_name = item_price_id.lower()
+        plan = self.match(plan_name)
+        result = None
+
+        if plan is not None:
+            stem = '-'.join(plan_name.rsplit('-', 2)[:-2])
+            family = next((family for marker, family in self.family_markers.items() if marker in plan_name), self.family)
+            result = PlanClass(True, plan['paid'], family, plan['cos_profile'].format(stem=stem), plan['storage'], plan_name)
+
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[item_price_id] = result
+
+        return result
+
+    def classify(self, items: Iterable) -> PlanClass:
+        # later matching items win, matching the order Chargebee lists them in
+        result = PlanClass()
+
+        for item in items or []:
+            if item.item_type in self.item_types:
+                result = self.classify_item(item.item_price_id) or result._replace(plan_name=item.item_price_id.lower())
+
+        return result
+
+
+class PlanCatalog:
+    def __init__(self, catalog: Dict=PLAN_CATALOG, path: Optional[str]=os.environ.get('PLAN_CATALOG_PATH')):
+        catalog = dict(catalog)
+
+        if path:
+            with open(path) as f:
+                catalog.update(json.load(f))
+            logger.info('Loaded Plan Catalog: %s | Tenants: %s', path, ', '.join(catalog))
+
+        self.tenants = { tenant: TenantPlans(tenant, config) for tenant, config in catalog.items() }
+        self.empty = TenantPlans('', {})
+
+    def tenant(self, cb_instance: str) -> TenantPlans:
+        return self.tenants.get(tenant_of(cb_instance), self.empty)
+
+    def classify(self, cb_instance: str, subscription) -> PlanClass:
+        return self.tenant(cb_instance).classify(subscription.subscription_items)
+
+
+plan_catalog = PlanCatalog()
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from webhooks.utils.metrics import rate_limit_throttled, rate_limit_wait
+from typing import List, Optional
+import os, time, heapq, asyncio, itertools, logging
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITY_NAMES = { INTERACTIVE: 'interactive', BACKGROUND: 'background' }
+
+call_priority: ContextVar[int] = ContextVar('call_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    # sweeps wrap themselves in this so webhook handlers always get the next token first
+    token = call_priority.set(BACKGROUND)
+
+    try:
+        yield
+    finally:
+        call_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, name: str,
+        rate: float=float(os.environ.get('CHARGEBEE_RATE_PER_MINUTE', 150)) / 60,
+        burst: int=int(os.environ.get('CHARGEBEE_BURST', 10)),
+        reserve: int=int(os.environ.get('CHARGEBEE_INTERACTIVE_RESERVE', 3)),
+        clock=time.monotonic
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        # background callers leave this many tokens in the bucket so a webhook burst never waits behind a sweep
+        self.reserve = min(reserve, burst - 1)
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.waiters: List = []
+        self.sequence = itertools.count()
+        self.pump: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        return now
+
+    def floor(self, priority: int):
+        return 1 + (self.reserve if priority == BACKGROUND else 0)
+
+    def take(self, priority: int):
+        now = self.refill()
+
+        if now < self.blocked_until or self.tokens < self.floor(priority):
+            return False
+
+        self.tokens -= 1
+        return True
+
+    async def acquire(self, priority: int=None):
+        priority = call_priority.get() if priority is None else priority
+        start = self.clock()
+
+        if not self.waiters and self.take(priority):
+            rate_limit_wait.labels(self.name, PRIORITY_NAMES[priority]).observe(0)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+
+        if self.pump is None or self.pump.done():
+            self.pump = asyncio.create_task(self.run())
+        self.wakeup.set()
+
+        await future
+
+        waited = self.clock() - start
+        rate_limit_wait.labels(self.name, PRIORITY_NAMES[priority]).observe(waited)
+
+        return waited
+
+    async def run(self):
+        # hands out tokens one at a time, best priority first, for as long as anyone is waiting
+        while self.waiters:
+            priority, _, future = self.waiters[0]
+
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+
+            if self.take(priority):
+                heapq.heappop(self.waiters)
+                future.set_result(None)
+                continue
+
+            delay = max(self.blocked_until - self.updated, (self.floor(priority) - self.tokens) / self.rate, 0.001)
+            self.wakeup.clear()
+
+            # an interactive caller arriving mid-wait may need fewer tokens than the background one at the head
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except (asyncio.TimeoutError):
+                pass
+
+    def throttle(self, retry_after: float):
+        # a 429 means our estimate of the site's budget was wrong: stop everyone until Chargebee says otherwise
+        self.refill()
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, self.updated + retry_after)
+        rate_limit_throttled.labels(self.name).inc()
+        logger.warning('Chargebee Rate Limited | Site: %s | Retry After: %ss | Waiting: %s', self.name, retry_after, len(self.waiters))
+
+    def stats(self):
+        self.refill()
+
+        return { 'tokens': round(self.tokens, 2), 'rate_per_minute': self.rate * 60, 'burst': self.burst, 'waiting': len(self.waiters), 'blocked_for': max(0, round(self.blocked_until - self.updated, 1)) }
@@ -0,0 +1,38 @@
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+TENANTS = ( 'msgco', 'tasman' )
+
+
+@lru_cache(maxsize=64)
+def tenant_of(cb_instance: str):
+    return (cb_instance or '').removesuffix('-test')
+
+
+class EventRegistry:
+    def __init__(self, tenants: Iterable[str]=TENANTS):
+        self.tenants = set(tenants)
+        self.handlers: Dict[Tuple[str, str], Callable] = {}
+        self.ignored: Dict[Tuple[str, str], str] = {}
+
+    def register(self, event_type: str, tenants: Iterable[str]=None):
+        def decorator(handler: Callable):
+            for tenant in (tenants or self.tenants):
+                self.handlers[(tenant, event_type)] = handler
+            return handler
+
+        return decorator
+
+    def ignore(self, tenants: Iterable[str], event_types: Iterable[str], msg: str):
+        for tenant in tenants:
+            for event_type in event_types:
+                self.ignored[(tenant, event_type)] = msg
+
+    def resolve(self, cb_instance: str, event_type: str) -> Tuple[Optional[Callable], Optional[str]]:
+        key = (tenant_of(cb_instance), event_type)
+
+        return self.handlers.get(key), self.ignored.get(key)
+
+
+event_registry = EventRegistry()
@@ -0,0 +1,92 @@
+from webhooks.utils.metrics import circuit_state, circuit_transitions
+from typing import Callable, List, Optional
+import os, time, random, logging
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = { CLOSED: 0, HALF_OPEN: 1, OPEN: 2 }
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f'{ name } unavailable - circuit open, retrying in { retry_in:.0f}s')
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    # consecutive failures open the circuit; after `reset_timeout` a single trial call decides whether it closes again
+    def __init__(self, upstream: str, host: str,
+        failure_threshold: int=int(os.environ.get('MAILSERVER_CIRCUIT_FAILURES', 5)),
+        reset_timeout: float=float(os.environ.get('MAILSERVER_CIRCUIT_RESET', 30)),
+        clock=time.monotonic
+    ):
+        self.upstream = upstream
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.listeners: List[Callable] = []
+        self.gauge = circuit_state.labels(upstream, host)
+
+    def on_change(self, listener: Callable):
+        self.listeners.append(listener)
+        return listener
+
+    def transition(self, state: str):
+        previous, self.state = self.state, state
+        self.gauge.set(STATE_VALUES[state])
+        circuit_transitions.labels(self.upstream, self.host, state).inc()
+
+        log = logger.warning if state == OPEN else logger.info
+        log('Circuit Breaker | %s %s: %s -> %s | Failures: %s', self.upstream, self.host, previous, state, self.failures, extra={ 'circuit': { 'upstream': self.upstream, 'host': self.host, 'from': previous, 'to': state } })
+
+        for listener in self.listeners:
+            try:
+                listener(self, previous, state)
+            except (Exception) as e:
+                logger.warning('Circuit Breaker listener failed: %s', e)
+
+    def allow(self):
+        # raises instead of letting the call through while the upstream is known to be down
+        if self.state == OPEN:
+            retry_in = self.opened_at + self.reset_timeout - self.clock()
+            if retry_in > 0:
+                raise CircuitOpenError(f'{ self.upstream } { self.host }', retry_in)
+            self.transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self.trial:
+                raise CircuitOpenError(f'{ self.upstream } { self.host }', self.reset_timeout)
+            self.trial = True
+
+    def success(self):
+        self.failures = 0
+        self.trial = False
+        self.transition(CLOSED) if self.state != CLOSED else None
+
+    def abandon(self):
+        # a trial call that was cancelled proved nothing either way
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        self.trial = False
+
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = self.clock()
+            self.transition(OPEN)
+
+    def stats(self):
+        return { 'state': self.state, 'failures': self.failures, 'retry_in': max(0, round(self.opened_at + self.reset_timeout - self.clock(), 1)) if self.state == OPEN else None }
+
+
+def backoff(attempt: int, base: float, cap: float, rand: Optional[Callable]=None):
+    # full jitter: anywhere between 0 and the exponential step, so retries from concurrent events don't line up
+    return (rand or random.random)() * min(cap, base * 2 ** attempt)
@@ -0,0 +1,54 @@
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, Optional
+import asyncio
+
+
+class KeyedScheduler:
+    def __init__(self):
+        # only keys with queued or running work are held, so idle customers cost nothing
+        self.locks: Dict[Hashable, asyncio.Lock] = {}
+        self.depths: Dict[Hashable, int] = {}
+        self.max_depth = 0
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[Hashable]):
+        if key is None:
+            yield
+            return
+
+        lock = self.locks.get(key)
+
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+
+        self.depths[key] = self.depths.get(key, 0) + 1
+        self.max_depth = max(self.max_depth, self.depths[key])
+
+        try:
+            async with lock:
+                yield
+        finally:
+            self.depths[key] -= 1
+            if self.depths[key] == 0:
+                del self.depths[key]
+                del self.locks[key]
+
+    async def run(self, key: Optional[Hashable], func, *args, **kwargs):
+        async with self.slot(key):
+            return await func(*args, **kwargs)
+
+    def depth(self, key: Hashable):
+        return self.depths.get(key, 0)
+
+    def stats(self, top: int=10):
+        busiest = sorted(self.depths.items(), key=lambda item: item[1], reverse=True)[:top]
+
+        return {
+            'active_keys': len(self.depths),
+            'queued': sum(self.depths.values()),
+            'max_depth_seen': self.max_depth,
+            'busiest': { str(key): depth for key, depth in busiest }
+        }
+
+
+customer_scheduler = KeyedScheduler()
@@ -0,0 +1,136 @@
+from typing import Dict, Optional
+import os, json, time, base64, asyncio, logging, boto3
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_KEYS = [ 'MSGCO_API_KEY', 'MSGCO_WEBHOOK_USERNAME', 'MSGCO_WEBHOOK_PASSWORD', 'TASMAN_API_KEY', 'TASMAN_WEBHOOK_USERNAME', 'TASMAN_WEBHOOK_PASSWORD', 'MAILSERVER_URL', 'MAILSERVER_USERNAME', 'MAILSERVER_PASSWORD' ]
+
+
+class AwsSecretsBackend:
+    def __init__(self, secret_id: str=os.environ.get('SECRETS_ID', 'chargebee-secrets'), region: str=os.environ.get('SECRETS_REGION', 'ap-southeast-2')):
+        self.secret_id = secret_id
+        self.region = region
+
+    def fetch(self) -> Dict:
+        response = boto3.Session().client('secretsmanager', region_name=self.region).get_secret_value(SecretId=self.secret_id)
+
+        return json.loads(response['SecretString'])
+
+
+class FileSecretsBackend:
+    # a JSON object with the same keys as the Secrets Manager secret
+    def __init__(self, path: str=os.environ.get('SECRETS_PATH', 'secrets.json')):
+        self.path = path
+
+    def fetch(self) -> Dict:
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class EnvSecretsBackend:
+    def fetch(self) -> Dict:
+        missing = [ key for key in SECRET_KEYS if key not in os.environ ]
+
+        if missing:
+            raise KeyError(f"Missing secrets in environment: { ', '.join(missing) }")
+
+        return { key: os.environ[key] for key in SECRET_KEYS }
+
+
+BACKENDS = { 'aws': AwsSecretsBackend, 'file': FileSecretsBackend, 'env': EnvSecretsBackend }
+
+
+def build_secrets(cb_secrets: Dict) -> Dict:
+    return {
+        'msgco': {
+            'api_key': cb_secrets.get("MSGCO_API_KEY"),
+            'wh_username': cb_secrets.get('MSGCO_WEBHOOK_USERNAME'),
+            'wh_password': cb_secrets.get('MSGCO_WEBHOOK_PASSWORD')
+        },
+        'tasman': {
+            'api_key': cb_secrets.get("TASMAN_API_KEY"),
+            'wh_username': cb_secrets.get('TASMAN_WEBHOOK_USERNAME'),
+            'wh_password': cb_secrets.get('TASMAN_WEBHOOK_PASSWORD')
+        },
+        'mailserver': {
+            'api_url': cb_secrets.get('MAILSERVER_URL').replace('[platform]', 'pc5'),
+            'username': cb_secrets.get('MAILSERVER_USERNAME'),
+            'password': cb_secrets.get('MAILSERVER_PASSWORD')
+        }
+    }
+
+def basic_authorization(username: Optional[str], password: Optional[str]):
+    return f"Basic { base64.b64encode(f'{ username }:{ password }'.encode('utf-8')).decode('utf-8') }"
+
+def merge_tenant(secrets: Dict, tenant: str) -> Optional[Dict]:
+    cb_secrets = secrets.get(tenant)
+
+    if cb_secrets is None:
+        return None
+
+    merged = { **cb_secrets, **secrets.get('mailserver', {}) }
+    merged['wh_authorization'] = basic_authorization(cb_secrets.get('wh_username'), cb_secrets.get('wh_password'))
+
+    return merged
+
+
+class SecretsProvider:
+    def __init__(self, backend=None, ttl: float=float(os.environ.get('SECRETS_TTL', 300)), retry: float=float(os.environ.get('SECRETS_RETRY', 30))):
+        self.backend = backend or BACKENDS.get(os.environ.get('SECRETS_BACKEND', 'aws'), AwsSecretsBackend)()
+        self.ttl = ttl
+        self.retry = retry
+        self.secrets: Dict = {}
+        self.tenants: Dict[str, Dict] = {}
+        self.loaded_at: Optional[float] = None
+        self.failures = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def load(self):
+        secrets = build_secrets(self.backend.fetch())
+        tenants = { tenant: merge_tenant(secrets, tenant) for tenant in secrets if tenant != 'mailserver' }
+
+        # swap whole snapshots so a request never sees half of a rotation
+        self.secrets, self.tenants, self.loaded_at = secrets, tenants, time.monotonic()
+        self.failures = 0
+
+    async def refresh(self):
+        try:
+            await asyncio.to_thread(self.load)
+            logger.info('Secrets refreshed | Tenants: %s', ', '.join(self.tenants))
+        except (Exception) as e:
+            # stale-while-revalidate: keep serving the last good snapshot and retry sooner
+            self.failures += 1
+            logger.warning('Secrets refresh failed (%s), serving values from %ss ago: %s', self.failures, self.age(), e)
+            if self.loaded_at is None:
+                raise
+
+    async def start(self):
+        await self.refresh()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.ttl if self.failures == 0 else self.retry)
+            await self.refresh()
+
+    def age(self):
+        return round(time.monotonic() - self.loaded_at) if self.loaded_at is not None else None
+
+    def tenant(self, cb_instance: str) -> Optional[Dict]:
+        return self.tenants.get(cb_instance.removesuffix('-test'))
+
+    def get(self, key: str, default=None):
+        return self.secrets.get(key, default)
+
+    def stats(self):
+        return { 'backend': type(self.backend).__name__, 'tenants': list(self.tenants), 'age': self.age(), 'ttl': self.ttl, 'failures': self.failures }
+
+
+secrets_provider = SecretsProvider()
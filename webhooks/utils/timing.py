@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import time
+
+
+class RequestTimer:
+    def __init__(self, event_type: str=None, tenant: str=None):
+        # wall clock for display only, every duration comes from perf_counter
+        self.event_type = event_type
+        self.tenant = tenant
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def mark(self, name: str):
+        # a phase that runs from the start of the request up to now, e.g. body parsing before the endpoint is entered
+        if name not in self.phases:
+            self.add(name, time.perf_counter() - self.start)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def duration(self):
+        elapsed = self.elapsed()
+        hours, remainder = divmod(int(elapsed), 3600)
+        minutes, seconds = divmod(remainder, 60)
+
+        return f'{ hours }h { minutes }m { seconds }s' if hours > 0 else f'{ minutes }m { seconds }s' if minutes > 0 else f'{ elapsed:.3f} secs'
+
+    def timings(self):
+        return { **{ name: round(seconds * 1000, 3) for name, seconds in self.phases.items() }, 'total': round(self.elapsed() * 1000, 3) }
+
+    def server_timing(self):
+        entries = [ f'{ name };dur={ seconds * 1000:.3f}' + (f';desc="{ self.counts[name] } calls"' if self.counts[name] > 1 else '') for name, seconds in self.phases.items() ]
+
+        return ', '.join(entries + [ f'total;dur={ self.elapsed() * 1000:.3f}' ])
+
+
+request_timer: ContextVar[Optional[RequestTimer]] = ContextVar('request_timer', default=None)
+
+
+@contextmanager
+def request_scope(event_type: str=None):
+    request = RequestTimer(event_type)
+    token = request_timer.set(request)
+
+    try:
+        yield request
+    finally:
+        request_timer.reset(token)
+
+
+@contextmanager
+def timed(name: str):
+    request = request_timer.get()
+
+    if request is None:
+        yield
+        return
+
+    with request.phase(name):
+        yield
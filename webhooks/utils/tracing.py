@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional
+import os, sys, json, time, random, inspect, threading, logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ( 'trace_id', 'span_id', 'parent_id', 'name', 'start', 'started_at', 'duration', 'attributes', 'status', 'error' )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = f'{ random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.status = 'ok'
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes
+        }
+
+
+class UnsampledSpan:
+    # stands in for every span of a trace that lost the sampling roll, so children are dropped too
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+
+UNSAMPLED = UnsampledSpan()
+
+
+class StdoutExporter:
+    def export(self, span: Span):
+        sys.stdout.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+    def close(self):
+        sys.stdout.flush()
+
+
+class JsonlFileExporter:
+    def __init__(self, path: str=os.environ.get('TRACE_PATH', 'traces.jsonl')):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', buffering=1)
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+EXPORTERS = { 'stdout': StdoutExporter, 'file': JsonlFileExporter }
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate: float=float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+    def configure(self, exporter: str=os.environ.get('TRACE_EXPORTER', 'none')):
+        exporter_class = EXPORTERS.get(exporter)
+        self.exporter = exporter_class() if exporter_class is not None else None
+        logger.info('Tracing Exporter: %s | Sample Rate: %s', exporter, self.sample_rate) if self.exporter is not None else None
+
+    def close(self):
+        self.exporter.close() if self.exporter is not None else None
+
+    def current_span(self):
+        return self.current.get() or UNSAMPLED
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if self.exporter is None:
+            yield UNSAMPLED
+            return
+
+        parent = self.current.get()
+
+        if parent is UNSAMPLED or (parent is None and random.random() >= self.sample_rate):
+            token = self.current.set(UNSAMPLED)
+            try:
+                yield UNSAMPLED
+            finally:
+                self.current.reset(token)
+            return
+
+        span = Span(name, parent.trace_id if parent is not None else f'{ random.getrandbits(128):032x}', parent.span_id if parent is not None else None, attributes)
+        token = self.current.set(span)
+
+        try:
+            yield span
+        except (BaseException) as e:
+            span.status = 'error'
+            span.error = f'{ type(e).__name__ }: { getattr(e, 'detail', e) }'
+            if hasattr(e, 'status_code'):
+                span.attributes.setdefault('status_code', e.status_code)
+            raise
+        finally:
+            self.current.reset(token)
+            span.duration = time.perf_counter() - span.start
+            try:
+                self.exporter.export(span)
+            except (Exception) as e:
+                logger.warning('Trace export failed: %s', e)
+
+    def traced(self, name: str=None):
+        def decorator(func):
+            span_name = name or func.__name__
+
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+tracer = Tracer()
+traced = tracer.traced
@@ -0,0 +1,96 @@
+from webhooks.utils.cache import TTLCache
+from datetime import datetime, timezone
+from typing import Optional
+import os, time, sqlite3, threading
+
+
+def aware(version: datetime):
+    # versions read back from the database are UTC-aware, so compare like with like
+    return version if version.tzinfo else version.replace(tzinfo=timezone.utc)
+
+
+class VersionIndex:
+    def __init__(self,
+        maxsize: int=int(os.environ.get('VERSION_INDEX_SIZE', 100000)),
+        ttl: float=float(os.environ.get('VERSION_INDEX_TTL', 7 * 24 * 3600)),
+        path: Optional[str]=os.environ.get('VERSION_INDEX_PATH')
+    ):
+        self.ttl = ttl
+        self.path = path
+        self.versions = TTLCache(maxsize, ttl)
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+        self.dropped = 0
+
+    def open(self):
+        # in memory only unless VERSION_INDEX_PATH is set; persisted, a separate process (the replay command) checks against
+        # what the server has already applied, at the cost of a SQLite write per newer version on the event loop
+        if not self.path or self.conn is not None:
+            return self
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS versions (kind TEXT NOT NULL, key TEXT NOT NULL, version REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (kind, key))')
+        self.conn.execute('DELETE FROM versions WHERE updated_at < ?', (time.time() - self.ttl,))
+
+        return self
+
+    def close(self):
+        conn, self.conn = self.conn, None
+
+        if conn is not None:
+            conn.close()
+
+    def current(self, kind: str, key: str):
+        current = self.versions.peek((kind, key))
+
+        if current is not None or self.conn is None:
+            return current
+
+        with self.lock:
+            row = self.conn.execute('SELECT version FROM versions WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+
+        if row is None:
+            return None
+
+        current = datetime.fromtimestamp(row[0], timezone.utc)
+        self.versions.set((kind, key), current)
+
+        return current
+
+    def is_stale(self, kind: str, key: str, version: Optional[datetime]):
+        # strictly older only: several events legitimately carry the same resource version
+        if version is None:
+            return False
+
+        version = aware(version)
+        current = self.current(kind, key)
+
+        return current is not None and version < current
+
+    def record(self, kind: str, key: str, version: Optional[datetime]):
+        if version is None:
+            return
+
+        version = aware(version)
+        current = self.current(kind, key)
+
+        if current is not None and version < current:
+            return
+
+        self.versions.set((kind, key), version)
+
+        if self.conn is not None and version != current:
+            with self.lock:
+                self.conn.execute(
+                    'INSERT INTO versions (kind, key, version, updated_at) VALUES (?, ?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET version = MAX(version, excluded.version), updated_at = excluded.updated_at',
+                    (kind, key, version.timestamp(), time.time())
+                )
+
+    def stats(self):
+        return { **self.versions.stats(), 'dropped': self.dropped, 'persisted': self.conn is not None }
+
+
+version_index = VersionIndex()